@@ -0,0 +1,66 @@
+"""Benchmark parameter batches against one simulation per parameter set.
+
+Advances the same number of puma and hare parameter sets on the bundled
+landscapes one PopulationState per parameter set and all together in
+a ParameterBatch, and reports parameter set steps per second.
+
+Usage: python benchmarks/bench_batch.py [<sets>] [<steps>]
+"""
+
+from __future__ import (absolute_import,
+                        division,
+                        print_function,
+                        unicode_literals)
+import os
+import sys
+import time
+import numpy as np
+import pumha
+from pumha.env import Landscape
+from pumha.pop import PumaPopulation, HarePopulation
+from pumha.state import PopulationState
+from pumha.ensemble import ParameterBatch
+
+MAPS = ('islands2.dat', 'map1.dat', 'islands.dat')
+
+
+def time_singles(land, births, steps):
+    """Return parameter set steps per second of separate simulations."""
+    states = [PopulationState([PumaPopulation(land),
+                               HarePopulation(land, birth=birth)])
+              for birth in births]
+    start = time.time()
+    for _ in range(steps):
+        for state in states:
+            state.step()
+    return len(births) * steps / (time.time() - start)
+
+
+def time_batch(land, births, steps):
+    """Return parameter set steps per second of a parameter batch."""
+    batch = ParameterBatch(PumaPopulation(land), HarePopulation(land),
+                           {'Hare_birth': births})
+    start = time.time()
+    for _ in range(steps):
+        batch.step()
+    return len(births) * steps / (time.time() - start)
+
+
+def main():
+    sets = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    steps = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    births = np.linspace(.06, .1, sets).tolist()
+    data_dir = os.path.join(os.path.dirname(pumha.__file__), 'data')
+    print('\nParameter set steps/s of %d parameter sets' % sets)
+    print('%-14s %11s %10s %10s %8s' % ('landscape', 'shape', 'single',
+                                        'batch', 'speedup'))
+    for name in MAPS:
+        land = Landscape(os.path.join(data_dir, name))
+        single = time_singles(land, births, steps)
+        batch = time_batch(land, births, steps)
+        print('%-14s %11s %10.0f %10.0f %8.2f' %
+              (name, '%dx%d' % land.shape, single, batch, batch / single))
+
+
+if __name__ == '__main__':
+    main()
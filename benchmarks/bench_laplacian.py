@@ -0,0 +1,65 @@
+"""Benchmark diffusion term of the puma update on the bundled landscapes.
+
+Compares the time of one puma density update using the per-square loop,
+the vectorized grid update, the gather based land vector update, the
+sparse Laplacian update and the vectorized update on a pool of threads.
+
+Usage: python benchmarks/bench_laplacian.py [<repeats>]
+"""
+
+from __future__ import (absolute_import,
+                        division,
+                        print_function,
+                        unicode_literals)
+import os
+import sys
+import time
+import numpy as np
+import pumha
+from pumha.env import Landscape
+from pumha.pop import PumaPopulation, HarePopulation
+
+MAPS = ('islands2.dat', 'map1.dat', 'islands.dat')
+
+
+def time_engine(land, engine, P, H, repeats):
+    """Return mean time in seconds of one puma update using engine."""
+    puma = PumaPopulation(land, engine=engine)
+    if engine in ('land', 'sparse'):
+        P = land.to_land_vector(P)
+        H = land.to_land_vector(H)
+        # build the cached Laplacian outside of the timed loop
+        land.laplacian()
+    out = np.copy(P)
+    if engine == 'threads':
+        # allocate the reused temporaries outside of the timed loop
+        puma.advance(P, H, out)
+    start = time.time()
+    for _ in range(repeats):
+        puma.advance(P, H, out)
+    return (time.time() - start) / repeats
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    data_dir = os.path.join(os.path.dirname(pumha.__file__), 'data')
+    results = []
+    for name in MAPS:
+        land = Landscape(os.path.join(data_dir, name))
+        P = PumaPopulation(land).density
+        H = HarePopulation(land).density
+        times = [time_engine(land, 'loop', P, H, 1)]
+        times += [time_engine(land, engine, P, H, repeats)
+                  for engine in ('vector', 'land', 'sparse', 'threads')]
+        results.append((name, land.neighbour_table.shape[1], times))
+
+    print('\n%-14s %8s %12s %12s %12s %12s %12s' %
+          ('landscape', 'land', 'loop [s]', 'vector [s]', 'land [s]',
+           'sparse [s]', 'threads [s]'))
+    for name, num_land, times in results:
+        print('%-14s %8d %12.2e %12.2e %12.2e %12.2e %12.2e' %
+              ((name, num_land) + tuple(times)))
+
+
+if __name__ == '__main__':
+    main()
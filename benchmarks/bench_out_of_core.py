@@ -0,0 +1,94 @@
+"""Benchmark out-of-core simulation against in-memory simulation.
+
+Runs puma and hare updates with the packed engine on a random square
+landscape, once with densities in memory and once with densities in
+memory-mapped scratch files for several band heights. For every mode it
+reports throughput in millions of squares updated per second and the peak
+of memory allocated by numpy during a step, which is bounded by the band
+height for out-of-core runs. Pages of memory-mapped files are not
+included, they are managed by the operating system like any file cache.
+
+Usage: python benchmarks/bench_out_of_core.py [<size> [<steps>]]
+"""
+
+from __future__ import (absolute_import,
+                        division,
+                        print_function,
+                        unicode_literals)
+import os
+import sys
+import time
+import shutil
+import tempfile
+import tracemalloc
+import numpy as np
+from pumha.env import Landscape
+from pumha.pop import PumaPopulation, HarePopulation
+from pumha.state import PopulationState
+
+BAND_ROWS = (16, 64, 256, 1024)
+
+
+def write_landscape(filename, size):
+    """Write a random landscape of size by size squares, 70% land."""
+    land = (np.random.random((size, size)) < .7).astype(int)
+    with open(filename, 'w') as out:
+        out.write('%d %d\n' % (size, size))
+        np.savetxt(out, land, fmt='%d')
+
+
+def step(pops, state):
+    """Advance all populations by one time step."""
+    P = state.current(PumaPopulation)
+    H = state.current(HarePopulation)
+    for pop in pops:
+        pop.advance(P, H, state.next(pop))
+    state.swap()
+
+
+def time_mode(land, steps, band_rows, scratch_dir):
+    """Return squares per second and peak numpy memory of one step."""
+    pops = [PumaPopulation(land, engine='packed', scratch_dir=scratch_dir),
+            HarePopulation(land, engine='packed', scratch_dir=scratch_dir)]
+    for pop in pops:
+        pop.tile_rows = band_rows
+    state = PopulationState(pops)
+    start = time.time()
+    for _ in range(steps):
+        step(pops, state)
+    elapsed = time.time() - start
+
+    tracemalloc.start()
+    step(pops, state)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return land.shape[0] * land.shape[1] * steps / elapsed, peak
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    steps = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        land_file = os.path.join(tmp_dir, 'land.dat')
+        write_landscape(land_file, size)
+        land = Landscape(land_file, cache=False, packed=True)
+        results = [('memory', 256) + time_mode(land, steps, 256, None)]
+        for band_rows in BAND_ROWS:
+            results.append(('scratch', band_rows) +
+                           time_mode(land, steps, band_rows, tmp_dir))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    grid_mb = land.shape[0] * land.shape[1] * 8 / 1e6
+    print('\nlandscape %d x %d, one density grid %.1f MB' %
+          (size, size, grid_mb))
+    print('%-10s %10s %14s %16s' %
+          ('mode', 'band rows', 'Msquares/s', 'step peak [MB]'))
+    for mode, band_rows, rate, peak in results:
+        print('%-10s %10d %14.1f %16.1f' %
+              (mode, band_rows, rate / 1e6, peak / 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""Benchmark scaling of the parallel update with the number of workers.
+
+Runs puma and hare updates of a landscape in a SharedState with 1, 2, 4,
+... workers up to the number of CPUs and reports steps per second and the
+speedup over a single worker.
+
+Usage: python benchmarks/bench_parallel.py [<landscape_file> [<steps>]]
+"""
+
+from __future__ import (absolute_import,
+                        division,
+                        print_function,
+                        unicode_literals)
+import os
+import sys
+import time
+import multiprocessing
+import pumha
+from pumha.env import Landscape
+from pumha.pop import PumaPopulation, HarePopulation
+from pumha.parallel import SharedState
+
+
+def time_workers(land, num_workers, steps):
+    """Return steps per second of a SharedState with num_workers workers."""
+    pops = [PumaPopulation(land), HarePopulation(land)]
+    with SharedState(pops, num_workers) as state:
+        # first step includes start up of the workers
+        state.step()
+        start = time.time()
+        for _ in range(steps):
+            state.step()
+        return steps / (time.time() - start)
+
+
+def main():
+    data_dir = os.path.join(os.path.dirname(pumha.__file__), 'data')
+    map_file = (sys.argv[1] if len(sys.argv) > 1
+                else os.path.join(data_dir, 'islands.dat'))
+    steps = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    land = Landscape(map_file)
+    workers = [1]
+    while workers[-1] * 2 <= multiprocessing.cpu_count():
+        workers.append(workers[-1] * 2)
+    rates = [time_workers(land, n, steps) for n in workers]
+
+    print('\n%s, %d x %d' % ((os.path.basename(map_file),) + land.shape))
+    print('%8s %12s %10s' % ('workers', 'steps/s', 'speedup'))
+    for n, rate in zip(workers, rates):
+        print('%8d %12.1f %10.2f' % (n, rate, rate / rates[0]))
+
+
+if __name__ == '__main__':
+    main()
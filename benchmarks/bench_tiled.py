@@ -0,0 +1,66 @@
+"""Benchmark the tiled update against the vector update.
+
+Runs puma and hare updates of the bundled landscapes with the vector engine
+in a PopulationState and with the tiled engine in a TiledState for several
+numbers of steps per pass, and reports millions of squares updated per
+second.
+
+Usage: python benchmarks/bench_tiled.py [<steps>]
+"""
+
+from __future__ import (absolute_import,
+                        division,
+                        print_function,
+                        unicode_literals)
+import os
+import sys
+import time
+import pumha
+from pumha.env import Landscape
+from pumha.pop import PumaPopulation, HarePopulation
+from pumha.state import PopulationState
+from pumha.tiled import TiledState
+
+MAPS = ('islands2.dat', 'map1.dat', 'islands.dat')
+DEPTHS = (1, 2, 4, 8)
+
+
+def time_state(land, steps, depth=None):
+    """Return squares per second of a state, tiled unless depth is None."""
+    engine = 'vector' if depth is None else 'tiled'
+    pops = [PumaPopulation(land, engine=engine),
+            HarePopulation(land, engine=engine)]
+    if depth is None:
+        state = PopulationState(pops)
+    else:
+        state = TiledState(pops, depth)
+    # first pass allocates the workspace
+    state.step()
+    state.sync()
+    start = time.time()
+    for _ in range(steps):
+        state.step()
+    state.sync()
+    return land.shape[0] * land.shape[1] * steps / (time.time() - start)
+
+
+def main():
+    steps = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    data_dir = os.path.join(os.path.dirname(pumha.__file__), 'data')
+    results = []
+    for name in MAPS:
+        land = Landscape(os.path.join(data_dir, name))
+        rates = [time_state(land, steps)]
+        rates += [time_state(land, steps, depth) for depth in DEPTHS]
+        results.append((name, land.shape, rates))
+
+    print('\nMsquares/s, tiled columns by steps per pass')
+    print('%-14s %11s %10s' % ('landscape', 'shape', 'vector') +
+          ''.join('%10s' % ('tiled %d' % depth) for depth in DEPTHS))
+    for name, shape, rates in results:
+        print('%-14s %11s' % (name, '%dx%d' % shape) +
+              ''.join('%10.1f' % (rate / 1e6) for rate in rates))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+"""Adaptive time stepping module.
+
+The module contains one class::
+
+    StepController
+
+and one function::
+
+    stability_limit
+
+The StepController advances a PopulationState with a time step chosen
+from an embedded error estimate. Every step is taken twice, once with the
+forward Euler method and once with the second order Heun method. The
+difference of both results estimates the error of the step, which is used
+to accept or reject the step and to choose the next time step. The time
+step is also kept below the stability limit of the explicit diffusion
+scheme.
+"""
+
+from __future__ import (absolute_import,
+                        division,
+                        print_function,
+                        unicode_literals)
+import numpy as np
+from pumha.pop import PumaPopulation, HarePopulation
+
+
+class StepController(object):
+    """Advance population state with adaptive time steps.
+
+    Heun step is written using the forward Euler update E of the
+    populations only::
+
+        Y1 = E(Y)                       (forward Euler)
+        Y2 = (Y + E(Y1)) / 2            (Heun)
+
+    so any explicit engine of the populations can be used. The error of
+    a step is the largest difference between Y1 and Y2 relative to
+    tolerance * max(1, max|Y2|). A step is accepted if the error is at
+    most 1 and the more accurate Heun result is kept. The next time step
+    is the current one scaled by safety / sqrt(error), limited by
+    min_factor and max_factor.
+
+    :Example:
+
+        >>> state = PopulationState([puma, hare])
+        >>> controller = StepController(state, tolerance=1e-3, dt=.4)
+        >>> t = controller.advance(0., 10.)
+
+    :ivar dt: proposed length of the next step
+    :vartype dt: float
+    :ivar dt_max: stability limit of the time step
+    :vartype dt_max: float
+    :ivar tolerance: relative tolerance of a single step
+    :vartype tolerance: float
+    :ivar accepted: number of accepted steps
+    :vartype accepted: int
+    :ivar rejected: number of rejected steps
+    :vartype rejected: int
+    :raises ValueError: if populations use the imex engine
+    """
+
+    def __init__(self, state, tolerance=1e-3, dt=None, safety=.9,
+                 min_factor=.2, max_factor=5.):
+        for pop in state.populations:
+            if pop.engine == 'imex':
+                raise ValueError("Adaptive time stepping requires an "
+                                 "explicit engine, not %s" % pop.engine)
+        self.state = state
+        self.tolerance = tolerance
+        self.safety = safety
+        self.min_factor = min_factor
+        self.max_factor = max_factor
+        self.dt_max = stability_limit(state.populations)
+        if dt is None:
+            dt = min(pop.dt for pop in state.populations)
+        self.dt = min(dt, self.dt_max)
+        self.accepted = 0
+        self.rejected = 0
+        # Heun results, allocated once
+        self._heun = [np.copy(state.next(pop)) for pop in state.populations]
+
+    def advance(self, t, t_stop):
+        """Take one accepted step from time t without going past t_stop.
+
+        Rejected steps are repeated with a shorter time step. If the step is
+        shortened to land on t_stop, the proposed time step is kept for the
+        following steps.
+
+        :param t: current simulated time
+        :type t: float
+        :param t_stop: simulated time which must not be passed
+        :type t_stop: float
+        :return: simulated time after the step
+        :rtype: float
+        :raises RuntimeError: if the time step underflows
+        """
+        while True:
+            truncated = self.dt >= t_stop - t
+            dt = t_stop - t if truncated else self.dt
+            if dt <= 1e-12 * max(1., abs(t)):
+                raise RuntimeError("Time step underflow at t=%s" % t)
+            error = self._try_step(dt)
+            if error > 0:
+                factor = self.safety / np.sqrt(error)
+                factor = min(self.max_factor, max(self.min_factor, factor))
+            else:
+                factor = self.max_factor
+            if error <= 1.:
+                self.accepted += 1
+                self.state.swap()
+                if not truncated:
+                    self.dt = min(dt * factor, self.dt_max)
+                return t_stop if truncated else t + dt
+            self.rejected += 1
+            self.dt = dt * factor
+
+    def _try_step(self, dt):
+        """Write Heun step into next buffers and return its error estimate."""
+        state = self.state
+        pops = state.populations
+        for pop in pops:
+            pop.dt = dt
+
+        # forward Euler step into next buffers
+        P = state.current(PumaPopulation)
+        H = state.current(HarePopulation)
+        for pop in pops:
+            pop.advance(P, H, state.next(pop))
+        euler = [state.next(pop) for pop in pops]
+
+        # second Euler step from Euler result, averaged with initial state
+        P = self._find(euler, PumaPopulation)
+        H = self._find(euler, HarePopulation)
+        for pop, out in zip(pops, self._heun):
+            pop.advance(P, H, out)
+
+        error = 0.
+        for pop, y1, y2 in zip(pops, euler, self._heun):
+            y2 += state.current(type(pop))
+            y2 *= .5
+            scale = self.tolerance * max(1., np.amax(y2))
+            error = max(error, np.amax(np.abs(y2 - y1)) / scale)
+            y1[...] = y2
+        return error
+
+    def _find(self, arrays, pop_class):
+        """Return array of the first population of pop_class from arrays.
+
+        Missing populations get the array of zeros from the state.
+        """
+        for pop, arr in zip(self.state.populations, arrays):
+            if isinstance(pop, pop_class):
+                return arr
+        return self.state.current(pop_class)
+
+
+def stability_limit(populations):
+    """Return the largest stable time step of the explicit diffusion scheme.
+
+    Eigenvalues of the discrete Laplacian lie between -2*max(N) and 0, where
+    N is the number of dry squares around a square, so forward Euler is
+    stable for::
+
+        dt <= 1 / (diffusion * max(N))
+
+    which is 1/(4*diffusion) for landscapes with a land square surrounded
+    by land.
+
+    :param populations: list of populations in a simulation
+    :type populations: list of pumha.pop.Population types
+    :return: stability limit of the time step (inf without diffusion)
+    :rtype: float
+    """
+    limit = np.inf
+    for pop in populations:
+        rate = pop.diffusion * np.amax(pop._env.neighbour_counts)
+        if rate > 0:
+            limit = min(limit, 1. / rate)
+    return limit
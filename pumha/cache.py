@@ -0,0 +1,240 @@
+"""Cache module.
+
+The module contains one class::
+
+    ResultCache
+
+and one function::
+
+    simulation_key
+
+A ResultCache keeps the output files and final densities of completed
+simulations in a local directory, so a simulation which was run before is
+not computed again. Entries are content addressed: the key of a simulation
+is a SHA-256 hash of the landscape, the initial densities, seeds and
+parameters of its populations, its output settings and the versions of
+the engines, and every entry is stored under its key and number of steps.
+A longer simulation with the same key continues from the final densities
+of the longest entry it extends instead of starting from the beginning.
+The cache is bounded in size, removing least recently used entries first.
+"""
+
+from __future__ import (absolute_import,
+                        division,
+                        print_function,
+                        unicode_literals)
+import os
+import shutil
+import hashlib
+import numpy as np
+import simplejson as json
+from pumha.checkpoint import landscape_hash
+
+# version of the numerics of the update engines, to be increased whenever
+# an engine gives different results, so older entries are not used
+ENGINE_VERSION = 1
+# size limit of a cache in bytes
+DEFAULT_CACHE_BYTES = 1 << 30
+# file of an entry holding final densities and the highest output density
+STATE_FILE = 'state.npz'
+# directory of an entry holding the output files
+OUTPUT_DIR = 'output'
+
+
+def simulation_key(populations, options):
+    """Return the key of a simulation of populations.
+
+    :param populations: populations of the simulation with their initial \
+            densities
+    :type populations: list of pumha.pop.Population types
+    :param options: other values on which output of the simulation \
+            depends, e.g. the output interval
+    :type options: dict
+    :return: hexadecimal SHA-256 digest
+    :rtype: string
+    """
+    digest = hashlib.sha256()
+    described = []
+    for pop in populations:
+        values = [type(pop).__name__, pop.kind, pop.engine, pop.min_ro,
+                  pop.max_ro, pop.birth, pop.death, pop.diffusion, pop.dt]
+        seed = getattr(pop, 'seed', None)
+        if seed is not None:
+            values.append([np.asarray(seed.entropy).tolist(),
+                           list(seed.spawn_key)])
+        community = getattr(pop, 'community', None)
+        if community is not None:
+            values.append(community.interactions[pop.index].tolist())
+        described.append(values)
+        # hashed in bands, so out-of-core densities are not loaded at once
+        for start in range(0, pop.density.shape[0], pop.tile_rows):
+            band = pop.density[start:start + pop.tile_rows]
+            digest.update(np.ascontiguousarray(band).tobytes())
+    header = {
+        'engine_version': ENGINE_VERSION,
+        'numpy': np.__version__,
+        'landscape': landscape_hash(populations[0]._env),
+        'populations': described,
+        'options': options,
+    }
+    digest.update(json.dumps(header, sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ResultCache(object):
+    """Size bounded cache of simulation results on disk.
+
+    Every entry is a directory named by the key of a simulation and its
+    number of steps, holding STATE_FILE and the output files in
+    OUTPUT_DIR. Entries are written to a temporary directory first and
+    then renamed, so other processes never see a partial entry. The
+    modification time of an entry is its last use, and the least recently
+    used entries are removed when the cache grows beyond max_bytes.
+    A cache which can not be written is skipped.
+
+    :Example:
+
+        >>> sim.cache = ResultCache(max_bytes=1 << 28)
+        >>> sim.run(500, 4)
+
+    :ivar directory: directory of the cache
+    :vartype directory: string
+    :ivar max_bytes: size limit of the cache in bytes
+    :vartype max_bytes: int
+    """
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_CACHE_BYTES):
+        if directory is None:
+            directory = os.path.join(os.path.expanduser('~'), '.cache',
+                                     'pumha')
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def lookup(self, key, num_steps):
+        """Return the longest entry of a key with at most num_steps steps.
+
+        The entry is marked as used.
+
+        :param key: key of the simulation, see simulation_key()
+        :type key: string
+        :param num_steps: number of steps of the simulation
+        :type num_steps: int
+        :return: number of steps and directory of the entry, or None if \
+                there is no such entry
+        :rtype: (int, string)
+        """
+        best = None
+        for name in self._entry_names():
+            entry_key, steps = name.rsplit('-', 1)
+            steps = int(steps)
+            if (entry_key == key and steps <= num_steps and
+                    (best is None or steps > best[0])):
+                best = (steps, os.path.join(self.directory, name))
+        if best is not None:
+            try:
+                os.utime(best[1], None)
+            except OSError:
+                return None
+        return best
+
+    def load(self, entry, out_dir, rename=None):
+        """Copy output files of an entry to out_dir and return its state.
+
+        :param entry: directory of the entry
+        :type entry: string
+        :param out_dir: output directory of the simulation
+        :type out_dir: string
+        :param rename: function returning the name of a copied file from \
+                its name in the entry, names are kept if None
+        :type rename: callable
+        :return: final densities keyed by population kind and the highest \
+                density written to output
+        :rtype: (dict, float)
+        """
+        output = os.path.join(entry, OUTPUT_DIR)
+        for name in os.listdir(output):
+            target = name if rename is None else rename(name)
+            shutil.copy2(os.path.join(output, name),
+                         os.path.join(out_dir, target))
+        with np.load(os.path.join(entry, STATE_FILE)) as data:
+            densities = dict((key[len('density_'):], data[key])
+                             for key in data.files
+                             if key.startswith('density_'))
+            max_density = float(data['max_density'])
+        return densities, max_density
+
+    def store(self, key, num_steps, out_dir, densities, max_density):
+        """Add the results of a completed simulation to the cache.
+
+        Output files are copied from out_dir, apart from checkpoints.
+        Least recently used entries are removed afterwards if the cache is
+        larger than max_bytes.
+
+        :param key: key of the simulation, see simulation_key()
+        :type key: string
+        :param num_steps: number of steps of the simulation
+        :type num_steps: int
+        :param out_dir: output directory of the simulation
+        :type out_dir: string
+        :param densities: final densities keyed by population kind
+        :type densities: dict
+        :param max_density: the highest density written to output
+        :type max_density: float
+        """
+        entry = os.path.join(self.directory, '%s-%d' % (key, num_steps))
+        tmp_entry = '%s.tmp%d' % (entry, os.getpid())
+        try:
+            os.makedirs(os.path.join(tmp_entry, OUTPUT_DIR))
+            for name in os.listdir(out_dir):
+                path = os.path.join(out_dir, name)
+                if os.path.isfile(path) and not name.startswith('checkpoint'):
+                    shutil.copy2(path, os.path.join(tmp_entry, OUTPUT_DIR))
+            arrays = dict(('density_' + kind, density)
+                          for kind, density in densities.items())
+            np.savez(os.path.join(tmp_entry, STATE_FILE),
+                     max_density=np.array(max_density), **arrays)
+            if os.path.exists(entry):
+                shutil.rmtree(tmp_entry)
+            else:
+                os.rename(tmp_entry, entry)
+        except (IOError, OSError):
+            print('Result cache could not be written.')
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+            return
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until max_bytes is not exceeded.
+        """
+        entries = []
+        for name in self._entry_names():
+            entry = os.path.join(self.directory, name)
+            try:
+                entries.append((os.path.getmtime(entry), _tree_size(entry),
+                                entry))
+            except OSError:  # removed by another process
+                continue
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+    def _entry_names(self):
+        """Return names of complete entries in the cache directory."""
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        return [name for name in names
+                if '.tmp' not in name and '-' in name]
+
+
+def _tree_size(directory):
+    """Return the total size of files in a directory tree in bytes."""
+    size = 0
+    for root, _, files in os.walk(directory):
+        size += sum(os.path.getsize(os.path.join(root, name))
+                    for name in files)
+    return size
@@ -0,0 +1,147 @@
+"""Checkpoint module.
+
+The module contains three functions::
+
+    save_checkpoint
+    load_checkpoint
+    landscape_hash
+
+A checkpoint holds everything needed to continue a simulation exactly
+where it stopped: densities of all populations, the number of completed
+steps, simulated time, state of the random number generator, the
+configuration, a hash of the landscape and the state of the output files:
+the fixed point scale of PPM files and the index of the snapshot store. Checkpoints are numpy .npz
+files, written to a temporary file first and then renamed, so a crash
+while writing never leaves a broken checkpoint behind.
+"""
+
+from __future__ import (absolute_import,
+                        division,
+                        print_function,
+                        unicode_literals)
+import os
+import hashlib
+import numpy as np
+import simplejson as json
+from pumha.ppm import PPM_SCALE
+
+
+def save_checkpoint(filename, step, time, densities, config, landscape,
+                    max_density=0., average_bytes=0, ppm_scale=PPM_SCALE,
+                    snapshot_file=None, snapshot_index=None):
+    """Atomically write a checkpoint file.
+
+    :param filename: name of the checkpoint file
+    :type filename: string
+    :param step: number of completed steps
+    :type step: int
+    :param time: simulated time
+    :type time: float
+    :param densities: density grids of populations keyed by population kind
+    :type densities: dict
+    :param config: configuration values as loaded from a config file
+    :type config: dict
+    :param landscape: landscape of the simulation
+    :type landscape: pumha.env.Landscape
+    :param max_density: the highest density written to output so far
+    :type max_density: float
+    :param average_bytes: size of average_densities.dat at the checkpoint
+    :type average_bytes: int
+    :param ppm_scale: fixed point scale of densities in PPM files
+    :type ppm_scale: float
+    :param snapshot_file: name of the snapshot store, None if there is none
+    :type snapshot_file: string
+    :param snapshot_index: size and index of the snapshot store, see \
+            pumha.store.SnapshotStore.checkpoint
+    :type snapshot_index: tuple of int and bytes
+    """
+    snapshot_bytes, index = snapshot_index or (0, b'')
+    rng_name, rng_keys, rng_pos, rng_has_gauss, rng_gauss = \
+        np.random.get_state()
+    arrays = {
+        'step': np.array(step),
+        'time': np.array(time),
+        'config': np.array(json.dumps(config)),
+        'landscape_hash': np.array(landscape_hash(landscape)),
+        'landscape_file': np.array(os.path.abspath(landscape.filename)),
+        'max_density': np.array(max_density),
+        'average_bytes': np.array(average_bytes),
+        'ppm_scale': np.array(ppm_scale),
+        'snapshot_file': np.array(snapshot_file or ''),
+        'snapshot_bytes': np.array(snapshot_bytes),
+        'snapshot_index': np.frombuffer(index, dtype=np.uint8),
+        'rng_keys': rng_keys,
+        'rng_pos': np.array(rng_pos),
+        'rng_has_gauss': np.array(rng_has_gauss),
+        'rng_gauss': np.array(rng_gauss),
+    }
+    for kind, density in densities.items():
+        arrays['density_' + kind] = density
+
+    tmp_file = filename + '.tmp'
+    with open(tmp_file, 'wb') as out:
+        np.savez(out, **arrays)
+        out.flush()
+        os.fsync(out.fileno())
+    # rename is atomic, so the checkpoint is either old or new, never broken
+    if hasattr(os, 'replace'):
+        os.replace(tmp_file, filename)
+    else:  # python 2
+        os.rename(tmp_file, filename)
+
+
+def load_checkpoint(filename, restore_rng=True):
+    """Read a checkpoint file.
+
+    :param filename: name of the checkpoint file
+    :type filename: string
+    :param restore_rng: set state of the numpy random number generator \
+            to the state saved in the checkpoint
+    :type restore_rng: bool
+    :return: checkpoint values with keys step, time, densities, config, \
+            landscape_hash, landscape_file, max_density, average_bytes, \
+            ppm_scale, snapshot_file and snapshot_index, the last two None \
+            if there was no snapshot store
+    :rtype: dict
+    """
+    with np.load(filename) as data:
+        checkpoint = {
+            'step': int(data['step']),
+            'time': float(data['time']),
+            'config': json.loads(str(data['config'])),
+            'landscape_hash': str(data['landscape_hash']),
+            'landscape_file': str(data['landscape_file']),
+            'max_density': float(data['max_density']),
+            'average_bytes': int(data['average_bytes']),
+            'ppm_scale': float(data['ppm_scale']),
+            'snapshot_file': str(data['snapshot_file']) or None,
+            'snapshot_index': None,
+            'densities': dict((key[len('density_'):], data[key])
+                              for key in data.files
+                              if key.startswith('density_')),
+        }
+        if checkpoint['snapshot_file'] is not None:
+            checkpoint['snapshot_index'] = (int(data['snapshot_bytes']),
+                                            data['snapshot_index'].tobytes())
+        if restore_rng:
+            np.random.set_state(('MT19937', data['rng_keys'],
+                                 int(data['rng_pos']),
+                                 int(data['rng_has_gauss']),
+                                 float(data['rng_gauss'])))
+    return checkpoint
+
+
+def landscape_hash(landscape):
+    """Return SHA-256 hash of the land mask of a landscape.
+
+    The packed mask is hashed, so the landscape is never unpacked.
+
+    :param landscape: landscape to hash
+    :type landscape: pumha.env.Landscape
+    :return: hexadecimal digest
+    :rtype: string
+    """
+    shape = tuple(int(n) for n in landscape.shape)
+    digest = hashlib.sha256(str(shape).encode('ascii'))
+    digest.update(np.ascontiguousarray(landscape.mask_bits).tobytes())
+    return digest.hexdigest()
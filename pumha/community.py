@@ -0,0 +1,251 @@
+"""Community module.
+
+The module contains three classes::
+
+    Community
+    CommunityState
+    SpeciesPopulation(Population)
+
+A Community is a generic reaction-diffusion model of any number of species
+living in one landscape, declared by a table of coefficients instead of
+a population class per species. The density of species i changes as::
+
+    dX_i/dt = X_i * (g_i + sum_j A_ij X_j) + l_i * Laplacian(X_i)
+
+where g is the growth rate (negative for a death rate), A the matrix of
+pairwise interactions and l the diffusion rate. Hares and pumas are the
+special case::
+
+    g = (r, -m)    A = ((0, -a),
+                        (b,  0))
+
+Densities of all species are stored in a single stacked array of shape
+(species, rows, cols) and every step updates all species with the same few
+batched numpy operations, so the cost grows linearly with the number of
+species without a Python loop over them. Every species is also represented
+by a SpeciesPopulation, whose density is a view of the stack, so
+a community runs in pumha.sim.Simulation like any other populations.
+"""
+
+from __future__ import (absolute_import,
+                        division,
+                        print_function,
+                        unicode_literals)
+import numpy as np
+from pumha.pop import Population, FUSED_BAND_SQUARES, population_seeds
+
+
+class SpeciesPopulation(Population):
+    """One species of a community.
+
+    The density of the species is a view of the stacked densities of the
+    community, which updates all species at once, so the population has no
+    update engine of its own.
+
+    :ivar community: community the species belongs to
+    :vartype community: pumha.community.Community
+    :ivar index: index of the species in the stacked densities
+    :vartype index: int
+    :ivar kind: name of the species
+    :vartype kind: string
+    """
+
+    def __init__(self, landscape, community, index, min_ro=0., max_ro=5.,
+                 seed=None):
+        self.community = community
+        self.index = index
+        self.kind = community.names[index]
+        # birth holds the growth rate, interactions live in the community
+        super(SpeciesPopulation, self).__init__(
+            landscape, community.growth[index], 0.,
+            community.diffusion[index], min_ro, max_ro, community.dt,
+            engine='community', seed=seed)
+
+
+class Community(object):
+    """Species, coefficient tables and stacked densities of a community.
+
+    :Example:
+
+        >>> community = Community(land, ['Hare', 'Puma'],
+        ...                       growth=[.08, -.06], diffusion=[.2, .2],
+        ...                       interactions=[[0, -.04], [.02, 0]])
+        >>> sim = Simulation(*community.populations)
+
+    :ivar names: names of the species
+    :vartype names: list of string
+    :ivar growth: growth rates of the species
+    :vartype growth: numpy.ndarray of float type
+    :ivar diffusion: diffusion rates of the species
+    :vartype diffusion: numpy.ndarray of float type
+    :ivar interactions: interaction matrix, row i holds the effect of \
+            every species on the growth of species i
+    :vartype interactions: numpy.ndarray of float type
+    :ivar dt: time step in arbitrary units
+    :vartype dt: float
+    :ivar density: stacked densities with shape (species, rows, cols)
+    :vartype density: numpy.ndarray of float type
+    :ivar populations: one population per species, with densities \
+            viewing the stack
+    :vartype populations: list of pumha.community.SpeciesPopulation
+    :raises ValueError: if the tables do not match the number of species
+    """
+
+    def __init__(self, landscape, names, growth, diffusion, interactions,
+                 dt=.4, min_ro=0., max_ro=5., seed=None):
+        self.names = list(names)
+        num_species = len(self.names)
+        self.growth = np.asarray(growth, dtype=float)
+        self.diffusion = np.asarray(diffusion, dtype=float)
+        self.interactions = np.asarray(interactions, dtype=float)
+        if (len(set(self.names)) != num_species or
+                self.growth.shape != (num_species,) or
+                self.diffusion.shape != (num_species,) or
+                self.interactions.shape != (num_species, num_species)):
+            raise ValueError("Coefficient tables do not match species %s"
+                             % self.names)
+        self.dt = dt
+        self._env = landscape
+        self._mask = None
+        # every species draws its initial densities from its own stream
+        seeds = population_seeds(seed, num_species)
+        self.populations = [SpeciesPopulation(landscape, self, index,
+                                              min_ro, max_ro, seeds[index])
+                            for index in range(num_species)]
+        self.density = np.array([pop.density for pop in self.populations])
+        self.bind(self.density)
+
+    @classmethod
+    def from_config(cls, landscape, species, dt, seed=None):
+        """Create a community from the Species list of a configuration.
+
+        Every species is a dictionary with "Name", "Growth", "Diffusion" and
+        an optional "Interactions" dictionary giving the effect of other
+        species, by name, on its growth::
+
+            {"Name": "Hare", "Growth": 0.08, "Diffusion": 0.2,
+             "Interactions": {"Puma": -0.04}}
+
+        :param landscape: landscape of the community
+        :type landscape: pumha.env.Landscape
+        :param species: species of the configuration
+        :type species: list of dict
+        :param dt: time step in arbitrary units
+        :type dt: float
+        :param seed: seed of the initial densities, the global numpy random \
+                generator is used if None
+        :type seed: int
+        :return: new community
+        :rtype: pumha.community.Community
+        :raises ValueError: if an interaction names an unknown species
+        """
+        names = [entry["Name"] for entry in species]
+        interactions = np.zeros((len(names), len(names)))
+        for row, entry in enumerate(species):
+            for name, value in entry.get("Interactions", {}).items():
+                if name not in names:
+                    raise ValueError("Unknown species in interactions of "
+                                     "%s: %s" % (entry["Name"], name))
+                interactions[row, names.index(name)] = value
+        return cls(landscape, names,
+                   [entry["Growth"] for entry in species],
+                   [entry["Diffusion"] for entry in species],
+                   interactions, dt, seed=seed)
+
+    def bind(self, density):
+        """Point densities of the populations to a stack of densities.
+
+        :param density: stacked densities with shape (species, rows, cols)
+        :type density: numpy.ndarray of float type
+        """
+        for pop, grid in zip(self.populations, density):
+            pop.density = grid
+
+    def advance(self, D, out):
+        """Write densities of all species at t+dt into out.
+
+        The grid is updated in bands of rows, every band with batched
+        operations over all species. The interaction term is a single
+        tensor product of the interaction matrix with the densities.
+        Negative densities are clamped to zero and only land squares of
+        out are written.
+
+        :param D: stacked densities at time t
+        :type D: numpy.ndarray of float type
+        :param out: stacked densities at t+dt
+        :type out: numpy.ndarray of float type
+        """
+        rows, cols = D.shape[1:]
+        N = self._env.dry_squares
+        if self._mask is None:
+            self._mask = self._env.landscape.astype(bool)
+        mask = self._mask
+        growth = self.growth[:, None, None]
+        diffusion = self.diffusion[:, None, None]
+        band_rows = max(1, FUSED_BAND_SQUARES // cols)
+        for first in range(1, rows - 1, band_rows):
+            last = min(first + band_rows, rows - 1)
+            band = slice(first, last)
+            D_c = D[:, band, 1:-1]
+            lap = ((D[:, first - 1:last - 1, 1:-1] +
+                    D[:, first + 1:last + 1, 1:-1] +
+                    D[:, band, :-2] + D[:, band, 2:]) -
+                   N[band, 1:-1] * D_c)
+            rates = growth + np.tensordot(self.interactions, D_c, axes=1)
+            new = D_c + self.dt * (D_c * rates + diffusion * lap)
+            new = np.where(new > 0, new, 0.)
+            np.copyto(out[:, band, 1:-1], new, where=mask[band, 1:-1])
+
+
+class CommunityState(object):
+    """Double buffered stacked densities of a community.
+
+    The state has the interface of pumha.state.PopulationState used by
+    pumha.sim.Simulation.run(): step() advances all species with
+    Community.advance() and swaps two stacked buffers, and densities of
+    the populations are views of the current buffer.
+
+    :ivar community: community owning the densities
+    :vartype community: pumha.community.Community
+    :ivar populations: populations of the species
+    :vartype populations: list of pumha.community.SpeciesPopulation
+    :ivar compact: always False, densities are padded grids
+    :vartype compact: bool
+    """
+
+    def __init__(self, community):
+        self.community = community
+        self.populations = community.populations
+        self.compact = False
+        self._current = community.density
+        self._next = np.copy(community.density)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def next(self, pop):
+        """Return the buffer receiving density of pop at t+dt.
+
+        :param pop: species of the community
+        :type pop: pumha.community.SpeciesPopulation
+        :return: next density array
+        :rtype: numpy.ndarray of float type
+        """
+        return self._next[pop.index]
+
+    def step(self):
+        """Advance all species by one time step and swap the buffers."""
+        self.community.advance(self._current, self._next)
+        self.swap()
+
+    def swap(self):
+        """Swap current and next buffers and rebind population densities."""
+        self._current, self._next = self._next, self._current
+        self.community.density = self._current
+        self.community.bind(self._current)
+
+    def sync(self):
+        """Do nothing, densities of populations view the current buffer."""
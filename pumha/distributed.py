@@ -0,0 +1,417 @@
+"""Distributed module.
+
+The module contains one class::
+
+    DistributedState
+
+and three functions::
+
+    run_rank
+    serve_rank
+    send_edges
+
+The DistributedState class is a drop-in replacement of
+pumha.state.PopulationState which distributes a simulation over rank
+processes, possibly running on different hosts. Every rank owns a strip of
+rows of the padded landscape and exchanges halo rows with the ranks owning
+the strips above and below over TCP. The state acts as the coordinator: it
+hands out strips together with the packed rows of the landscape they
+need, tells ranks how many steps to make and gathers the strips into
+density grids of populations whenever a snapshot is needed by the output
+methods of pumha.sim.Simulation. Ranks never read the landscape file and
+can draw the initial densities of their own strips, so only the
+coordinator holds whole density grids, which can be backed by scratch
+files. A rank which stops or does not reply within a timeout stops the
+simulation with an error instead of blocking the coordinator.
+
+Ranks started by the coordinator run as local processes. Ranks on other
+hosts are started with::
+
+    python -m pumha.distributed <host> <port> <authkey>
+
+where host and port are the address of the coordinator and authkey is the
+hexadecimal key printed by a coordinator created with launch=False. Ranks
+started before the coordinator keep trying to connect for RANK_TIMEOUT
+seconds.
+"""
+
+from __future__ import (absolute_import,
+                        division,
+                        print_function,
+                        unicode_literals)
+import os
+import sys
+import time
+import socket
+import binascii
+import multiprocessing
+from multiprocessing.connection import Listener, Client
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from pumha.pop import (COMPACT_ENGINES, SEED_BAND_ROWS, species_indices,
+                       split_rows)
+
+# seconds the coordinator waits for a reply of a rank, per step made, and
+# a rank keeps trying to connect to the coordinator
+RANK_TIMEOUT = 600
+
+
+def run_rank(address, authkey, timeout=RANK_TIMEOUT):
+    """Run one rank of a distributed simulation until it is stopped.
+
+    The rank connects to the coordinator, opens a listener for halo
+    exchange on the address it used to reach the coordinator, receives its
+    strip of rows with initial densities, connects to its neighbours and
+    then serves commands of the coordinator::
+
+        ('step', n)   make n steps and reply 'done'
+        ('gather',)   send densities of owned rows of every population
+        ('stop',)     close connections and return
+
+    If the rank fails, the error is sent to the coordinator in place of
+    the reply and raised. A coordinator which is not listening yet is
+    connected to again until timeout seconds have passed.
+
+    :param address: host and port of the coordinator
+    :type address: (string, int)
+    :param authkey: authentication key of the coordinator
+    :type authkey: bytes
+    :param timeout: seconds to keep trying to connect to the coordinator
+    :type timeout: float
+    """
+    deadline = time.time() + timeout
+    while True:
+        try:
+            conn = Client(tuple(address), authkey=authkey)
+            break
+        except ConnectionRefusedError:
+            if time.time() > deadline:
+                raise
+            time.sleep(.1)
+    sock = socket.fromfd(conn.fileno(), socket.AF_INET, socket.SOCK_STREAM)
+    host = sock.getsockname()[0]
+    sock.close()
+    listener = Listener((host, 0), authkey=authkey)
+    conn.send(listener.address)
+    try:
+        serve_rank(conn, listener, authkey)
+    except Exception as e:
+        conn.send(('error', repr(e)))
+        raise
+
+
+def serve_rank(conn, listener, authkey):
+    """Set up a rank and serve commands of the coordinator, see run_rank()."""
+    setup = conn.recv()
+    start, stop = setup['rows']
+    # packed rows of the landscape from first_row on, covering the strip
+    # and its halos, and the seed bands of the strip if densities are drawn
+    land = setup['landscape']
+    first = setup['first_row']
+    env = land.sub_landscape(start - 1 - first, stop + 1 - first)
+    num_pops = len(setup['populations'])
+    # current and next buffers of every population, and zeros standing
+    # for a missing puma or hare population, rows include both halos
+    buffers = np.zeros((2, num_pops + 1) + env.shape)
+    populations = []
+    for index, (pop_class, params) in enumerate(setup['populations']):
+        # the density of the strip is received or drawn below
+        pop = pop_class(env, engine='packed', density=buffers[0, index],
+                        seed=params['seed'], **params['init'])
+        pop.tile_rows = params['tile_rows']
+        populations.append(pop)
+        if setup['densities'] is None:
+            buffers[0, index] = pop.random_density(
+                land, (start - 1, stop + 1), first)
+    if setup['densities'] is not None:
+        buffers[0, :num_pops] = setup['densities']
+    P_index, H_index = setup['species']
+
+    # the neighbour above connects first, so ranks connect in a chain
+    upper = listener.accept() if setup['upper'] else None
+    lower = (Client(tuple(setup['lower']), authkey=authkey)
+             if setup['lower'] is not None else None)
+    listener.close()
+    conn.send('ready')
+
+    current = 0
+    # receiving needs a flat buffer, Connection.recv_bytes_into() takes the
+    # length of the first axis of a buffer as its number of items
+    halo = np.empty(num_pops * env.shape[1])
+    rows = env.shape[0]
+    # edge rows are sent by a thread while halos are received, so all
+    # ranks exchange halos at once and a send never waits for a receive
+    sender = ThreadPoolExecutor(1)
+    while True:
+        command = conn.recv()
+        if command[0] == 'step':
+            for _ in range(command[1]):
+                grid = buffers[current]
+                sent = sender.submit(send_edges, upper, lower,
+                                     grid[:num_pops, 1],
+                                     grid[:num_pops, rows - 2])
+                if upper is not None:
+                    upper.recv_bytes_into(halo)
+                    grid[:num_pops, 0] = halo.reshape(num_pops, -1)
+                if lower is not None:
+                    lower.recv_bytes_into(halo)
+                    grid[:num_pops, rows - 1] = halo.reshape(num_pops, -1)
+                sent.result()
+                P = grid[P_index]
+                H = grid[H_index]
+                for index, pop in enumerate(populations):
+                    pop.advance_rows(P, H, buffers[1 - current, index],
+                                     1, rows - 1)
+                current = 1 - current
+            conn.send('done')
+        elif command[0] == 'gather':
+            conn.send_bytes(np.ascontiguousarray(
+                buffers[current, :num_pops, 1:rows - 1]))
+        else:
+            break
+    sender.shutdown()
+    for link in (upper, lower, conn):
+        if link is not None:
+            link.close()
+
+
+class DistributedState(object):
+    """Density grids of populations distributed over rank processes.
+
+    The state has the interface of pumha.state.PopulationState used by
+    Simulation.run(): step() and sync(). Steps are only counted by step()
+    and sent to the ranks in a single command by the next sync(), which
+    also gathers the strips of all ranks into density attributes of the
+    populations, so ranks run without waiting for the coordinator between
+    outputs. Ranks update their strips with the packed engine, so results
+    are identical to a serial simulation. The convergence monitor is not
+    supported, since it needs densities of every step.
+
+    Only the coordinator holds whole density grids; a rank holds its
+    strip and the packed rows of the landscape sent by the coordinator. If
+    draw is True, every rank draws the random initial densities of its
+    strip with Population.random_density() instead of receiving them, so
+    the densities of populations are not read before the first sync().
+    Seeded populations then start from the same densities as they would
+    draw themselves, unseeded ones from new random densities.
+
+    Replies of ranks are awaited for at most timeout seconds per step. If
+    a rank stops, fails or does not reply in time, the ranks started by
+    the state are terminated, the state is closed and RuntimeError is
+    raised.
+
+    :Example:
+
+        >>> with DistributedState([puma, hare], num_ranks=4) as state:
+        ...     for i in range(num_steps):
+        ...         state.step()
+        ...     state.sync()
+
+    :ivar populations: populations of the simulation
+    :vartype populations: list of pumha.pop.Population types
+    :ivar compact: always False, densities are padded grids
+    :vartype compact: bool
+    :ivar strips: rows owned by every rank
+    :vartype strips: list of (int, int)
+    :ivar address: host and port of the coordinator
+    :vartype address: (string, int)
+    :ivar authkey: authentication key ranks connect with
+    :vartype authkey: bytes
+    :ivar draw: ranks draw initial densities of their strips
+    :vartype draw: bool
+    :ivar timeout: seconds to wait for a rank per step
+    :vartype timeout: float
+    :raises ValueError: if a population uses a compact engine
+    :raises RuntimeError: if a rank fails or does not reply in time
+    """
+
+    def __init__(self, populations, num_ranks, address=('127.0.0.1', 0),
+                 authkey=None, launch=True, draw=False,
+                 timeout=RANK_TIMEOUT):
+        self.populations = list(populations)
+        self.compact = False
+        self.draw = draw
+        self.timeout = timeout
+        for pop in self.populations:
+            if pop.engine in COMPACT_ENGINES:
+                raise ValueError("Distributed simulation works on grids, not "
+                                 "with the %s engine" % pop.engine)
+        self.authkey = authkey if authkey is not None else os.urandom(16)
+        self._listener = Listener(address, authkey=self.authkey)
+        self.address = self._listener.address
+        self._pending = 0
+        self._processes = []
+        if launch:
+            for _ in range(num_ranks):
+                process = multiprocessing.Process(
+                    target=run_rank, args=(self.address, self.authkey))
+                process.daemon = True
+                process.start()
+                self._processes.append(process)
+        else:
+            print('Waiting for %s ranks at %s:%s, authkey %s' %
+                  (num_ranks, self.address[0], self.address[1],
+                   binascii.hexlify(self.authkey).decode('ascii')))
+
+        self._ranks = [self._listener.accept() for _ in range(num_ranks)]
+        halo_addresses = [self._receive(rank, self.timeout)
+                          for rank in self._ranks]
+        rows = self.populations[0]._env.shape[0]
+        self.strips = split_rows(rows, num_ranks)
+        if len(self.strips) < num_ranks:
+            raise ValueError("More ranks than rows of the landscape")
+        self._send_setup(halo_addresses)
+        self._wait('ready', self.timeout)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def step(self):
+        """Count one more time step to be made by the ranks."""
+        self._pending += 1
+
+    def sync(self):
+        """Make counted steps and gather strips into density grids.
+
+        Does nothing once the state is closed, since closing gathers the
+        final densities.
+        """
+        if self._ranks is None:
+            return
+        self._flush()
+        num_pops = len(self.populations)
+        cols = self.populations[0]._env.shape[1]
+        for rank in self._ranks:
+            rank.send(('gather',))
+        for rank, (start, stop) in zip(self._ranks, self.strips):
+            strip = np.empty(num_pops * (stop - start) * cols)
+            self._receive(rank, self.timeout, strip)
+            for pop, density in zip(self.populations,
+                                    strip.reshape(num_pops, -1, cols)):
+                pop.density[start:stop] = density
+
+    def close(self):
+        """Gather final densities and stop all ranks."""
+        if self._ranks is None:
+            return
+        self.sync()
+        for rank in self._ranks:
+            rank.send(('stop',))
+            rank.close()
+        for process in self._processes:
+            process.join()
+        self._listener.close()
+        self._ranks = None
+
+    def _flush(self):
+        """Send the counted steps to all ranks and wait for them."""
+        if self._pending:
+            steps = self._pending
+            # counted steps are made even if waiting for a rank fails
+            self._pending = 0
+            for rank in self._ranks:
+                rank.send(('step', steps))
+            self._wait('done', self.timeout * steps)
+
+    def _wait(self, reply, timeout):
+        """Wait for the reply of every rank.
+
+        :raises RuntimeError: if a rank replied with an error, see \
+                _receive()
+        """
+        for rank in self._ranks:
+            answer = self._receive(rank, timeout)
+            if answer != reply:
+                self._abort("Rank of the distributed simulation failed: %s"
+                            % answer[1])
+
+    def _receive(self, rank, timeout, buf=None):
+        """Return a message of a rank, or receive its bytes into buf.
+
+        :raises RuntimeError: if the rank stopped or did not send anything \
+                within timeout seconds
+        """
+        try:
+            if rank.poll(timeout):
+                if buf is None:
+                    return rank.recv()
+                rank.recv_bytes_into(buf)
+                return None
+        except (EOFError, OSError):
+            self._abort("Rank of the distributed simulation stopped")
+        self._abort("Rank of the distributed simulation did not reply in "
+                    "%s s" % timeout)
+
+    def _abort(self, message):
+        """Terminate the ranks, close connections and raise RuntimeError."""
+        # killed, as a rank which hangs may not handle SIGTERM
+        for process in self._processes:
+            process.kill()
+            process.join()
+        for rank in self._ranks:
+            rank.close()
+        self._listener.close()
+        self._ranks = None
+        raise RuntimeError(message)
+
+    def _send_setup(self, halo_addresses):
+        """Send strips, landscape rows, parameters and densities to ranks."""
+        species = species_indices(self.populations)
+        # unseeded populations get new entropy, so ranks drawing their
+        # densities never share random numbers
+        specs = [(type(pop), {'init': {'birth': pop.birth,
+                                       'death': pop.death,
+                                       'diffusion': pop.diffusion,
+                                       'dt': pop.dt},
+                              'seed': (pop.seed if pop.seed is not None
+                                       else np.random.SeedSequence()),
+                              'tile_rows': pop.tile_rows})
+                 for pop in self.populations]
+        land = self.populations[0]._env
+        rows = land.shape[0]
+        for index, (rank, (start, stop)) in enumerate(zip(self._ranks,
+                                                          self.strips)):
+            first, end = start - 1, stop + 1
+            if self.draw:
+                # whole seed bands are drawn by Population.random_density()
+                first -= first % SEED_BAND_ROWS
+                end = min(end - end % -SEED_BAND_ROWS, rows)
+            last = index == len(self._ranks) - 1
+            rank.send({
+                'rows': (start, stop),
+                'first_row': first,
+                'landscape': land.sub_landscape(first, end, copy=True),
+                'populations': specs,
+                'species': species,
+                'densities': None if self.draw else np.array(
+                    [pop.density[start - 1:stop + 1]
+                     for pop in self.populations]),
+                'upper': index > 0,
+                'lower': None if last else halo_addresses[index + 1],
+            })
+
+
+def send_edges(upper, lower, top, bottom):
+    """Send the top edge row to the upper and bottom one to the lower rank.
+
+    :param upper: connection to the rank above, None for the first rank
+    :type upper: multiprocessing.connection.Connection
+    :param lower: connection to the rank below, None for the last rank
+    :type lower: multiprocessing.connection.Connection
+    :param top: first owned row of every population
+    :type top: numpy.ndarray of float type
+    :param bottom: last owned row of every population
+    :type bottom: numpy.ndarray of float type
+    """
+    if upper is not None:
+        upper.send_bytes(np.ascontiguousarray(top))
+    if lower is not None:
+        lower.send_bytes(np.ascontiguousarray(bottom))
+
+
+if __name__ == '__main__':
+    run_rank((sys.argv[1], int(sys.argv[2])),
+             binascii.unhexlify(sys.argv[3]))
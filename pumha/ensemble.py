@@ -0,0 +1,270 @@
+"""Ensemble module.
+
+The module contains two classes::
+
+    Ensemble
+    ParameterBatch(Ensemble)
+
+An Ensemble simulates K independent realisations of a puma and hare
+simulation, which differ only in their random initial densities. Densities
+of all members are stacked into arrays of shape (K, rows, cols) sharing one
+landscape, and every step updates all members with the same batched numpy
+operations, so the landscape is loaded and the numpy calls are paid for
+once instead of once per realisation. A ParameterBatch is an ensemble whose
+members differ in their parameters, e.g. the points of a sensitivity
+analysis, with birth, death and diffusion rates and time steps held in
+arrays broadcast over the members.
+"""
+
+from __future__ import (absolute_import,
+                        division,
+                        print_function,
+                        unicode_literals)
+import os
+import copy
+import time
+import numpy as np
+from tqdm import tqdm
+
+# parameters of a ParameterBatch, config file keys with the population and
+# its attribute holding the parameter
+BATCH_KEYS = {
+    'Puma_birth': ('puma', 'birth'),
+    'Puma_mortality': ('puma', 'death'),
+    'Puma_diffusion': ('puma', 'diffusion'),
+    'Hare_birth': ('hare', 'birth'),
+    'Hare_predation': ('hare', 'death'),
+    'Hare_diffusion': ('hare', 'diffusion'),
+    'Time_step': ('both', 'dt'),
+}
+# squares of stacked members updated at once, so float temporaries stay
+# below the 128 KiB mmap threshold of malloc and are not mapped and paged
+# in again by every numpy operation
+BATCH_BLOCK_SQUARES = 16000
+# least number of rows in a band of stacked members, as thinner bands
+# spend most of their time on the halo rows
+BATCH_BAND_ROWS = 16
+
+
+class Ensemble(object):
+    """Stacked densities of an ensemble of puma and hare simulations.
+
+    Unless initial densities of all members are given, as a pair of puma
+    and hare stacks, the first member starts from the densities of the
+    given populations, so it follows the same path as a single simulation
+    of them. Every other member draws new random initial densities with
+    Population.random_density(), pumas first. Members are updated with
+    Population.advance_window() of the given populations, so every member
+    matches a single simulation with the vector engine bit for bit.
+
+    :Example:
+
+        >>> ensemble = Ensemble(puma, hare, size=32)
+        >>> ensemble.run(100, 10, 'ensemble_out')
+        >>> members, mean, std = ensemble.averages()
+
+    :ivar puma: puma population giving the parameters of all members
+    :vartype puma: pumha.pop.PumaPopulation
+    :ivar hare: hare population giving the parameters of all members
+    :vartype hare: pumha.pop.HarePopulation
+    :ivar size: number of members
+    :vartype size: int
+    :ivar P: puma densities of all members, shape (size, rows, cols)
+    :vartype P: numpy.ndarray of float type
+    :ivar H: hare densities of all members, shape (size, rows, cols)
+    :vartype H: numpy.ndarray of float type
+    :raises ValueError: if the ensemble has no members
+    """
+
+    def __init__(self, puma, hare, size, densities=None):
+        if size < 1:
+            raise ValueError("Ensemble needs at least one member")
+        self.puma = puma
+        self.hare = hare
+        self.size = size
+        env = puma._env
+        self.P = np.empty((size,) + env.shape)
+        self.H = np.empty((size,) + env.shape)
+        if densities is not None:
+            # initial puma and hare densities of all members
+            self.P[...], self.H[...] = densities
+        else:
+            self.P[0] = puma.density
+            self.H[0] = hare.density
+            for member in range(1, size):
+                self.P[member] = puma.random_density(env)
+                self.H[member] = hare.random_density(env)
+        self._P_next = np.copy(self.P)
+        self._H_next = np.copy(self.H)
+
+    def step(self):
+        """Advance all members by one time step.
+
+        Members are always updated in stacks, in bands of rows across the
+        member axis with one halo row above and below. A band holds at
+        least BATCH_BAND_ROWS rows, more if all members fit in
+        BATCH_BLOCK_SQUARES squares, and stacks hold as many members as fit
+        in that many squares, so every numpy operation works on a block of
+        similar size whatever the size of the landscape.
+        """
+        N = self.puma._N
+        mask = self.puma._land_mask
+        rows, cols = N.shape
+        band_rows = max(BATCH_BAND_ROWS,
+                        BATCH_BLOCK_SQUARES // (self.size * cols))
+        chunk = max(1, BATCH_BLOCK_SQUARES // (band_rows * cols))
+        for first_member in range(0, self.size, chunk):
+            members = slice(first_member, first_member + chunk)
+            puma, hare = self.populations(members)
+            P = self.P[members]
+            H = self.H[members]
+            P_next = self._P_next[members]
+            H_next = self._H_next[members]
+            for first in range(1, rows - 1, band_rows):
+                # the band with one halo row above and below
+                window = slice(first - 1,
+                               min(first + band_rows, rows - 1) + 1)
+                N_band = N[window]
+                mask_band = mask[window]
+                puma.advance_window(P[:, window], H[:, window],
+                                    P_next[:, window], N_band, mask_band)
+                hare.advance_window(P[:, window], H[:, window],
+                                    H_next[:, window], N_band, mask_band)
+        self.P, self._P_next = self._P_next, self.P
+        self.H, self._H_next = self._H_next, self.H
+
+    def populations(self, members):
+        """Return the puma and hare populations updating some members.
+
+        :param members: index of a member or slice of members
+        :type members: int or slice
+        :return: puma and hare population
+        :rtype: (pumha.pop.PumaPopulation, pumha.pop.HarePopulation)
+        """
+        return self.puma, self.hare
+
+    def averages(self):
+        """Return average densities of members and their mean and deviation.
+
+        Averages are taken over all squares of the landscape, as in
+        pumha.sim.Simulation.save_average_density().
+
+        :return: hare and puma averages of every member with shape \
+                (size, 2), and mean and standard deviation of the \
+                averages over members with shape (2,)
+        :rtype: (numpy.ndarray, numpy.ndarray, numpy.ndarray)
+        """
+        rows, cols = self.P.shape[1:]
+        squares = (rows - 2) * (cols - 2)
+        members = np.column_stack((self.H.sum(axis=(1, 2)),
+                                   self.P.sum(axis=(1, 2)))) / squares
+        return members, members.mean(axis=0), members.std(axis=0)
+
+    def run(self, num_steps, save_freq, out_dir):
+        """Run all members, writing average densities every save_freq step.
+
+        Two files are written to out_dir. ensemble_members.dat has a line
+        of timestep, member, hare and puma average per member and output,
+        ensemble_averages.dat a line of timestep, mean and standard
+        deviation of hare averages and mean and standard deviation of puma
+        averages over members per output.
+
+        :param num_steps: Number of steps for a simulation
+        :type num_steps: int
+        :param save_freq: Number of time steps between outputs
+        :type save_freq: int
+        :param out_dir: directory of the output files
+        :type out_dir: string
+        """
+        start = time.time()
+        with open(os.path.join(out_dir, 'ensemble_members.dat'),
+                  'w') as members_file, \
+                open(os.path.join(out_dir, 'ensemble_averages.dat'),
+                     'w') as averages_file:
+            for i in tqdm(range(num_steps)):
+                self.step()
+                if i % save_freq == 0:
+                    members, mean, std = self.averages()
+                    for member, (hare, puma) in enumerate(members.tolist()):
+                        members_file.write('%d %d %r %r\n' %
+                                           (i, member, hare, puma))
+                    # hare mean and deviation, then puma mean and deviation
+                    stats = np.column_stack((mean, std)).ravel().tolist()
+                    averages_file.write('%d %r %r %r %r\n' %
+                                        tuple([i] + stats))
+        print("Simulation time: %.2f s" % (time.time() - start))
+
+
+class ParameterBatch(Ensemble):
+    """Stacked densities of puma and hare simulations with own parameters.
+
+    Every member has its own puma and hare birth, death and diffusion rates
+    and time step, given by lists of values keyed by the names of the
+    config file keys in BATCH_KEYS. Parameters which are not given take
+    the values of the puma and hare populations. Parameters are held in
+    arrays of shape (size, 1, 1), which broadcast over the stacked
+    densities, so members are advanced in the same numpy operations as
+    members of an Ensemble and each matches a single simulation with the
+    vector engine and its parameters bit for bit.
+
+    Members start from the puma and hare densities, unless densities of
+    every member are given.
+
+    :Example:
+
+        >>> batch = ParameterBatch(puma, hare, {
+        ...     'Hare_birth': [.06, .08, .1], 'Time_step': [.4, .4, .2]})
+        >>> for i in range(100):
+        ...     batch.step()
+        >>> members, mean, std = batch.averages()
+
+    :ivar parameters: parameters of members, arrays of shape (size, 1, 1) \
+            keyed by config file keys
+    :vartype parameters: dict
+    :raises ValueError: if a key is not in BATCH_KEYS or the numbers of \
+            values differ
+    """
+
+    def __init__(self, puma, hare, parameters, densities=None):
+        for key in parameters:
+            if key not in BATCH_KEYS:
+                raise ValueError("Parameter can not be batched: %s" % key)
+        sizes = set(len(values) for values in parameters.values())
+        if len(sizes) != 1:
+            raise ValueError("Parameters need the same number of values")
+        size = sizes.pop()
+        if densities is None:
+            densities = (puma.density, hare.density)
+        super(ParameterBatch, self).__init__(puma, hare, size, densities)
+        self.parameters = {}
+        for key, (species, name) in BATCH_KEYS.items():
+            pop = hare if species == 'hare' else puma
+            values = parameters.get(key, [getattr(pop, name)] * size)
+            self.parameters[key] = np.asarray(values,
+                                              dtype=float)[:, None, None]
+        self._populations = {}
+
+    def populations(self, members):
+        """Return puma and hare populations with parameters of some members.
+
+        The populations are shallow copies of the puma and hare with
+        parameters of the members, kept for later steps.
+
+        :param members: index of a member or slice of members
+        :type members: int or slice
+        :return: puma and hare population
+        :rtype: (pumha.pop.PumaPopulation, pumha.pop.HarePopulation)
+        """
+        key = (members if isinstance(members, int)
+               else (members.start, members.stop))
+        if key not in self._populations:
+            puma = copy.copy(self.puma)
+            hare = copy.copy(self.hare)
+            for name, (species, attribute) in BATCH_KEYS.items():
+                values = self.parameters[name][members]
+                if species in ('puma', 'both'):
+                    setattr(puma, attribute, values)
+                if species in ('hare', 'both'):
+                    setattr(hare, attribute, values)
+            self._populations[key] = (puma, hare)
+        return self._populations[key]
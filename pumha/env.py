@@ -4,10 +4,25 @@ The module contains one class::
 
     Landscape
 
+and one function::
+
+    replace_file
+
 The module creates a Landscape object which holds all the landscape-related
 information, such as the actual landscape grid array, information about
-the number of neighbouring dry squares to each square and indices of land
-squares.
+the number of neighbouring dry squares to each square, indices of land
+squares and a table of neighbours of land squares used by the compact
+(land only) representation of population densities. The land mask is also
+kept bit-packed, with 8 squares per byte, together with neighbour counts
+of one byte per square, which is all the packed update engine needs.
+
+A loaded landscape is cached in a sidecar directory next to the landscape
+file (the file name followed by CACHE_SUFFIX), which holds the padded
+landscape, dry squares and land indices as .npy files, as well as the
+packed mask and neighbour counts (the packed on-disk format). Later runs
+memory-map the arrays instead of parsing the text file again. The cache
+is used only while the size and modification time or the SHA-256 hash of
+the landscape file match the ones recorded in the cache.
 """
 
 
@@ -15,9 +30,22 @@ from __future__ import (absolute_import,
                         division,
                         print_function,
                         unicode_literals)
+import os
 import sys
+import hashlib
+import simplejson as json
 import numpy as np
 from scipy.ndimage import convolve
+from scipy import sparse
+from scipy.sparse.linalg import factorized
+
+CACHE_SUFFIX = '.cache'
+# arrays stored in the cache, each as <name>.npy
+CACHE_ARRAYS = ('landscape', 'dry_squares', 'land_indices')
+# packed arrays stored in the cache, the only ones read by packed landscapes
+PACKED_ARRAYS = ('mask_bits', 'neighbour_counts')
+# bytes of whitespace allowed between entries of a landscape file
+WHITESPACE = b' \t\r\n\v\f'
 
 
 class Landscape(object):
@@ -33,21 +61,176 @@ class Landscape(object):
     the population densities, this list of indices is used to avoid having to
     loop over water squares.
 
+    Densities can also be stored for land squares only, as a land vector.
+    A land vector holds one value per land square, in the order of
+    land_indices, followed by one extra element which is always zero and
+    stands for every water square. The neighbour table gives for every land
+    square the positions of its four neighbours in a land vector. The
+    graph Laplacian of land squares is built on first use of laplacian() and
+    cached, so all populations on the same landscape share it. The same
+    holds for factorised implicit diffusion solvers from diffusion_solver().
+
+    If cache is True, the landscape, dry squares and land indices are read
+    from the cache of the landscape file when it is up to date, and the
+    cache is written after the landscape file is loaded otherwise. Cached
+    arrays are memory-mapped read only.
+
+    If packed is True, only mask_bits and neighbour_counts are kept, which
+    takes about 1/8 byte plus 1 byte per square instead of 16 bytes for
+    the float landscape and dry squares. Full arrays (landscape,
+    dry_squares, land_indices and neighbour_table) are then built from the
+    packed ones when first used and kept afterwards, so engines other
+    than the packed engine still work, without the memory savings. Tiles
+    of the mask are unpacked on demand with unpack_rows().
+
     :ivar filename: name of file holding the landscape array
     :vartype filename: string
+    :ivar cache_dir: name of the cache directory of the landscape file
+    :vartype cache_dir: string
+    :ivar packed: True if full landscape arrays are built on demand only
+    :vartype packed: bool
+    :ivar shape: shape of the padded landscape
+    :vartype shape: (int, int)
+    :ivar mask_bits: land mask of the padded landscape packed along rows \
+            with numpy.packbits
+    :vartype mask_bits: numpy.ndarray of uint8 type
+    :ivar neighbour_counts: number of dry squares around every square
+    :vartype neighbour_counts: numpy.ndarray of uint8 type
     """
 
-    def __init__(self, filename):
+    def __init__(self, filename, cache=True, packed=False):
         # Check if the landscape exists.
         try:
-            open(filename)
+            open(filename).close()
         except IOError:
             print('No such landscape file.')
             sys.exit(1)
 
-        self.landscape = self.load_landscape(filename)
-        self.dry_squares = self.find_dry_squares()
-        self.land_indices = self.find_land_squares_indices()
+        self.filename = filename
+        self.cache_dir = filename + CACHE_SUFFIX
+        self.packed = packed
+        self._landscape = None
+        self._dry_squares = None
+        self._land_indices = None
+        self._neighbour_table = None
+        cached = self.load_cache() if cache else None
+        if cached is not None:
+            self.mask_bits, self.neighbour_counts = cached[:2]
+            self.shape = self.neighbour_counts.shape
+            if not packed:
+                (self._landscape, self._dry_squares,
+                 self._land_indices) = cached[2:]
+        else:
+            self.landscape = self.load_landscape(filename)
+            self.dry_squares = self.find_dry_squares()
+            self.land_indices = self.find_land_squares_indices()
+            if cache:
+                self.save_cache()
+            if packed:
+                self._landscape = None
+                self._dry_squares = None
+                self._land_indices = None
+        self._laplacian = None
+        self._solvers = {}
+
+    @property
+    def landscape(self):
+        """Padded landscape array, 1 for land and 0 for water."""
+        if self._landscape is None:
+            self._landscape = self.unpack_rows(0, self.shape[0]).astype(float)
+        return self._landscape
+
+    @landscape.setter
+    def landscape(self, value):
+        self._landscape = value
+        self.shape = np.shape(value)
+        self.mask_bits = np.packbits(np.asarray(value) != 0, axis=1)
+
+    @property
+    def dry_squares(self):
+        """Number of dry squares around every square as a float array."""
+        if self._dry_squares is None:
+            self._dry_squares = self.neighbour_counts.astype(float)
+        return self._dry_squares
+
+    @dry_squares.setter
+    def dry_squares(self, value):
+        self._dry_squares = value
+        self.neighbour_counts = np.asarray(value).astype(np.uint8)
+
+    @property
+    def land_indices(self):
+        """Indices of land squares, see find_land_squares_indices()."""
+        if self._land_indices is None:
+            self._land_indices = self.find_land_squares_indices()
+        return self._land_indices
+
+    @land_indices.setter
+    def land_indices(self, value):
+        self._land_indices = value
+
+    @property
+    def neighbour_table(self):
+        """Neighbour table of land squares, see find_neighbour_table()."""
+        if self._neighbour_table is None:
+            self._neighbour_table = self.find_neighbour_table()
+        return self._neighbour_table
+
+    def unpack_rows(self, start, stop):
+        """Return land mask of a band of rows unpacked from mask_bits.
+
+        :param start: first row of the band
+        :type start: int
+        :param stop: row after the last row of the band
+        :type stop: int
+        :return: mask with True on land squares, shape (stop-start, cols)
+        :rtype: numpy.ndarray of bool type
+        """
+        bits = np.unpackbits(self.mask_bits[start:stop], axis=1)
+        return bits[:, :self.shape[1]].view(bool)
+
+    def sub_landscape(self, start, stop, copy=False):
+        """Return a packed landscape made of rows start to stop.
+
+        The packed arrays of the new landscape are views of the rows, so
+        a sub landscape of a memory-mapped cache reads only its own rows
+        from disk, unless copy is True. A copy holds its rows in memory, so
+        it can be sent to another process or host, which never reads the
+        landscape file. Neighbour counts are the ones of the whole
+        landscape, so interior rows of the sub landscape are updated exactly
+        as in the whole landscape when its first and last rows hold halo
+        densities.
+
+        :param start: first row
+        :type start: int
+        :param stop: row after the last row
+        :type stop: int
+        :param copy: copy the rows instead of taking views
+        :type copy: bool
+        :return: landscape of the rows
+        :rtype: pumha.env.Landscape
+        """
+        sub = object.__new__(type(self))
+        sub.filename = self.filename
+        sub.cache_dir = self.cache_dir
+        sub.packed = True
+        sub._landscape = None
+        sub._dry_squares = None
+        sub._land_indices = None
+        sub._neighbour_table = None
+        sub._laplacian = None
+        sub._solvers = {}
+        sub.mask_bits = self.mask_bits[start:stop]
+        sub.neighbour_counts = self.neighbour_counts[start:stop]
+        if copy:
+            sub.mask_bits = np.array(sub.mask_bits)
+            sub.neighbour_counts = np.array(sub.neighbour_counts)
+        sub.shape = sub.neighbour_counts.shape
+        return sub
+
+    def count_land(self):
+        """Return the number of land squares, counted in mask_bits."""
+        return int(np.count_nonzero(np.unpackbits(self.mask_bits)))
 
     def load_landscape(self, filename):
         """Load the landscape as a numpy array from a file.
@@ -57,36 +240,39 @@ class Landscape(object):
         second line of the file (the first line contains the size, so it is
         skipped in the loading). The method pads the array with a border of
         0-s, so that the land is always surrounded by water.
-        Before loading the landscape, the method checks that the file can be
-        loaded as a numpy array and then ensures that all entries are either 1
-        or 0. If either of these checks fails, the simulation will terminate.
+        Landscapes made of single character 0 and 1 entries are parsed
+        directly from the bytes of the file with parse_landscape(). Other
+        files are loaded with numpy.loadtxt, which checks that the file can
+        be loaded as a numpy array, and then it is ensured that all entries
+        are either 1 or 0. If either of these checks fails, the simulation
+        will terminate.
 
         :param filename: name of file containing land array
         :type filename: string
         :return: padded landscape array
-        :rtype: integer array
+        :rtype: float array
         """
         print('Loading landscape')
 
-        # ensure the file has isn't empty.
-        with open(filename):
-            linecount = sum(1 for line in open(filename))
-            if linecount < 2:
-                print("No landscape found")
-                sys.exit(1)
-
-        try:
-            new_map = np.pad(np.loadtxt(filename, skiprows=1),
-                             ((1, 1), (1, 1)),
-                             mode='constant',
-                             constant_values=0)
-        except ValueError:
-            print("Value error in landscape file.")
-            print("Please ensure the landscape contains only 0 and 1 entries.")
+        with open(filename, 'rb') as land_file:
+            data = land_file.read()
+        # ensure the file isn't empty.
+        header_end = data.find(b'\n')
+        if header_end < 0 or not data[header_end + 1:].strip():
+            print("No landscape found")
             sys.exit(1)
 
-        new_map = np.pad(np.loadtxt(filename, skiprows=1),
-                         ((1, 1), (1, 1)),
+        land = self.parse_landscape(data[header_end + 1:])
+        if land is None:
+            try:
+                land = np.loadtxt(filename, skiprows=1)
+            except ValueError:
+                print("Value error in landscape file.")
+                print("Please ensure the landscape contains only 0 and 1 "
+                      "entries.")
+                sys.exit(1)
+
+        new_map = np.pad(land, ((1, 1), (1, 1)),
                          mode='constant',
                          constant_values=0)
 
@@ -97,6 +283,126 @@ class Landscape(object):
 
         return new_map
 
+    @staticmethod
+    def parse_landscape(data):
+        """Parse rows of single character 0 and 1 entries.
+
+        The bytes are classified as a whole with numpy, without splitting
+        them into lines and entries in Python. Blank lines are skipped.
+
+        :param data: landscape rows, without the size line
+        :type data: bytes
+        :return: landscape array, or None if an entry is not a single 0 \
+                or 1 or the rows have different lengths
+        :rtype: float array
+        """
+        buf = np.frombuffer(data, dtype=np.uint8)
+        is_space = np.zeros(256, dtype=bool)
+        is_space[np.frombuffer(WHITESPACE, dtype=np.uint8)] = True
+        space = is_space[buf]
+        entries = np.flatnonzero(~space)
+        # every entry must be one character surrounded by whitespace
+        if np.any(np.diff(entries) == 1):
+            return None
+        values = buf[entries] - ord(b'0')
+        if np.any(values > 1):
+            return None
+        # line number of every entry
+        lines = np.cumsum(buf == ord(b'\n'))[entries]
+        counts = np.bincount(lines)
+        counts = counts[counts > 0]
+        if np.any(counts != counts[0]):
+            return None
+        return values.reshape(len(counts), counts[0]).astype(float)
+
+    def source_key(self):
+        """Return size and modification time of the landscape file.
+
+        :return: key with size and mtime entries
+        :rtype: dict
+        """
+        stat = os.stat(self.filename)
+        return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+    def source_hash(self):
+        """Return SHA-256 hash of the landscape file.
+
+        :return: hexadecimal digest
+        :rtype: string
+        """
+        digest = hashlib.sha256()
+        with open(self.filename, 'rb') as land_file:
+            for chunk in iter(lambda: land_file.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def load_cache(self):
+        """Memory-map cached arrays of the landscape file.
+
+        The cache is valid if size and modification time of the landscape
+        file are the ones recorded in the cache. Otherwise the file is
+        hashed, so a file which was only touched or copied still uses the
+        cache, and the recorded size and time are updated.
+
+        Packed landscapes read only the packed arrays.
+
+        :return: mask bits, neighbour counts, landscape, dry squares and \
+                land indices, or None if there is no valid cache
+        :rtype: tuple of numpy.ndarray
+        """
+        key_file = os.path.join(self.cache_dir, 'key.json')
+        try:
+            with open(key_file) as f:
+                key = json.load(f)
+            source = self.source_key()
+            if (key['size'], key['mtime']) != (source['size'],
+                                               source['mtime']):
+                if key['sha256'] != self.source_hash():
+                    return None
+                key.update(source)
+                self._write_cache_key(key)
+            names = PACKED_ARRAYS
+            if not self.packed:
+                names += CACHE_ARRAYS
+            return tuple(np.load(os.path.join(self.cache_dir, name + '.npy'),
+                                 mmap_mode='r')
+                         for name in names)
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+
+    def save_cache(self):
+        """Write the landscape arrays to the cache of the landscape file.
+
+        The key of the cache is written last, so an interrupted write
+        leaves an invalid cache rather than a wrong one. A cache which can
+        not be written, e.g. next to a read only landscape file, is skipped.
+        """
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            key_file = os.path.join(self.cache_dir, 'key.json')
+            if os.path.exists(key_file):
+                os.remove(key_file)
+            for name in PACKED_ARRAYS + CACHE_ARRAYS:
+                # replaced rather than overwritten, so memory maps of the
+                # old cache, e.g. in other processes, stay valid
+                array_file = os.path.join(self.cache_dir, name + '.npy')
+                with open(array_file + '.tmp', 'wb') as f:
+                    np.save(f, np.ascontiguousarray(getattr(self, name)))
+                replace_file(array_file + '.tmp', array_file)
+            key = self.source_key()
+            key['sha256'] = self.source_hash()
+            self._write_cache_key(key)
+        except (IOError, OSError):
+            print('Landscape cache could not be written.')
+
+    def _write_cache_key(self, key):
+        """Atomically write the key of the cache."""
+        key_file = os.path.join(self.cache_dir, 'key.json')
+        with open(key_file + '.tmp', 'w') as f:
+            json.dump(key, f)
+        replace_file(key_file + '.tmp', key_file)
+
     def find_dry_squares(self):
         """Count the number of dry squares around each array element.
 
@@ -142,3 +448,148 @@ class Landscape(object):
         :rtype: [int, int] list
         """
         return np.transpose(np.nonzero(self.landscape))
+
+    def find_neighbour_table(self):
+        """Return land vector positions of neighbours of every land square.
+
+        Row k of the table holds positions of the north, south, west and east
+        neighbours respectively, so that element [k][m] is the position of
+        the k-th neighbour of the m-th land square in a land vector. Water
+        neighbours point to the last element of a land vector, which is
+        always zero.
+
+        Example::
+
+            Land:   0 0 0 0    Land vector positions:   . . . .
+                    0 1 1 0                             . 0 1 .
+                    0 0 1 0                             . . 2 .
+                    0 0 0 0                             . . . .
+
+            Table:  3 3 1      (north)
+                    3 2 3      (south)
+                    3 0 3      (west)
+                    1 3 3      (east)
+
+        :return: array of neighbour positions with shape (4, n) where n is \
+                the number of land squares
+        :rtype: integer array
+        """
+        land = self.landscape != 0
+        num_land = np.count_nonzero(land)
+        dtype = np.int32 if num_land < np.iinfo(np.int32).max else np.int64
+        positions = np.full(self.landscape.shape, num_land, dtype=dtype)
+        positions[land] = np.arange(num_land, dtype=dtype)
+        # the landscape is padded with water, so neighbours never wrap around
+        rows, cols = np.nonzero(land)
+        return np.array([positions[rows - 1, cols],
+                         positions[rows + 1, cols],
+                         positions[rows, cols - 1],
+                         positions[rows, cols + 1]])
+
+    def to_land_vector(self, grid):
+        """Return land squares of a grid as a land vector.
+
+        :param grid: array with the shape of the landscape
+        :type grid: numpy.ndarray
+        :return: values on land squares followed by a single zero
+        :rtype: numpy.ndarray of float type
+        """
+        indices = self.land_indices
+        vector = np.zeros(len(indices) + 1, dtype=float)
+        vector[:-1] = grid[indices[:, 0], indices[:, 1]]
+        return vector
+
+    def to_grid(self, vector, out=None):
+        """Scatter a land vector back to a grid with the landscape shape.
+
+        :param vector: land vector
+        :type vector: numpy.ndarray
+        :param out: optional grid to write into, its water squares are \
+                left untouched
+        :type out: numpy.ndarray
+        :return: grid with land squares set from the vector
+        :rtype: numpy.ndarray of float type
+        """
+        if out is None:
+            out = np.zeros(self.shape, dtype=float)
+        indices = self.land_indices
+        out[indices[:, 0], indices[:, 1]] = vector[:-1]
+        return out
+
+    def laplacian(self):
+        """Return the cached graph Laplacian of land squares.
+
+        The matrix is built with find_laplacian() when first requested.
+
+        :return: Laplacian acting on land vectors without the last element
+        :rtype: scipy.sparse.csr_matrix
+        """
+        if self._laplacian is None:
+            self._laplacian = self.find_laplacian()
+        return self._laplacian
+
+    def find_laplacian(self):
+        """Build the graph Laplacian of land squares as a sparse matrix.
+
+        Element (m, k) is 1 if land squares m and k are neighbours and the
+        diagonal holds minus the number of dry squares around a land square.
+        Water squares have no rows or columns, which gives no-flux boundary
+        at the coast. Multiplying a land vector without its last element by
+        the matrix gives the discrete Laplacian at every land square::
+
+            (P[i-1][j] + P[i+1][j] + P[i][j-1] + P[i][j+1]) - N[i][j]*P[i][j]
+
+        :return: n by n Laplacian, where n is the number of land squares
+        :rtype: scipy.sparse.csr_matrix
+        """
+        table = self.neighbour_table
+        num_land = table.shape[1]
+        rows = np.tile(np.arange(num_land), 4)
+        cols = table.ravel()
+        on_land = cols != num_land
+        rows = np.concatenate((rows[on_land], np.arange(num_land)))
+        cols = np.concatenate((cols[on_land], np.arange(num_land)))
+        data = np.concatenate((np.ones(np.count_nonzero(on_land)),
+                               -self.dry_squares[self.landscape != 0]))
+        return sparse.csr_matrix((data, (rows, cols)),
+                                 shape=(num_land, num_land))
+
+    def diffusion_solver(self, diffusion, dt):
+        """Return a cached solver of one backward Euler diffusion step.
+
+        The returned function solves the linear system::
+
+            (I - dt*diffusion*L) x = b
+
+        where L is the Laplacian from laplacian(). The matrix is factorised
+        once for every pair of diffusion and dt, so populations with the same
+        parameters share the factorisation.
+
+        :param diffusion: diffusion rate
+        :type diffusion: float
+        :param dt: time step
+        :type dt: float
+        :return: function taking b and returning x, both of length n
+        :rtype: callable
+        """
+        key = (diffusion, dt)
+        if key not in self._solvers:
+            lap = self.laplacian()
+            matrix = sparse.identity(lap.shape[0], format='csc') - \
+                dt * diffusion * lap.tocsc()
+            self._solvers[key] = factorized(matrix.tocsc())
+        return self._solvers[key]
+
+
+def replace_file(source, destination):
+    """Atomically rename source to destination, replacing destination.
+
+    :param source: name of the new file
+    :type source: string
+    :param destination: name of the replaced file
+    :type destination: string
+    """
+    if hasattr(os, 'replace'):
+        os.replace(source, destination)
+    else:  # python 2
+        os.rename(source, destination)
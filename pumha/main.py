@@ -1,6 +1,8 @@
 """Pumas and hares simulation.
 
 Usage: pumha <landscape_file> [<config_file>]
+       pumha --resume=<checkpoint> [<landscape_file>]
+       pumha sweep <landscape_file> <sweep_file> [options]
        pumha (-h | --help | --version)
 
 The program requires landscape file in the following format::
@@ -18,28 +20,62 @@ size grids subject to hardware restrictions.
 If config_file is not provided, the program will display a warning
 and will continue using default values.
 
+Instead of the hare and puma parameters, the config file may declare any
+number of species of a community, see pumha.community. With Ensemble in
+the config file, the program runs that many realisations from different
+random initial densities at once and writes their average densities, see
+pumha.ensemble.
+
+A simulation with Checkpoint_interval in its config file can be continued
+from its last checkpoint with --resume. The configuration is read from the
+checkpoint and the landscape from the file the simulation was started with,
+unless another landscape_file is given.
+
+The sweep command runs a simulation for every combination of parameter
+values of a sweep file on a pool of processes and writes the final average
+densities of all runs to a single table, see pumha.sweep. A sweep
+interrupted before all runs completed is continued by running it again with
+its output directory given by --out.
+
 Arguments::
 
     landscape_file  required argument
     config_file     optional config file
+    sweep_file      parameter values of a sweep
 
 Options::
 
-    -h --help    Show this screen and exit.
-    --version    Print current version
+    -h --help               Show this screen and exit.
+    --version               Print current version
+    --resume=<checkpoint>   Continue a simulation from a checkpoint file
+    --processes=<n>         Number of processes of a sweep, all CPUs if not
+                            given
+    --out=<dir>             Output directory of a sweep, new if not given
+    --batch=<n>             Number of sweep runs advanced together [default: 1]
 """
 
 from __future__ import (absolute_import,
                         division,
                         print_function,
                         unicode_literals)
+import sys
+import json
 from docopt import docopt
 import pkg_resources
 from pumha.pop import (Configuration,
                        PumaPopulation,
-                       HarePopulation)
+                       HarePopulation,
+                       population_seeds,
+                       zeros_grid)
 from pumha.env import Landscape
-from pumha.sim import Simulation
+from pumha.community import Community
+from pumha.sim import Simulation, create_output_dir
+from pumha.ensemble import Ensemble
+from pumha.sweep import run_sweep
+from pumha.monitor import ConvergenceMonitor
+from pumha.checkpoint import load_checkpoint
+from pumha.cache import ResultCache
+from pumha.ppm import fixed_point_scale
 
 
 def main():
@@ -54,26 +90,142 @@ def main():
     arguments = docopt(__doc__, version=version)
     config_file = arguments.get("<config_file>")
     map_file = arguments.get('<landscape_file>')
+    checkpoint_file = arguments.get('--resume')
+
+    if arguments.get('sweep'):
+        sweep(map_file, arguments['<sweep_file>'],
+              arguments.get('--processes'), arguments.get('--out'),
+              int(arguments['--batch']))
+        return
+
+    if checkpoint_file is not None:
+        # random state is restored later by sim.resume()
+        checkpoint = load_checkpoint(checkpoint_file, restore_rng=False)
+        config = Configuration(data=checkpoint['config'])
+        if map_file is None:
+            map_file = checkpoint['landscape_file']
+    else:
+        # creating new simulation
+        config = Configuration(config_file)
+
+    env = Landscape(map_file, packed=config.engine == 'packed')
+
+    if config.species is not None:
+        try:
+            community = Community.from_config(env, config.species,
+                                              config.time_step, config.seed)
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
+        populations = community.populations
+    else:
+        puma_seed, hare_seed = population_seeds(config.seed, 2)
+        # ranks draw the densities of their own strips, so the grids of
+        # the coordinator are only filled by the output
+        densities = [None, None]
+        if config.ranks:
+            densities = [zeros_grid(env.shape, config.scratch_dir)
+                         for _ in range(2)]
+        puma_pop = PumaPopulation(env,
+                                  birth=config.puma_birth,
+                                  death=config.puma_mortality,
+                                  diffusion=config.puma_diffusion,
+                                  dt=config.time_step,
+                                  engine=config.engine,
+                                  scratch_dir=config.scratch_dir,
+                                  seed=puma_seed,
+                                  density=densities[0])
+
+        hare_pop = HarePopulation(env,
+                                  birth=config.hare_birth,
+                                  death=config.hare_predation,
+                                  diffusion=config.hare_diffusion,
+                                  dt=config.time_step,
+                                  engine=config.engine,
+                                  scratch_dir=config.scratch_dir,
+                                  seed=hare_seed,
+                                  density=densities[1])
+
+        for pop in (puma_pop, hare_pop):
+            pop.tile_rows = config.band_rows
+            pop.threads = config.threads
+        populations = [puma_pop, hare_pop]
+
+        if config.ensemble:
+            ensemble = Ensemble(puma_pop, hare_pop, config.ensemble)
+            ensemble.run(config.steps, config.output_interval,
+                         create_output_dir())
+            return
+
+    sim = Simulation(env, *populations)
+    # snapshots of out-of-core densities are not copied to memory
+    sim.async_output = config.async_output and config.scratch_dir is None
+    sim.snapshot_dtype = config.snapshot_dtype
+    if config.ppm_max_density is not None:
+        sim.ppm_scale = fixed_point_scale(config.ppm_max_density)
+    sim.config = config.data
+    sim.checkpoint_freq = config.checkpoint_interval
+    sim.workers = config.workers
+    sim.ranks = config.ranks
+    sim.rank_densities = bool(config.ranks) and config.species is None
+    sim.tile_steps = config.tile_steps
+    if config.cache:
+        sim.cache = ResultCache(config.cache_dir,
+                                int(config.cache_size * 2**20))
+    if checkpoint_file is not None:
+        try:
+            sim.resume(checkpoint_file)
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
+    monitor = None
+    if config.convergence_tolerance is not None:
+        monitor = ConvergenceMonitor(config.convergence_tolerance,
+                                     config.convergence_steps,
+                                     config.convergence_norm)
+
+    if config.adaptive:
+        sim.run_adaptive(config.steps, config.output_interval,
+                         config.tolerance, monitor)
+    else:
+        sim.run(config.steps, config.output_interval, monitor)
+
+
+def sweep(map_file, sweep_file, processes=None, out_dir=None, batch_size=1):
+    """Run a parameter sweep given on the command line.
+
+    :param map_file: name of the landscape file
+    :type map_file: string
+    :param sweep_file: name of the sweep file
+    :type sweep_file: string
+    :param processes: number of processes, all CPUs if None
+    :type processes: string
+    :param out_dir: output directory, a new one if None
+    :type out_dir: string
+    :param batch_size: maximum number of runs advanced together
+    :type batch_size: int
+    """
+    try:
+        with open(sweep_file, 'r') as f:
+            spec = json.load(f)
+    except IOError:
+        print("Sweep file does not exist:\n%s" % sweep_file)
+        sys.exit(1)
+    except ValueError:
+        print("Sweep file is not of json type")
+        sys.exit(1)
+    if processes is not None:
+        processes = int(processes)
+    engine = spec.get("Base", {}).get("Engine")
+    env = Landscape(map_file, packed=engine == 'packed')
+    if out_dir is None:
+        out_dir = create_output_dir()
+    try:
+        run_sweep(env, spec, out_dir, processes, batch_size)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
 
-    # creating new simulation
-    config = Configuration(config_file)
-
-    env = Landscape(map_file)
-
-    puma_pop = PumaPopulation(env,
-                              birth=config.puma_birth,
-                              death=config.puma_mortality,
-                              diffusion=config.puma_diffusion,
-                              dt=config.time_step)
-
-    hare_pop = HarePopulation(env,
-                              birth=config.hare_birth,
-                              death=config.hare_predation,
-                              diffusion=config.hare_diffusion,
-                              dt=config.time_step)
-
-    sim = Simulation(env, puma_pop, hare_pop)
-    sim.run(config.steps, config.output_interval)
 
 if __name__ == "__main__":
     main()
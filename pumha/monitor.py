@@ -0,0 +1,113 @@
+"""Convergence monitor module.
+
+The module contains one class::
+
+    ConvergenceMonitor
+
+The ConvergenceMonitor watches how fast population densities change during
+a simulation, so that a simulation which settled into a steady state can
+be stopped before reaching the requested number of steps.
+"""
+
+from __future__ import (absolute_import,
+                        division,
+                        print_function,
+                        unicode_literals)
+import numpy as np
+
+NORMS = ('max', 'l2')
+
+
+class ConvergenceMonitor(object):
+    """Detect a steady state of populations in a PopulationState.
+
+    After every step the current buffer of a population holds its new
+    density and the next buffer still holds the density before the step,
+    so the change made by the step is found without copying densities.
+    The difference is taken in bands of tile_rows rows of the population,
+    so out-of-core densities are never read into memory as a whole.
+    The rate of change of a population is the max or L2 norm of the
+    difference divided by the time step of the population. A simulation
+    is converged when the largest rate of change over all populations
+    stays below tolerance for num_steps consecutive steps.
+
+    :Example:
+
+        >>> monitor = ConvergenceMonitor(1e-6, num_steps=20)
+        >>> sim.run(100000, 100, monitor)
+
+    :ivar tolerance: largest rate of change of a converged density
+    :vartype tolerance: float
+    :ivar num_steps: number of consecutive steps below tolerance
+    :vartype num_steps: int
+    :ivar norm: norm of density change, one of pumha.monitor.NORMS
+    :vartype norm: string
+    :ivar change: largest rate of change in the last step
+    :vartype change: float
+    :raises ValueError: if the norm is not known
+    """
+
+    def __init__(self, tolerance, num_steps=10, norm='max'):
+        if norm not in NORMS:
+            raise ValueError("Unknown norm: %s" % norm)
+        self.tolerance = tolerance
+        self.num_steps = num_steps
+        self.norm = norm
+        self.change = np.inf
+        self._below = 0
+        self._scratch = None
+
+    def update(self, state):
+        """Record the change of densities made by the last step of state.
+
+        :param state: double buffered densities right after swap()
+        :type state: pumha.state.PopulationState
+        :return: True if the simulation is converged
+        :rtype: bool
+        """
+        change = 0.
+        for pop in state.populations:
+            new = state.current(type(pop))
+            old = state.next(pop)
+            # land vectors of compact states are taken as a single band
+            band_rows = pop.tile_rows if new.ndim > 1 else len(new)
+            band = new[:band_rows]
+            if self._scratch is None or self._scratch.shape != band.shape:
+                self._scratch = np.empty(band.shape, dtype=band.dtype)
+            pop_change = 0.
+            for start in range(0, len(new), band_rows):
+                stop = min(start + band_rows, len(new))
+                diff = np.subtract(new[start:stop], old[start:stop],
+                                   out=self._scratch[:stop - start])
+                if self.norm == 'max':
+                    np.abs(diff, out=diff)
+                    pop_change = max(pop_change, np.amax(diff))
+                else:
+                    flat = diff.reshape(-1)
+                    pop_change += np.dot(flat, flat)
+            if self.norm == 'l2':
+                pop_change = np.sqrt(pop_change)
+            change = max(change, pop_change / pop.dt)
+
+        self.change = change
+        if change < self.tolerance:
+            self._below += 1
+        else:
+            self._below = 0
+        return self.converged()
+
+    def converged(self):
+        """Return True if the tolerance held for the last num_steps steps."""
+        return self._below >= self.num_steps
+
+    def stop_reason(self, timestep):
+        """Return a description of convergence at the given timestep.
+
+        :param timestep: the timestep at which the simulation stopped
+        :type timestep: int
+        :return: stop reason
+        :rtype: string
+        """
+        return ("Converged at step %s: %s rate of change %s below %s for "
+                "%s steps" % (timestep, self.norm, self.change,
+                              self.tolerance, self.num_steps))
@@ -0,0 +1,264 @@
+"""Parallel module.
+
+The module contains one class::
+
+    SharedState
+
+and one function::
+
+    strip_worker
+
+The SharedState class is a drop-in replacement of
+pumha.state.PopulationState which updates populations with a pool of worker
+processes. The padded landscape is split into horizontal strips of rows,
+one per worker, and densities of all populations are held in a single
+multiprocessing.shared_memory block, so workers read the halo rows of their
+neighbours directly from shared memory. Workers advance in lockstep,
+synchronised by a barrier, and the results are identical to a serial
+simulation. A worker which dies or hangs breaks the barrier after a timeout,
+so the pool is terminated instead of waiting forever.
+"""
+
+from __future__ import (absolute_import,
+                        division,
+                        print_function,
+                        unicode_literals)
+import multiprocessing
+from multiprocessing import shared_memory
+from threading import BrokenBarrierError
+import numpy as np
+from pumha.pop import COMPACT_ENGINES, species_indices, split_rows
+
+# seconds a worker or the main process waits for the others to finish
+# a step before the barrier is broken and the pool terminated
+BARRIER_TIMEOUT = 600
+
+
+def strip_worker(populations, shm, shape, species, start, stop, barrier,
+                 stop_event, timeout=BARRIER_TIMEOUT):
+    """Update rows start to stop of all populations until stopped.
+
+    The worker waits at the barrier for the next step, updates its strip
+    from the current to the next buffer and waits at the barrier again for
+    all other workers to finish the step, at most timeout seconds. The wait
+    for the next step has no timeout, as the main process may write output
+    in between. If the stop event is set when a step starts, the worker
+    returns. Any error breaks the barrier, so the main process does not wait
+    forever.
+
+    :param populations: populations of the simulation
+    :type populations: list of pumha.pop.Population types
+    :param shm: shared memory block holding buffers of all populations
+    :type shm: multiprocessing.shared_memory.SharedMemory
+    :param shape: shape of buffers in the block
+    :type shape: tuple of int
+    :param species: indices of puma and hare densities in the buffers
+    :type species: (int, int)
+    :param start: first row of the strip
+    :type start: int
+    :param stop: row after the last row of the strip
+    :type stop: int
+    :param barrier: barrier shared by all workers and the main process
+    :type barrier: multiprocessing.Barrier
+    :param stop_event: event set when the workers should finish
+    :type stop_event: multiprocessing.Event
+    :param timeout: seconds to wait for other workers to finish a step
+    :type timeout: float
+    """
+    buffers = np.ndarray(shape, dtype=float, buffer=shm.buf)
+    P = H = None
+    current = 0
+    try:
+        while True:
+            barrier.wait()
+            if stop_event.is_set():
+                break
+            P = buffers[current, species[0]]
+            H = buffers[current, species[1]]
+            for index, pop in enumerate(populations):
+                pop.advance_rows(P, H, buffers[1 - current, index],
+                                 start, stop)
+            barrier.wait(timeout)
+            current = 1 - current
+    except BrokenBarrierError:
+        pass
+    except Exception:
+        barrier.abort()
+        raise
+    finally:
+        del buffers, P, H
+        shm.close()
+
+
+class SharedState(object):
+    """Density buffers in shared memory updated by worker processes.
+
+    The state has the interface of pumha.state.PopulationState, so it can
+    be used by the simulation, the convergence monitor and output methods
+    in its place. Both buffers of every population, and a grid of zeros
+    standing for a missing puma or hare population, are held in one shared
+    memory block with shape (2, number of populations + 1, rows, cols).
+    Density attributes of populations are views of the current buffers.
+
+    Every worker updates a strip of rows with Population.advance_rows(),
+    reading one halo row of each neighbouring strip. A step starts and ends
+    with a barrier of all workers and the main process, so between steps
+    the main process can read and write the buffers while the workers
+    wait. The result does not depend on the number of workers and matches
+    the vector and packed engines bit for bit.
+
+    Workers are forked where possible, so populations are not copied. The
+    state must be closed to stop the workers and free the shared memory,
+    after which densities of populations are copied back to private
+    arrays. It is best used as a context manager. If a step does not finish
+    within timeout seconds, e.g. because a worker was killed, the workers
+    are terminated and step() raises RuntimeError.
+
+    :Example:
+
+        >>> with SharedState([puma, hare], num_workers=8) as state:
+        ...     for i in range(num_steps):
+        ...         state.step()
+
+    :ivar populations: populations owning the buffers
+    :vartype populations: list of pumha.pop.Population types
+    :ivar compact: always False, buffers are padded grids
+    :vartype compact: bool
+    :ivar strips: rows updated by every worker
+    :vartype strips: list of (int, int)
+    :ivar timeout: seconds to wait for the workers to finish a step
+    :vartype timeout: float
+    :raises ValueError: if a population uses a compact engine
+    :raises RuntimeError: if a worker fails or does not finish a step in \
+            time
+    """
+
+    def __init__(self, populations, num_workers, timeout=BARRIER_TIMEOUT):
+        self.populations = list(populations)
+        self.compact = False
+        self.timeout = timeout
+        for pop in self.populations:
+            if pop.engine in COMPACT_ENGINES:
+                raise ValueError("Parallel simulation works on grids, not "
+                                 "with the %s engine" % pop.engine)
+
+        num_pops = len(self.populations)
+        rows, cols = self.populations[0].density.shape
+        self._shape = (2, num_pops + 1, rows, cols)
+        self._shm = shared_memory.SharedMemory(
+            create=True, size=int(np.prod(self._shape)) * 8)
+        self._buffers = np.ndarray(self._shape, dtype=float,
+                                   buffer=self._shm.buf)
+        self._buffers[:, num_pops] = 0.
+        for index, pop in enumerate(self.populations):
+            self._buffers[0, index] = pop.density
+            self._buffers[1, index] = pop.density
+        self._current = 0
+        species = species_indices(self.populations)
+        self._species = species
+
+        try:
+            context = multiprocessing.get_context('fork')
+        except ValueError:  # platforms without fork
+            context = multiprocessing.get_context()
+        self.strips = split_rows(rows, num_workers)
+        self._barrier = context.Barrier(len(self.strips) + 1)
+        self._stop_event = context.Event()
+        self._workers = [context.Process(target=strip_worker,
+                                         args=(self.populations, self._shm,
+                                               self._shape, species, start,
+                                               stop, self._barrier,
+                                               self._stop_event, timeout))
+                         for start, stop in self.strips]
+        for worker in self._workers:
+            worker.daemon = True
+            worker.start()
+        self._bind()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def current(self, pop_class):
+        """Return density at time t of the first population of pop_class.
+
+        :param pop_class: required population class
+        :type pop_class: extended Population class
+        :return: current density array (array of zeros if not found)
+        :rtype: numpy.ndarray of float type
+        """
+        for index, pop in enumerate(self.populations):
+            if isinstance(pop, pop_class):
+                return self._buffers[self._current, index]
+        return self._buffers[self._current, len(self.populations)]
+
+    def next(self, pop):
+        """Return the buffer holding density of pop before the last step.
+
+        :param pop: population in the state
+        :type pop: pumha.pop.Population
+        :return: next density array
+        :rtype: numpy.ndarray of float type
+        """
+        return self._buffers[1 - self._current, self.populations.index(pop)]
+
+    def step(self):
+        """Advance all populations by one time step in the worker processes.
+
+        :raises RuntimeError: if a worker failed or did not finish the \
+                step in time, the workers are terminated
+        """
+        try:
+            self._barrier.wait(self.timeout)
+            self._barrier.wait(self.timeout)
+        except BrokenBarrierError:
+            self._terminate()
+            raise RuntimeError("A worker process of the parallel simulation "
+                               "failed or did not finish a step in %s s" %
+                               self.timeout)
+        self.swap()
+
+    def swap(self):
+        """Swap current and next buffers of all populations."""
+        self._current = 1 - self._current
+        self._bind()
+
+    def sync(self):
+        """Do nothing, density attributes are views of current buffers."""
+
+    def close(self):
+        """Stop the workers, copy densities out and free shared memory."""
+        if self._shm is None:
+            return
+        self._stop_event.set()
+        try:
+            self._barrier.wait(self.timeout)
+        except BrokenBarrierError:
+            self._terminate()
+        for worker in self._workers:
+            worker.join()
+        for index, pop in enumerate(self.populations):
+            pop.density = np.copy(self._buffers[self._current, index])
+        del self._buffers
+        try:
+            self._shm.close()
+        except BufferError:
+            # views of the buffers are still in use, memory is released
+            # together with them
+            pass
+        self._shm.unlink()
+        self._shm = None
+
+    def _terminate(self):
+        """Terminate all workers and wait for them to exit."""
+        for worker in self._workers:
+            worker.terminate()
+        for worker in self._workers:
+            worker.join()
+
+    def _bind(self):
+        """Point density attributes of populations to current buffers."""
+        for index, pop in enumerate(self.populations):
+            pop.density = self._buffers[self._current, index]
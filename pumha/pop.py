@@ -22,12 +22,259 @@ from __future__ import (absolute_import,
                         unicode_literals)
 import sys
 import os
+import tempfile
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from jsonschema.exceptions import ValidationError
 from jsonschema import validate
 import numpy as np
 import simplejson as json
 
+# update engines understood by Population.advance()
+#   vector - whole grid array-at-a-time update (default)
+#   loop   - reference per-square update using update_density_ij()
+#   land   - gather based update of land vectors (compact representation)
+#   sparse - update of land vectors using sparse Laplacian of the landscape
+#   imex   - implicit diffusion and explicit reaction step of land vectors,
+#            stable for any time step
+#   packed - vector update done in bands of rows, reading only the packed
+#            land mask and neighbour counts of the landscape
+#   threads - vector update done in blocks of rows by a pool of threads
+#   tiled  - vector update, advanced several steps at a time in small tiles
+#            of the grid by pumha.tiled.TiledState
+ENGINES = ('vector', 'loop', 'land', 'sparse', 'imex', 'packed', 'threads',
+           'tiled')
+DEFAULT_ENGINE = 'vector'
+# engines working on land vectors instead of padded grids
+COMPACT_ENGINES = ('land', 'sparse', 'imex')
+# rows updated at once by the packed engine, also used as the height of
+# bands in which out-of-core density grids are filled and compared
+DEFAULT_TILE_ROWS = 256
+# shape of tiles and number of steps a tile is advanced at once by the tiled
+# engine, a density tile of 64 x 512 squares takes 256 kB, so the tiles of
+# both species and the landscape stay in a typical L2 or L3 cache
+DEFAULT_TILE_SHAPE = (64, 512)
+DEFAULT_TILE_STEPS = 4
+# squares in a band of rows of the fused puma and hare update, bands of
+# both species with their temporaries stay in the cache
+FUSED_BAND_SQUARES = 32768
+# values of a default configuration file, see Configuration.create_config()
+DEFAULT_CONFIG = {
+    'Hare_birth': 0.08,
+    'Hare_predation': 0.04,
+    'Hare_diffusion': 0.2,
+    'Puma_birth': 0.02,
+    'Puma_mortality': 0.06,
+    'Puma_diffusion': 0.2,
+    'Time_step': 0.4,
+    'Steps': 100,
+    'Output_interval': 8
+}
+# JSON schema of a configuration file, see Configuration.valid_config()
+CONFIG_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "Hare_birth": {"type": "number"},
+        "Hare_predation": {"type": "number"},
+        "Hare_diffusion": {"type": "number"},
+        "Puma_birth": {"type": "number"},
+        "Puma_mortality": {"type": "number"},
+        "Puma_diffusion": {"type": "number"},
+        "Time_step": {"type": "number"},
+        "Steps": {"type": "number"},
+        "Output_interval": {"type": "number"},
+        "Engine": {"type": "string"},
+        "Adaptive": {"type": "boolean"},
+        "Tolerance": {"type": "number"},
+        "Convergence_tolerance": {"type": "number"},
+        "Convergence_steps": {"type": "number"},
+        "Convergence_norm": {"enum": ["max", "l2"]},
+        "Async_output": {"type": "boolean"},
+        "Snapshot_dtype": {"enum": ["float32", "float64"]},
+        "Ppm_max_density": {"type": "number", "exclusiveMinimum": 0},
+        "Checkpoint_interval": {"type": "number"},
+        "Scratch_dir": {"type": "string"},
+        "Band_rows": {"type": "integer", "minimum": 1},
+        "Workers": {"type": "integer", "minimum": 1},
+        "Ranks": {"type": "integer", "minimum": 1},
+        "Threads": {"type": "integer", "minimum": 1},
+        "Tile_steps": {"type": "integer", "minimum": 1},
+        "Seed": {"type": "integer", "minimum": 0},
+        "Ensemble": {"type": "integer", "minimum": 1},
+        "Cache": {"type": "boolean"},
+        "Cache_dir": {"type": "string"},
+        "Cache_size": {"type": "number"},
+        "Species": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "Name": {"type": "string"},
+                    "Growth": {"type": "number"},
+                    "Diffusion": {"type": "number"},
+                    "Interactions": {
+                        "type": "object",
+                        "additionalProperties": {"type": "number"},
+                    },
+                },
+                "required": ["Name", "Growth", "Diffusion"],
+            },
+        },
+    },
+}
+# rows of a band of initial densities drawn from its own random stream of
+# a seeded population, fixed so densities do not depend on thread counts
+SEED_BAND_ROWS = 256
+# thread pools of the threads engine keyed by the number of threads
+_THREAD_POOLS = {}
+
+
+def split_rows(rows, num_strips):
+    """Split interior rows of a padded grid into strips of similar height.
+
+    :param rows: number of rows of the padded grid
+    :type rows: int
+    :param num_strips: number of strips
+    :type num_strips: int
+    :return: first row and row after the last row of every strip, strips \
+            without rows are left out
+    :rtype: list of (int, int)
+    """
+    bounds = np.linspace(1, rows - 1, num_strips + 1).round().astype(int)
+    return [(int(start), int(stop))
+            for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+
+
+def species_indices(populations):
+    """Return indices of the first puma and hare populations in a list.
+
+    A missing species gets the index len(populations), which states use
+    for an array of zeros standing in for its density.
+
+    :param populations: populations of a simulation
+    :type populations: list of pumha.pop.Population types
+    :return: index of the puma and of the hare population
+    :rtype: (int, int)
+    """
+    return tuple(next((index for index, pop in enumerate(populations)
+                       if isinstance(pop, pop_class)), len(populations))
+                 for pop_class in (PumaPopulation, HarePopulation))
+
+
+def can_fuse(populations):
+    """Return True if populations can be updated with advance_fused().
+
+    :param populations: populations of a simulation
+    :type populations: list of pumha.pop.Population types
+    :rtype: bool
+    """
+    if len(populations) != 2:
+        return False
+    puma, hare = species_indices(populations)
+    return (puma < 2 and hare < 2 and
+            all(pop.engine == 'vector' for pop in populations) and
+            populations[0]._env is populations[1]._env)
+
+
+def advance_fused(puma, hare, P, H, P_out, H_out):
+    """Update pumas and hares together in bands of rows.
+
+    Both populations are updated band by band, so the bands of P, H and of
+    the landscape are read from memory once and used by both populations
+    while they are in the cache, instead of streaming whole grids twice.
+    Every band is updated with Population.advance_window(), so the result
+    matches two separate vector updates bit for bit.
+
+    :param puma: puma population
+    :type puma: pumha.pop.PumaPopulation
+    :param hare: hare population living in the same landscape
+    :type hare: pumha.pop.HarePopulation
+    :param P: density array of pumas at time t
+    :type P: numpy.ndarray of float type
+    :param H: density array of hares at time t
+    :type H: numpy.ndarray of float type
+    :param P_out: density array of pumas at t+dt
+    :type P_out: numpy.ndarray of float type
+    :param H_out: density array of hares at t+dt
+    :type H_out: numpy.ndarray of float type
+    """
+    rows, cols = P.shape
+    N = puma._N
+    mask = puma._land_mask
+    band_rows = max(1, FUSED_BAND_SQUARES // cols)
+    for first in range(1, rows - 1, band_rows):
+        # the band with one halo row above and below
+        window = slice(first - 1, min(first + band_rows, rows - 1) + 1)
+        P_band = P[window]
+        H_band = H[window]
+        N_band = N[window]
+        mask_band = mask[window]
+        puma.advance_window(P_band, H_band, P_out[window], N_band, mask_band)
+        hare.advance_window(P_band, H_band, H_out[window], N_band, mask_band)
+
+
+def population_seeds(seed, num_populations):
+    """Return independent seed sequences of populations from one seed.
+
+    :param seed: seed of a simulation, e.g. the Seed of a configuration
+    :type seed: int or numpy.random.SeedSequence
+    :param num_populations: number of populations
+    :type num_populations: int
+    :return: seed sequence of every population, None for every population \
+            if seed is None
+    :rtype: list of numpy.random.SeedSequence
+    """
+    if seed is None:
+        return [None] * num_populations
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    return seed.spawn(num_populations)
+
+
+def thread_pool(num_threads):
+    """Return a thread pool with num_threads threads, shared by populations.
+
+    Pools are created on first use and kept for the life of the process,
+    so the threads engine does not start threads every step.
+
+    :param num_threads: number of threads of the pool
+    :type num_threads: int
+    :return: thread pool
+    :rtype: concurrent.futures.ThreadPoolExecutor
+    """
+    if num_threads not in _THREAD_POOLS:
+        _THREAD_POOLS[num_threads] = ThreadPoolExecutor(num_threads)
+    return _THREAD_POOLS[num_threads]
+
+
+def zeros_grid(shape, scratch_dir=None):
+    """Return a float grid of zeros, in memory or backed by a scratch file.
+
+    With scratch_dir the grid is a numpy.memmap of a new file in the
+    directory. The file is removed right away where the platform allows it,
+    the mapping keeps the data until the grid is garbage collected, so no
+    scratch files are left behind.
+
+    :param shape: shape of the grid
+    :type shape: (int, int)
+    :param scratch_dir: directory of the scratch file, in memory if None
+    :type scratch_dir: string
+    :return: grid of zeros
+    :rtype: numpy.ndarray or numpy.memmap of float type
+    """
+    if scratch_dir is None:
+        return np.zeros(shape, dtype=float)
+    handle, filename = tempfile.mkstemp(suffix='.dat', prefix='pumha_',
+                                        dir=scratch_dir)
+    os.close(handle)
+    # a new file is filled with zeros by memmap
+    grid = np.memmap(filename, dtype=float, mode='w+', shape=tuple(shape))
+    try:
+        os.remove(filename)
+    except OSError:  # files in use can not be removed on Windows
+        pass
+    return grid
+
 
 class Configuration(object):
     """Class for loading simulation parameters.
@@ -42,7 +289,11 @@ class Configuration(object):
     :vartype filename: string
     """
 
-    def __init__(self, config_file):
+    def __init__(self, config_file=None, data=None):
+        if data is not None:
+            # configuration stored with simulation results, e.g. a checkpoint
+            self.load_from_dict(data)
+            return
 
         if config_file is None:
             directory = os.path.dirname(os.path.abspath(__file__))
@@ -91,17 +342,33 @@ class Configuration(object):
                 print("Config file is not of json type")
                 sys.exit(1)
 
+        self.load_from_dict(config)
+
+    def load_from_dict(self, config):
+        """Load configuration values from a dictionary.
+
+        The dictionary is kept as the data attribute, so the configuration
+        can be stored together with simulation results, e.g. in
+        a checkpoint.
+
+        :param config: configuration values keyed by config file keys
+        :type config: dict
+        """
+        self.data = config
         for key in config:
             value = config[key]
             print("{} ({})".format(key, value))
 
+        # species of a community replace the hare and puma parameters
+        self.species = config.get("Species")
         try:
-            self.hare_birth = config["Hare_birth"]
-            self.hare_predation = config["Hare_predation"]
-            self.hare_diffusion = config["Hare_diffusion"]
-            self.puma_birth = config["Puma_birth"]
-            self.puma_mortality = config["Puma_mortality"]
-            self.puma_diffusion = config["Puma_diffusion"]
+            if self.species is None:
+                self.hare_birth = config["Hare_birth"]
+                self.hare_predation = config["Hare_predation"]
+                self.hare_diffusion = config["Hare_diffusion"]
+                self.puma_birth = config["Puma_birth"]
+                self.puma_mortality = config["Puma_mortality"]
+                self.puma_diffusion = config["Puma_diffusion"]
             self.time_step = config["Time_step"]
             self.steps = config["Steps"]
             self.output_interval = config["Output_interval"]
@@ -111,6 +378,74 @@ class Configuration(object):
             print('Try \'pumha --help\' for help')
             sys.exit(1)
 
+        # optional keys, older config files do not have them
+        self.engine = config.get("Engine", DEFAULT_ENGINE)
+        self.adaptive = config.get("Adaptive", False)
+        self.tolerance = config.get("Tolerance", 1e-3)
+        self.convergence_tolerance = config.get("Convergence_tolerance")
+        self.convergence_steps = config.get("Convergence_steps", 10)
+        self.convergence_norm = config.get("Convergence_norm", 'max')
+        self.async_output = config.get("Async_output", True)
+        self.snapshot_dtype = config.get("Snapshot_dtype")
+        # highest density expected in PPM files, None for the default scale
+        self.ppm_max_density = config.get("Ppm_max_density")
+        self.checkpoint_interval = config.get("Checkpoint_interval")
+        self.scratch_dir = config.get("Scratch_dir")
+        self.band_rows = config.get("Band_rows", DEFAULT_TILE_ROWS)
+        self.workers = config.get("Workers")
+        self.ranks = config.get("Ranks")
+        self.threads = config.get("Threads")
+        self.tile_steps = config.get("Tile_steps", DEFAULT_TILE_STEPS)
+        self.seed = config.get("Seed")
+        self.ensemble = config.get("Ensemble")
+        self.cache = config.get("Cache", True)
+        self.cache_dir = config.get("Cache_dir")
+        # size limit of the result cache in megabytes
+        self.cache_size = config.get("Cache_size", 1024)
+        if self.engine not in ENGINES:
+            print("Unknown engine in a config file: %s" % self.engine)
+            print("Available engines: %s" % ', '.join(ENGINES))
+            sys.exit(1)
+        if self.scratch_dir is not None and self.engine != 'packed':
+            print("Scratch_dir requires the packed engine")
+            sys.exit(1)
+        if self.ranks and self.convergence_tolerance:
+            print("Ranks can not be used with a convergence tolerance")
+            sys.exit(1)
+        if self.adaptive and self.engine == 'imex':
+            print("Adaptive time steps require an explicit engine, not imex")
+            sys.exit(1)
+        if self.adaptive and (self.workers or self.ranks or
+                              self.checkpoint_interval or
+                              self.engine == 'tiled'):
+            print("Adaptive time steps can not be used with workers, ranks, "
+                  "checkpoints or the tiled engine")
+            sys.exit(1)
+        if self.species is not None and (self.adaptive or
+                                         self.convergence_tolerance):
+            print("Species can not be used with adaptive time steps or "
+                  "a convergence tolerance")
+            sys.exit(1)
+        if self.species is not None and (self.workers or self.ranks or
+                                         self.engine != DEFAULT_ENGINE):
+            print("Species are updated together with the %s engine and can "
+                  "not be used with another engine, workers or ranks" %
+                  DEFAULT_ENGINE)
+            sys.exit(1)
+        if self.ensemble and (self.species is not None or self.adaptive or
+                              self.convergence_tolerance):
+            print("Ensemble can not be used with species, adaptive time "
+                  "steps or a convergence tolerance")
+            sys.exit(1)
+        if self.ensemble and (self.engine != 'vector' or self.workers or
+                              self.ranks or self.checkpoint_interval or
+                              self.snapshot_dtype is not None or
+                              self.scratch_dir is not None):
+            print("Ensemble members are updated with the vector engine and "
+                  "can not be used with another engine, workers, ranks, "
+                  "checkpoints, snapshots or a scratch directory")
+            sys.exit(1)
+
     def create_config(self, config_file):
         """Create a default configuration file with some standard values.
 
@@ -122,21 +457,10 @@ class Configuration(object):
         :param config_file: Name of file containing coniguration
         :type config_file: String
         """
-        default = {
-            'Hare_birth': 0.08,
-            'Hare_predation': 0.04,
-            'Hare_diffusion': 0.2,
-            'Puma_birth': 0.02,
-            'Puma_mortality': 0.06,
-            'Puma_diffusion': 0.2,
-            'Time_step': 0.4,
-            'Steps': 100,
-            'Output_interval': 8
-        }
-
         try:
             with open(config_file, 'w') as outfile:
-                json.dump(default, outfile, sort_keys=True, indent=4*' ')
+                json.dump(DEFAULT_CONFIG, outfile, sort_keys=True,
+                          indent=4*' ')
                 print("New config file created:\n%s\n" % config_file)
         except:
             print("Something went wrong...")
@@ -151,25 +475,10 @@ class Configuration(object):
         :param config_file: Name of file containing coniguration
         :type config_file: String
         """
-        schema = {
-            "type": "object",
-            "properties": {
-                "Hare_birth": {"type": "number"},
-                "Hare_predation": {"type": "number"},
-                "Hare_diffusion": {"type": "number"},
-                "Puma_birth": {"type": "number"},
-                "Puma_mortality": {"type": "number"},
-                "Puma_diffusion": {"type": "number"},
-                "Time_step": {"type": "number"},
-                "Steps": {"type": "number"},
-                "Output_interval": {"type": "number"},
-            },
-        }
-
         with open(config_file, 'r') as f:
             config = json.load(f, object_pairs_hook=OrderedDict)
         try:
-            validate(config, schema)
+            validate(config, CONFIG_SCHEMA)
         except ValidationError as ve:
             print('Invalid configuration file format.:\n%s' % str(ve))
             print('Try \'pumha --help\' for help')
@@ -196,40 +505,155 @@ class Population(object):
     :ivar dt: time step in arbitrary units
     :vartype dt: float
     :ivar density: population density in a given landscape \
-            initialized at random
+            initialized at random, unless an initial density grid is given
     :vartype density: numpy.ndarray containing data with float type
+    :ivar engine: name of the update engine used by advance(), \
+            one of pumha.pop.ENGINES
+    :vartype engine: string
+    :ivar tile_rows: number of rows updated at once by the packed engine
+    :vartype tile_rows: int
+    :ivar threads: number of threads of the threads engine, the number of \
+            CPUs if None
+    :vartype threads: int
+    :ivar scratch_dir: directory of scratch files backing density grids \
+            of an out-of-core population, densities are held in memory \
+            if None
+    :vartype scratch_dir: string
+    :ivar seed: seed sequence of the random initial densities, the global \
+            numpy random generator is used if None
+    :vartype seed: numpy.random.SeedSequence
     """
 
+    tile_rows = DEFAULT_TILE_ROWS
+    threads = None
+
     def __init__(self, landscape_inp, birth, death,
-                 diffusion, min_ro, max_ro, dt):
+                 diffusion, min_ro, max_ro, dt, engine=DEFAULT_ENGINE,
+                 scratch_dir=None, seed=None, density=None):
+        self.scratch_dir = scratch_dir
+        if seed is not None and not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        self.seed = seed
         self.min_ro = min_ro
         self.max_ro = max_ro
         self.birth = birth
         self.death = death
         self.diffusion = diffusion
         self.dt = dt
-        self.density = self.random_density(landscape_inp)
-        self._N = landscape_inp.dry_squares
-        self._landscape = landscape_inp.landscape
-        self._land_idx = landscape_inp.land_indices
-
-    def random_density(self, landscape_inp):
+        self.engine = engine
+        if density is None:
+            density = self.random_density(landscape_inp)
+        self.density = density
+        self._env = landscape_inp
+        self._mask = None
+        self._N_land_cache = None
+        self._workspace = None
+
+    # landscape arrays are looked up on first use, so populations using
+    # the packed engine never unpack the whole landscape
+    @property
+    def _N(self):
+        return self._env.dry_squares
+
+    @property
+    def _landscape(self):
+        return self._env.landscape
+
+    @property
+    def _land_idx(self):
+        return self._env.land_indices
+
+    @property
+    def _land_mask(self):
+        if self._mask is None:
+            self._mask = self._env.landscape.astype(bool)
+        return self._mask
+
+    @property
+    def _N_land(self):
+        if self._N_land_cache is None:
+            self._N_land_cache = self._env.dry_squares[self._land_mask]
+        return self._N_land_cache
+
+    def random_density(self, landscape_inp, rows=None, first_row=0):
         """Assign a random density between min and max ro to every land square.
 
         Returns a grid with a random density assigned
         between minimum and maximum densities for every land square.
+        The grid is filled in bands of tile_rows rows, drawing random
+        numbers in the order of land squares, so the densities do not depend
+        on the band height. If scratch_dir is set, the grid is backed by
+        a scratch file (see zeros_grid()).
+
+        Without a seed, numbers are drawn from the global numpy random
+        generator. A seeded population draws every band of SEED_BAND_ROWS
+        rows from its own stream spawned from the seed sequence instead,
+        so bands are filled in parallel by threads (as many as the threads
+        engine uses) and the grid is the same for any number of threads.
+        Every call spawns new streams, so later calls give new densities.
+
+        If rows are given, only rows start to stop of the grid are drawn,
+        e.g. by a rank of a distributed simulation. Landscape_inp then holds
+        the rows of the whole landscape from first_row on, at least up to
+        the end of the last band of SEED_BAND_ROWS rows overlapping the
+        rows. Rows of a seeded population hold the same densities as in
+        a grid drawn at once with the same seed sequence.
 
         :param landscape_inp: Instance of a Landscape object
         :type landscape_inp: Landscape
+        :param rows: first row and the row after the last row drawn, \
+                all rows of landscape_inp if None
+        :type rows: (int, int)
+        :param first_row: row of the whole landscape landscape_inp starts at
+        :type first_row: int
         :return: a 2D array of random densities
         :rtype: numpy.ndarray of float type
         """
         min_ro = self.min_ro
         max_ro = self.max_ro
-        grid = landscape_inp.landscape.astype(np.float)
-        # assigning a random density to every land square
-        grid[grid == 1] = np.random.uniform(min_ro, max_ro,
-                                            grid[grid == 1].shape)
+        end = first_row + landscape_inp.shape[0]
+        start, stop = rows if rows is not None else (first_row, end)
+        grid = zeros_grid((stop - start, landscape_inp.shape[1]),
+                          self.scratch_dir)
+        if self.seed is None:
+            for band in range(start, stop, self.tile_rows):
+                band_stop = min(band + self.tile_rows, stop)
+                land = landscape_inp.unpack_rows(band - first_row,
+                                                 band_stop - first_row)
+                # assigning a random density to every land square
+                grid[band - start:band_stop - start][land] = \
+                    np.random.uniform(min_ro, max_ro, np.count_nonzero(land))
+            return grid
+
+        # bands above the rows are spawned, but not drawn
+        starts = range(0, stop, SEED_BAND_ROWS)
+        streams = self.seed.spawn(len(starts))
+
+        def fill_band(band, stream):
+            band_stop = min(band + SEED_BAND_ROWS, end)
+            if band_stop <= start:
+                return
+            land = landscape_inp.unpack_rows(band - first_row,
+                                             band_stop - first_row)
+            generator = np.random.Generator(np.random.PCG64(stream))
+            values = generator.uniform(min_ro, max_ro,
+                                       np.count_nonzero(land))
+            if start <= band and band_stop <= stop:
+                grid[band - start:band_stop - start][land] = values
+            else:
+                # band cut by the rows, drawn whole to keep the stream order
+                drawn = np.zeros(land.shape)
+                drawn[land] = values
+                grid[max(band, start) - start:min(band_stop, stop) - start] \
+                    = drawn[max(start - band, 0):min(stop, band_stop) - band]
+
+        num_threads = min(self.threads or os.cpu_count() or 1, len(starts))
+        if num_threads > 1:
+            # consumed, so errors of the threads are raised here
+            list(thread_pool(num_threads).map(fill_band, starts, streams))
+        else:
+            for band, stream in zip(starts, streams):
+                fill_band(band, stream)
         return grid
 
     def load_config(self, birth, death, diffusion, dt):
@@ -269,6 +693,359 @@ class Population(object):
                      isinstance(p, pop_class)), np.zeros((rows, cols),
                                                          dtype=float))
 
+    def update_density(self, populations_old, populations_new):
+        r"""Update density array of a population instance.
+
+        Method updates entire density array of a population instance based
+        on densities of current populations living in a landscape. Only land
+        squares in the density array are updated.
+
+        :param populations_old: list of populations at current timestep
+        :type populations_old: list of Population type
+        :param populations_new: list of populations with updated \
+                density array at t+dt
+        :type populations_new: list of Population type
+        """
+        # extract required populations density arrays for update
+        X_new = self.find_density_arr(type(self), populations_new)
+        P = self.find_density_arr(PumaPopulation, populations_old)
+        H = self.find_density_arr(HarePopulation, populations_old)
+
+        self.advance(P, H, X_new)
+
+    def advance(self, P, H, out):
+        """Write density at t+dt into out using the instance engine.
+
+        Engines from COMPACT_ENGINES expect land vectors (see
+        pumha.env.Landscape) in place of padded density grids.
+
+        All explicit engines give identical results as long as out is
+        a different array from P and H. The sparse engine sums the stencil
+        in a different order and agrees with the others to rounding error.
+        The imex engine uses a different (implicit) time discretisation of
+        diffusion, so it agrees with the others to the order of dt. The
+        vector engine evaluates the same expression as update_density_ij()
+        with the same order of floating point operations, so the two engines
+        agree bit for bit. If out is the density array at time t itself, the
+        loop engine reads squares that were already updated in the current
+        sweep, while the vector engine does not.
+
+        :param P: density array of pumas at time t
+        :type P: numpy.ndarray of float type
+        :param H: density array of hares at time t
+        :type H: numpy.ndarray of float type
+        :param out: density array of the population at t+dt
+        :type out: numpy.ndarray of float type
+        :raises ValueError: if the engine is not known
+        """
+        if self.engine == 'loop':
+            for i, j in self._land_idx:
+                out[i][j] = self.update_density_ij(i, j, P, H)
+        elif self.engine in ('vector', 'tiled'):
+            # a single step of a tiled population is a vector update
+            self.advance_vector(P, H, out)
+        elif self.engine == 'land':
+            self.advance_land(P, H, out)
+        elif self.engine == 'sparse':
+            self.advance_sparse(P, H, out)
+        elif self.engine == 'imex':
+            self.advance_imex(P, H, out)
+        elif self.engine == 'packed':
+            self.advance_packed(P, H, out)
+        elif self.engine == 'threads':
+            self.advance_threads(P, H, out)
+        else:
+            raise ValueError("Unknown engine: %s" % self.engine)
+
+    def advance_vector(self, P, H, out):
+        """Update all land squares at once using array slicing.
+
+        The 5-point stencil is evaluated on the interior of the padded grid,
+        where shifted slices give the four neighbours of every square.
+        Negative densities are clamped to zero and only land squares of out
+        are written, water squares are left untouched.
+
+        :param P: density array of pumas at time t
+        :type P: numpy.ndarray of float type
+        :param H: density array of hares at time t
+        :type H: numpy.ndarray of float type
+        :param out: density array of the population at t+dt
+        :type out: numpy.ndarray of float type
+        """
+        self.advance_window(P, H, out, self._N, self._land_mask)
+
+    def advance_window(self, P, H, out, N, mask):
+        """Update land squares of the interior of a window of the grid.
+
+        Evaluates the expression of advance_vector() on arrays holding
+        a rectangular window of the padded grid, whose first and last rows
+        and columns are only read as halos. Used by the tiled state of
+        pumha.tiled, which updates small windows several steps at a time.
+        Densities may be stacks of windows with leading axes, e.g. members
+        of a pumha.ensemble.Ensemble, which are updated at once with the
+        same landscape window.
+
+        :param P: window of puma densities at time t
+        :type P: numpy.ndarray of float type
+        :param H: window of hare densities at time t
+        :type H: numpy.ndarray of float type
+        :param out: window of densities of the population at t+dt
+        :type out: numpy.ndarray of float type
+        :param N: window of dry squares (see pumha.env.Landscape)
+        :type N: numpy.ndarray of float type
+        :param mask: window of the land mask
+        :type mask: numpy.ndarray of bool type
+        """
+        X = self.own_density(P, H)
+        X_c = X[..., 1:-1, 1:-1]
+        lap = ((X[..., :-2, 1:-1] + X[..., 2:, 1:-1] + X[..., 1:-1, :-2] +
+                X[..., 1:-1, 2:]) - N[1:-1, 1:-1] * X_c)
+        new = X_c + self.dt * (self.reaction(P[..., 1:-1, 1:-1],
+                                             H[..., 1:-1, 1:-1]) +
+                               self.diffusion * lap)
+        new = np.where(new > 0, new, 0.)
+        np.copyto(out[..., 1:-1, 1:-1], new, where=mask[1:-1, 1:-1])
+
+    def advance_packed(self, P, H, out):
+        """Update land squares in bands of tile_rows rows.
+
+        Every band evaluates the same expression as advance_vector(), with
+        the land mask of the band unpacked from the bit-packed mask of the
+        landscape and uint8 neighbour counts in place of the float dry
+        squares, so the two engines agree bit for bit. Bands without land
+        are skipped. Full landscape arrays are never used, so apart from
+        the densities the engine needs about 1.125 bytes per square.
+
+        :param P: density array of pumas at time t
+        :type P: numpy.ndarray of float type
+        :param H: density array of hares at time t
+        :type H: numpy.ndarray of float type
+        :param out: density array of the population at t+dt
+        :type out: numpy.ndarray of float type
+        """
+        self.advance_rows(P, H, out, 1, out.shape[0] - 1)
+
+    def advance_rows(self, P, H, out, start, stop):
+        """Update land squares of rows start to stop of a padded grid.
+
+        Rows are updated in bands of tile_rows rows as in advance_packed().
+        Only rows start to stop of out are written and rows start-1 and
+        stop of P and H are read as halos, so strips of rows can be updated
+        independently, e.g. by parallel workers, giving the same result as
+        a single update of the whole grid.
+
+        :param P: density array of pumas at time t
+        :type P: numpy.ndarray of float type
+        :param H: density array of hares at time t
+        :type H: numpy.ndarray of float type
+        :param out: density array of the population at t+dt
+        :type out: numpy.ndarray of float type
+        :param start: first updated row, at least 1
+        :type start: int
+        :param stop: row after the last updated row, at most rows-1
+        :type stop: int
+        """
+        env = self._env
+        X = self.own_density(P, H)
+        for first in range(start, stop, self.tile_rows):
+            last = min(first + self.tile_rows, stop)
+            if not env.mask_bits[first:last].any():
+                continue
+            band = slice(first, last)
+            X_c = X[band, 1:-1]
+            lap = ((X[first - 1:last - 1, 1:-1] + X[first + 1:last + 1, 1:-1] +
+                    X[band, :-2] + X[band, 2:]) -
+                   env.neighbour_counts[band, 1:-1] * X_c)
+            new = X_c + self.dt * (self.reaction(P[band, 1:-1],
+                                                 H[band, 1:-1]) +
+                                   self.diffusion * lap)
+            new = np.where(new > 0, new, 0.)
+            np.copyto(out[band, 1:-1], new,
+                      where=env.unpack_rows(first, last)[:, 1:-1])
+
+    def advance_threads(self, P, H, out):
+        """Update land squares in blocks of rows on a pool of threads.
+
+        The interior rows are split into one block per thread and every
+        block evaluates the same expression as advance_vector(), in the
+        same order of floating point operations, so the two engines agree
+        bit for bit. Numpy releases the GIL in its loops, so blocks are
+        updated in parallel. Temporaries of every block are allocated once
+        and reused with out= arguments, so a step allocates no arrays.
+
+        :param P: density array of pumas at time t
+        :type P: numpy.ndarray of float type
+        :param H: density array of hares at time t
+        :type H: numpy.ndarray of float type
+        :param out: density array of the population at t+dt
+        :type out: numpy.ndarray of float type
+        """
+        num_threads = self.threads or os.cpu_count() or 1
+        rows, cols = out.shape
+        key = (rows, cols, num_threads)
+        if self._workspace is None or self._workspace[0] != key:
+            blocks = [(start, stop, {'lap': np.empty((stop - start, cols - 2)),
+                                     'tmp': np.empty((stop - start, cols - 2)),
+                                     'new': np.empty((stop - start, cols - 2)),
+                                     'clip': np.empty((stop - start, cols - 2),
+                                                      dtype=bool)})
+                      for start, stop in split_rows(rows, num_threads)]
+            self._workspace = (key, blocks)
+        futures = [thread_pool(num_threads).submit(self.advance_block, P, H,
+                                                   out, start, stop, work)
+                   for start, stop, work in self._workspace[1]]
+        for future in futures:
+            # raises an error of the block, if any
+            future.result()
+
+    def advance_block(self, P, H, out, start, stop, work):
+        """Update land squares of rows start to stop for advance_threads().
+
+        :param P: density array of pumas at time t
+        :type P: numpy.ndarray of float type
+        :param H: density array of hares at time t
+        :type H: numpy.ndarray of float type
+        :param out: density array of the population at t+dt
+        :type out: numpy.ndarray of float type
+        :param start: first updated row, at least 1
+        :type start: int
+        :param stop: row after the last updated row, at most rows-1
+        :type stop: int
+        :param work: temporaries 'lap', 'tmp', 'new' and 'clip' with the \
+                shape of the interior of the rows
+        :type work: dict of numpy.ndarray
+        """
+        lap, tmp, new = work['lap'], work['tmp'], work['new']
+        clip = work['clip']
+        X = self.own_density(P, H)
+        band = slice(start, stop)
+        X_c = X[band, 1:-1]
+        np.add(X[start - 1:stop - 1, 1:-1], X[start + 1:stop + 1, 1:-1],
+               out=lap)
+        np.add(lap, X[band, :-2], out=lap)
+        np.add(lap, X[band, 2:], out=lap)
+        np.multiply(self._N[band, 1:-1], X_c, out=tmp)
+        np.subtract(lap, tmp, out=lap)
+        np.multiply(self.diffusion, lap, out=lap)
+        self.reaction_into(P[band, 1:-1], H[band, 1:-1], new, tmp)
+        np.add(new, lap, out=new)
+        np.multiply(self.dt, new, out=new)
+        np.add(X_c, new, out=new)
+        # negative densities (and nan, as in advance_vector()) become zero
+        np.greater(new, 0, out=clip)
+        np.logical_not(clip, out=clip)
+        np.copyto(new, 0., where=clip)
+        np.copyto(out[band, 1:-1], new, where=self._land_mask[band, 1:-1])
+
+    def advance_land(self, P, H, out):
+        """Update all land squares of land vectors.
+
+        Neighbour densities are gathered with the neighbour table of the
+        landscape, water neighbours read the zero last element of a land
+        vector. The last element of out is not written.
+
+        :param P: land vector of puma densities at time t
+        :type P: numpy.ndarray of float type
+        :param H: land vector of hare densities at time t
+        :type H: numpy.ndarray of float type
+        :param out: land vector of the population density at t+dt
+        :type out: numpy.ndarray of float type
+        """
+        X = self.own_density(P, H)
+        nbr = self._env.neighbour_table
+        X_c = X[:-1]
+        lap = ((X[nbr[0]] + X[nbr[1]] + X[nbr[2]] + X[nbr[3]]) -
+               self._N_land * X_c)
+        new = X_c + self.dt * (self.reaction(P[:-1], H[:-1]) +
+                               self.diffusion * lap)
+        out[:-1] = np.where(new > 0, new, 0.)
+
+    def advance_sparse(self, P, H, out):
+        """Update all land squares of land vectors using sparse Laplacian.
+
+        Diffusion term is a single sparse matrix-vector product with the
+        Laplacian cached by the landscape. The last element of out is not
+        written.
+
+        :param P: land vector of puma densities at time t
+        :type P: numpy.ndarray of float type
+        :param H: land vector of hare densities at time t
+        :type H: numpy.ndarray of float type
+        :param out: land vector of the population density at t+dt
+        :type out: numpy.ndarray of float type
+        """
+        X_c = self.own_density(P, H)[:-1]
+        lap = self._env.laplacian().dot(X_c)
+        new = X_c + self.dt * (self.reaction(P[:-1], H[:-1]) +
+                               self.diffusion * lap)
+        out[:-1] = np.where(new > 0, new, 0.)
+
+    def advance_imex(self, P, H, out):
+        """Update all land squares of land vectors with an IMEX step.
+
+        Reaction term is treated explicitly (forward Euler) and diffusion
+        implicitly (backward Euler)::
+
+            (I - dt*l*L) X(t+dt) = X(t) + dt*R(P(t), H(t))
+
+        where L is the Laplacian of the landscape, l is diffusion rate and R
+        is the reaction term. Diffusion part is unconditionally stable, so dt
+        is only limited by the reaction term and the required accuracy.
+        The factorised matrix is cached by the landscape for every pair of
+        diffusion and dt. The last element of out is not written.
+
+        :param P: land vector of puma densities at time t
+        :type P: numpy.ndarray of float type
+        :param H: land vector of hare densities at time t
+        :type H: numpy.ndarray of float type
+        :param out: land vector of the population density at t+dt
+        :type out: numpy.ndarray of float type
+        """
+        X_c = self.own_density(P, H)[:-1]
+        solve = self._env.diffusion_solver(self.diffusion, self.dt)
+        new = solve(X_c + self.dt * self.reaction(P[:-1], H[:-1]))
+        out[:-1] = np.where(new > 0, new, 0.)
+
+    def own_density(self, P, H):
+        """Return the density array of this population from P and H.
+
+        :param P: density array of pumas
+        :type P: numpy.ndarray of float type
+        :param H: density array of hares
+        :type H: numpy.ndarray of float type
+        :return: density array of the population
+        :rtype: numpy.ndarray of float type
+        """
+        raise NotImplementedError
+
+    def reaction(self, P, H):
+        """Return the reaction (birth and death) term of the population.
+
+        :param P: density of pumas
+        :type P: numpy.ndarray of float type
+        :param H: density of hares
+        :type H: numpy.ndarray of float type
+        :return: rate of change of density excluding diffusion
+        :rtype: numpy.ndarray of float type
+        """
+        raise NotImplementedError
+
+    def reaction_into(self, P, H, out, tmp):
+        """Write the reaction term into out without allocating arrays.
+
+        Evaluates the same operations as reaction() in the same order.
+
+        :param P: density of pumas
+        :type P: numpy.ndarray of float type
+        :param H: density of hares
+        :type H: numpy.ndarray of float type
+        :param out: array receiving the reaction term
+        :type out: numpy.ndarray of float type
+        :param tmp: scratch array with the shape of out
+        :type tmp: numpy.ndarray of float type
+        """
+        raise NotImplementedError
+
 
 class PumaPopulation(Population):
     """Puma population class with its specific update method.
@@ -301,33 +1078,29 @@ class PumaPopulation(Population):
     """
 
     def __init__(self, Landscape, birth=.02, death=.06, diffusion=.2,
-                 min_ro=0., max_ro=5., dt=.4):
+                 min_ro=0., max_ro=5., dt=.4, engine=DEFAULT_ENGINE,
+                 scratch_dir=None, seed=None, density=None):
         super(PumaPopulation, self).__init__(Landscape, birth, death,
-                                             diffusion, min_ro, max_ro, dt)
+                                             diffusion, min_ro, max_ro, dt,
+                                             engine, scratch_dir, seed,
+                                             density)
         self.kind = 'PumaPopulation'
         print('Puma population created')
 
-    def update_density(self, populations_old, populations_new):
-        r"""Update density array of puma population instance.
+    def own_density(self, P, H):
+        """Return puma density array P."""
+        return P
 
-        Method updates entire density array of puma population instance based
-        on densities of current populations living in a landscape. Only land
-        squares in the density array are updated.
-
-        :param populations_old: list of populations at current timestep
-        :type populations_old: list of Population type
-        :param populations_new: list of populations with updated \
-                density array at t+dt
-        :type populations_new: list of Population type
-        """
-        # extract required populations density arrays for update
-        P_new = self.find_density_arr(PumaPopulation, populations_new)
-        P = self.find_density_arr(PumaPopulation, populations_old)
-        H = self.find_density_arr(HarePopulation, populations_old)
+    def reaction(self, P, H):
+        """Return reaction term of the puma equation, bHP-mP."""
+        return self.birth * H * P - self.death * P
 
-        # update all landscape ij
-        for i, j in self._land_idx:
-            P_new[i][j] = self.update_density_ij(i, j, P, H)
+    def reaction_into(self, P, H, out, tmp):
+        """Write reaction term of the puma equation, bHP-mP, into out."""
+        np.multiply(self.birth, H, out=out)
+        np.multiply(out, P, out=out)
+        np.multiply(self.death, P, out=tmp)
+        np.subtract(out, tmp, out=out)
 
     def update_density_ij(self, i, j, P, H):
         """Return updated puma density at one (i,j) square.
@@ -384,33 +1157,29 @@ class HarePopulation(Population):
     """
 
     def __init__(self, Landscape, birth=.08, death=.04, diffusion=.2,
-                 min_ro=0., max_ro=5., dt=.4):
+                 min_ro=0., max_ro=5., dt=.4, engine=DEFAULT_ENGINE,
+                 scratch_dir=None, seed=None, density=None):
         super(HarePopulation, self).__init__(Landscape, birth, death,
-                                             diffusion, min_ro, max_ro, dt)
+                                             diffusion, min_ro, max_ro, dt,
+                                             engine, scratch_dir, seed,
+                                             density)
         print('Hare population created')
         self.kind = 'HarePopulation'
 
-    def update_density(self, populations_old, populations_new):
-        r"""Update density array of hare population instance.
+    def own_density(self, P, H):
+        """Return hare density array H."""
+        return H
 
-        Method updates entire density array of hare population instance based
-        on densities of current populations living in a landscape. Only land
-        squares in the density array are updated.
-
-        :param populations_old: list of populations at current timestep
-        :type populations_old: list of Population type
-        :param populations_new: list of populations with updated \
-                density array at t+dt
-        :type populations_new: list of Extended Population type
-        """
-        # extract required populations density arrays for update
-        H_new = self.find_density_arr(HarePopulation, populations_new)
-        P = self.find_density_arr(PumaPopulation, populations_old)
-        H = self.find_density_arr(HarePopulation, populations_old)
+    def reaction(self, P, H):
+        """Return reaction term of the hare equation, rH-aHP."""
+        return self.birth * H - self.death * H * P
 
-        # update all landscape ij
-        for i, j in self._land_idx:
-            H_new[i][j] = self.update_density_ij(i, j, P, H)
+    def reaction_into(self, P, H, out, tmp):
+        """Write reaction term of the hare equation, rH-aHP, into out."""
+        np.multiply(self.birth, H, out=out)
+        np.multiply(self.death, H, out=tmp)
+        np.multiply(tmp, P, out=tmp)
+        np.subtract(out, tmp, out=out)
 
     def update_density_ij(self, i, j, P, H):
         """Return updated hare density at one (ij) square.
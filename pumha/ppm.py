@@ -0,0 +1,145 @@
+"""PPM module.
+
+The module contains five functions::
+
+    write_ppm
+    write_ppm_bands
+    read_ppm
+    patch_maxval
+    fixed_point_scale
+
+The functions write and read binary (P6) PPM files with 8 or 16-bit
+samples. The header of a file has a fixed width field for the colour
+maximum value (Maxval), so the value can be changed in place at the end
+of a simulation without rewriting the pixels.
+"""
+
+from __future__ import (absolute_import,
+                        division,
+                        print_function,
+                        unicode_literals)
+import numpy as np
+
+# characters reserved for Maxval in the header, enough for 65535
+MAXVAL_WIDTH = 5
+# largest Maxval and sample type for each sample depth in bits
+MAXVALS = {8: 255, 16: 65535}
+SAMPLE_TYPES = {8: np.dtype('u1'), 16: np.dtype('>u2')}
+# densities are written as fixed point numbers with 8 bits after the
+# binary point, fewer if a higher density has to fit in 16-bit samples
+PPM_SCALE = 256
+
+
+def write_ppm(filename, pixels, depth=16):
+    """Write an array of RGB pixels to a binary PPM file.
+
+    Maxval is set to the largest value allowed by the depth and can be
+    changed later with patch_maxval(). The header looks like::
+
+        P6
+        4 3
+        65535
+
+    where Maxval is right aligned in a field of MAXVAL_WIDTH characters,
+    which is valid since PPM header fields may be separated by any amount
+    of whitespace.
+
+    :param filename: name of the output file
+    :type filename: string
+    :param pixels: integer array of shape (rows, cols, 3)
+    :type pixels: numpy.ndarray
+    :param depth: bits per sample, 8 or 16
+    :type depth: int
+    """
+    write_ppm_bands(filename, pixels.shape[:2], [pixels], depth)
+
+
+def write_ppm_bands(filename, shape, bands, depth=16):
+    """Write RGB pixels given in bands of rows to a binary PPM file.
+
+    The file is the same as the one written by write_ppm() for the
+    concatenated bands, but only one band is held in memory at a time.
+
+    :param filename: name of the output file
+    :type filename: string
+    :param shape: number of rows and columns of pixels
+    :type shape: tuple
+    :param bands: integer arrays of shape (band rows, cols, 3) from the \
+            top of the image down, e.g. a generator
+    :type bands: iterable
+    :param depth: bits per sample, 8 or 16
+    :type depth: int
+    """
+    rows, cols = shape
+    header = 'P6\n%d %d\n%*d\n' % (cols, rows, MAXVAL_WIDTH, MAXVALS[depth])
+    with open(filename, 'wb') as out:
+        out.write(header.encode('ascii'))
+        for band in bands:
+            band = np.ascontiguousarray(band, dtype=SAMPLE_TYPES[depth])
+            out.write(band.tobytes())
+
+
+def read_ppm(filename):
+    """Read a binary PPM file written by write_ppm().
+
+    :param filename: name of the PPM file
+    :type filename: string
+    :return: Maxval and array of pixels with shape (rows, cols, 3)
+    :rtype: (int, numpy.ndarray)
+    """
+    with open(filename, 'rb') as ppm_file:
+        data = ppm_file.read()
+    magic, size, maxval_line, pixels = data.split(b'\n', 3)
+    if magic != b'P6':
+        raise ValueError("Not a binary PPM file: %s" % filename)
+    cols, rows = [int(x) for x in size.split()]
+    maxval = int(maxval_line)
+    depth = 16 if len(pixels) == rows * cols * 6 else 8
+    pixels = np.frombuffer(pixels, dtype=SAMPLE_TYPES[depth])
+    return maxval, pixels.reshape(rows, cols, 3)
+
+
+def patch_maxval(filename, maxval):
+    """Overwrite Maxval in the header of a PPM file written by write_ppm().
+
+    Only the Maxval field is rewritten. Maxval is clipped to the range
+    allowed by the sample depth of the file (1-255 for 8-bit and 256-65535
+    for 16-bit samples).
+
+    :param filename: name of the PPM file
+    :type filename: string
+    :param maxval: new colour maximum value
+    :type maxval: int
+    :return: Maxval written to the file
+    :rtype: int
+    """
+    with open(filename, 'r+b') as ppm_file:
+        header = ppm_file.read(64)
+        offset = header.index(b'\n', header.index(b'\n') + 1) + 1
+        old_maxval = int(header[offset:offset + MAXVAL_WIDTH])
+        if old_maxval > MAXVALS[8]:
+            maxval = min(max(maxval, MAXVALS[8] + 1), MAXVALS[16])
+        else:
+            maxval = min(max(maxval, 1), MAXVALS[8])
+        ppm_file.seek(offset)
+        ppm_file.write(('%*d' % (MAXVAL_WIDTH, maxval)).encode('ascii'))
+    return maxval
+
+
+def fixed_point_scale(max_value, scale=PPM_SCALE):
+    """Return the scale of 16-bit fixed point samples of values.
+
+    The scale is halved as many times as needed for max_value multiplied
+    by the scale to stay below the largest 16-bit Maxval.
+
+    :param max_value: the highest value written to the samples
+    :type max_value: float
+    :param scale: the largest scale
+    :type scale: float
+    :return: scale divided by a power of two
+    :rtype: float
+    """
+    scale = float(scale)
+    while max_value * scale > MAXVALS[16] - 1 and scale > 0:
+        scale /= 2
+    return scale
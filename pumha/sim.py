@@ -11,7 +11,8 @@ and one function::
 The module is used to build new simulations using
 extended Population classes and create the output data.
 
-To run a simulation, use run() method.
+To run a simulation, use run() method, or run_adaptive() method for
+adaptive time steps.
 """
 from __future__ import (absolute_import,
                         division,
@@ -21,7 +22,19 @@ import time
 import os
 import numpy as np
 from tqdm import tqdm
-from pumha.pop import Population, HarePopulation
+from pumha.pop import (Population, HarePopulation, DEFAULT_TILE_STEPS,
+                       species_indices)
+from pumha.state import PopulationState
+from pumha.parallel import SharedState
+from pumha.distributed import DistributedState
+from pumha.tiled import TiledState
+from pumha.community import CommunityState
+from pumha.adaptive import StepController
+from pumha.ppm import write_ppm_bands, patch_maxval, MAXVALS, PPM_SCALE
+from pumha.writer import OutputWriter, DEFAULT_MAX_QUEUED_BYTES
+from pumha.store import SnapshotStore
+from pumha.checkpoint import save_checkpoint, load_checkpoint, landscape_hash
+from pumha.cache import simulation_key
 
 
 class Simulation(object):
@@ -55,14 +68,66 @@ class Simulation(object):
 
     :ivar populations: List of populations in a simulation
     :vartype populations: list of pumha.pop.Population types
+    :ivar async_output: write output in a background thread
+    :vartype async_output: bool
+    :ivar max_queued_bytes: memory limit of densities waiting to be written
+    :vartype max_queued_bytes: int
+    :ivar snapshot_dtype: data type of densities saved to densities.npz, \
+            no densities.npz is saved if None
+    :vartype snapshot_dtype: string
+    :ivar snapshot_file: name of the density store in the output directory
+    :vartype snapshot_file: string
+    :ivar checkpoint_freq: number of steps between checkpoints, \
+            no checkpoints are written if None
+    :vartype checkpoint_freq: int
+    :ivar config: configuration values saved in checkpoints
+    :vartype config: dict
+    :ivar workers: number of worker processes updating strips of the \
+            landscape in run(), the update is serial if None
+    :vartype workers: int
+    :ivar ranks: number of local rank processes of a distributed run(), \
+            takes precedence over workers
+    :vartype ranks: int
+    :ivar rank_densities: ranks of a distributed run() draw the random \
+            initial densities of their strips, densities of populations \
+            are placeholders filled by the first output, e.g. grids of \
+            zeros which are never allocated in memory before
+    :vartype rank_densities: bool
+    :ivar tile_steps: number of steps made at once in every tile when all \
+            populations use the tiled engine
+    :vartype tile_steps: int
+    :ivar cache: cache of results of run(), results are not cached if None
+    :vartype cache: pumha.cache.ResultCache
+    :ivar ppm_scale: fixed point scale of densities in PPM files, to be \
+            set before the first output, e.g. with \
+            pumha.ppm.fixed_point_scale(); densities above \
+            65535/ppm_scale are clipped
+    :vartype ppm_scale: float
     """
 
     def __init__(self, *args):
         # create populations list but ignore args which are not populations
         self.populations = [pop for pop in args if isinstance(pop, Population)]
-        self._print_info = True
+        # puma and hare populations are looked up once, not every step,
+        # add_population() and remove_population() keep the indices valid
+        self._species = species_indices(self.populations)
         self.out_dir = create_output_dir()
         self.num_steps = 1  # redefined in run()
+        self.async_output = True
+        self.max_queued_bytes = DEFAULT_MAX_QUEUED_BYTES
+        self.snapshot_dtype = None
+        self.snapshot_file = 'densities.npz'
+        self.checkpoint_freq = None
+        self.workers = None
+        self.ranks = None
+        self.rank_densities = False
+        self.tile_steps = DEFAULT_TILE_STEPS
+        self.cache = None
+        self.ppm_scale = PPM_SCALE
+        self.config = None
+        self._start_step = 0
+        self._start_max_density = 0
+        self._snapshot_index = None
 
     def add_population(self, pop):
         """Add population object to a simulation
@@ -72,6 +137,7 @@ class Simulation(object):
         """
         if isinstance(pop, Population):
             self.populations.append(pop)
+            self._species = species_indices(self.populations)
         else:
             print("Object is not of Population type")
 
@@ -83,26 +149,35 @@ class Simulation(object):
         """
         try:
             self.populations.remove(pop)
+            self._species = species_indices(self.populations)
             print(pop.kind + ' removed')
         except ValueError as ve:
             msg = ("No such a population in a list: %s, %s" % (pop, ve))
             print(msg)
             return msg
 
-    def update(self, populations_old, populations_new):
+    def update(self, state):
         """One step update for all populations in a simulation
 
-        :param populations_old: list of populations at time t
-        :param populations_new: list of populations at time t+dt
+        Every population reads densities at time t from the current buffers
+        of the state and writes its density at t+dt into its next buffer.
+        The buffers are swapped afterwards.
+
+        :param state: double buffered densities of all populations
+        :type state: pumha.state.PopulationState or \
+                pumha.parallel.SharedState
         """
-        for pop in self.populations:
-            pop.update_density(populations_old, populations_new)
+        state.step()
 
-    def run(self, num_steps, save_freq):
+    def run(self, num_steps, save_freq, monitor=None):
         """Run a simulation over given number of steps and save an output to PPM
 
-        Instance population list is updated every second iteration. At the end
-        of a simulation it is updated with the latest version.
+        Population densities are held in a PopulationState which owns two
+        density buffers per population and swaps them every step, so
+        populations always hold the latest densities and no arrays are
+        copied or allocated inside the loop. For compact engines the
+        density grids are only allocated for every output and checkpoint
+        and at the end.
         The method invokes save_density_grid_interface() every save_freq step
         in attempt to save output to a ppm file.
         At the end of the simulation rescale_ppm_files() method is invoked to
@@ -110,201 +185,574 @@ class Simulation(object):
         Method also includes a simple timer for a loop which prints the
         total elapsed time at the end of a simulation to the standard output.
 
+        If a convergence monitor is given, the simulation stops as soon as
+        the monitor reports a steady state, saving an output of the last
+        step. The reason why the simulation stopped is written to
+        stop_reason.dat in the output directory.
+
+        If checkpoint_freq is set, a checkpoint is written to
+        checkpoint.npz in the output directory every checkpoint_freq steps.
+        After resume() the simulation continues from the step of the
+        checkpoint.
+
+        If workers is set, densities are held in a SharedState from
+        pumha.parallel and updated by worker processes, which gives the same
+        results as the serial update. If ranks is set, the simulation is
+        distributed over rank processes by a DistributedState from
+        pumha.distributed instead, with the same results, and if
+        rank_densities is set the ranks draw the initial densities. Populations
+        using the tiled engine are held in a TiledState from pumha.tiled,
+        which makes tile_steps steps at a time, or one step at a time when
+        a monitor is given. Species of a pumha.community.Community are
+        held in a CommunityState and updated all at once.
+
+        If cache is set, a simulation which was run before with the same
+        landscape, initial densities, parameters and output settings
+        copies its output files and final densities from the cache instead,
+        and a longer one continues from the longest cached simulation it
+        extends. Completed simulations are added to the cache. Only
+        simulations whose populations all have a seed are cached, as others
+        never start from the same densities again. Simulations with
+        a monitor or checkpoints, resumed simulations and simulations with
+        rank_densities are not cached.
+
         :param num_steps: Number of steps for a simulation
         :type num_steps: int
         :param save_freq: Number of time steps between outputs
         :type save_freq: int
+        :param monitor: optional convergence monitor
+        :type monitor: pumha.monitor.ConvergenceMonitor
+        :raises ValueError: if ranks and a monitor are given, distributed \
+                runs do not keep densities of every step
         """
+        if self.ranks and monitor is not None:
+            raise ValueError("Distributed simulation can not be used with "
+                             "a convergence monitor")
         self.num_steps = num_steps
+        start = time.time()
+        cache_key = None
+        if (self.cache is not None and self.populations and
+                all(getattr(pop, 'seed', None) is not None
+                    for pop in self.populations) and
+                monitor is None and not self.checkpoint_freq and
+                not self._start_step and not self.rank_densities):
+            cache_key = simulation_key(self.populations, {
+                'save_freq': save_freq,
+                'snapshot_dtype': self.snapshot_dtype,
+                'ppm_scale': self.ppm_scale,
+            })
+            if self.load_cached(cache_key, num_steps) == num_steps:
+                print("Results of %s steps loaded from the cache" %
+                      num_steps)
+                return
         print('''
               Running simulation over %s steps\n
               ppm output is saved every %s steps\n''' % (num_steps, save_freq))
-        start = time.time()
-        populations_old = np.copy(self.populations)
-        # tqdm is used to provide progress bar
-        max_density = 0
-        for i in tqdm(range(num_steps)):
-            if i % 2 == 0:
-                self.update(populations_old, self.populations)
-            else:
-                self.update(self.populations, populations_old)
-            # saving ppm file every T steps
-            if i % save_freq == 0:
-                # save output
-                self.save_density_grid_interface(i)
-                self.save_average_density(i)
-                # find max value of density
-                new_max_ro = np.amax([p.density for p in self.populations])
-                if new_max_ro > max_density:
-                    max_density = new_max_ro
+        community = getattr(self.populations[0], 'community', None) \
+            if self.populations else None
+        if (community is not None and
+                self.populations == community.populations):
+            state = CommunityState(community)
+        elif self.ranks:
+            state = DistributedState(self.populations, self.ranks,
+                                     draw=self.rank_densities)
+            # the ranks hold the densities from now on
+            self.rank_densities = False
+        elif self.workers:
+            state = SharedState(self.populations, self.workers)
+        elif (self.populations and
+              all(pop.engine == 'tiled' for pop in self.populations)):
+            # the monitor compares densities of every step
+            state = TiledState(self.populations,
+                               1 if monitor is not None else self.tile_steps,
+                               species=self._species)
+        else:
+            state = PopulationState(self.populations, self._species)
+        if state.compact:
+            # grids are allocated again for output by sync()
+            state.release()
+        stop_reason = "Completed %s steps" % num_steps
+        with state, self.output_writer() as writer:
+            # tqdm is used to provide progress bar
+            for i in tqdm(range(self._start_step, num_steps)):
+                self.update(state)
+                # saving ppm file every T steps
+                if i % save_freq == 0:
+                    self.save_output(state, i, writer)
+                if monitor is not None and monitor.update(state):
+                    stop_reason = monitor.stop_reason(i)
+                    if i % save_freq != 0:
+                        self.save_output(state, i, writer)
+                    break
+                if (self.checkpoint_freq and
+                        (i + 1) % self.checkpoint_freq == 0):
+                    self.save_checkpoint(state, i + 1, writer)
+
+        state.sync()
+        self.save_stop_reason(stop_reason)
+        # use max density value to rescale all ppm files
+        self.rescale_ppm_files(writer.max_density)
+        if cache_key is not None:
+            self.cache.store(cache_key, num_steps, self.out_dir,
+                             dict((p.kind, p.density)
+                                  for p in self.populations),
+                             writer.max_density)
 
+        end = time.time()
+        print("Simulation time: %.2f s" % (end - start))
+
+    def load_cached(self, key, num_steps):
+        """Continue from the longest cached simulation of at most num_steps.
+
+        Output files of the cached simulation are copied to the output
+        directory, with step numbers in their names padded to the width of
+        num_steps, and densities of populations are set to its final
+        densities, so a following run() continues from its last step, as
+        after resume().
+
+        :param key: key of the simulation, see pumha.cache.simulation_key
+        :type key: string
+        :param num_steps: number of steps of the simulation
+        :type num_steps: int
+        :return: number of steps of the cached simulation, 0 if there is \
+                none
+        :rtype: int
+        """
+        cached = self.cache.lookup(key, num_steps)
+        if cached is None:
+            return 0
+        steps, entry = cached
+        width = len(str(num_steps))
+
+        def rename(name):
+            # e.g. 050.ppm of a 500 step entry is 0050.ppm of 1000 steps
+            step = len(name) - len(name.lstrip('0123456789'))
+            if not step:
+                return name
+            return name[:step].lstrip('0').zfill(width) + name[step:]
+        densities, max_density = self.cache.load(entry, self.out_dir, rename)
+        for pop in self.populations:
+            pop.density[...] = densities[pop.kind]
+        self.snapshot_file = 'densities_%s.npz' % steps
+        self._start_step = steps
+        self._start_max_density = max_density
+        return steps
+
+    def run_adaptive(self, num_steps, save_freq, tolerance=1e-3,
+                     monitor=None):
+        """Run a simulation with adaptive time steps and save an output to PPM
+
+        The simulation covers the same simulated time as run() with
+        num_steps steps of the population time step dt, and outputs are
+        saved at the same simulated times and with the same names, i.e.
+        output i holds densities at time (i+1)*dt. In between, the length
+        of steps is chosen by pumha.adaptive.StepController, so that the
+        error of every step stays within tolerance and the step does not
+        exceed the stability limit of the explicit engines. The time step
+        of every population is restored at the end of the simulation, also
+        when it fails.
+        A convergence monitor is checked after every accepted step, as in
+        run(); the last output of a converged simulation is named after the
+        number of time steps dt covered so far.
+
+        :param num_steps: Number of time steps dt covered by a simulation
+        :type num_steps: int
+        :param save_freq: Number of time steps dt between outputs
+        :type save_freq: int
+        :param tolerance: relative error tolerance of a single step
+        :type tolerance: float
+        :param monitor: optional convergence monitor
+        :type monitor: pumha.monitor.ConvergenceMonitor
+        :raises ValueError: if workers, ranks or checkpoint_freq is set or \
+                populations use the tiled engine
+        """
+        if (self.workers or self.ranks or self.checkpoint_freq or
+                any(pop.engine == 'tiled' for pop in self.populations)):
+            raise ValueError("Adaptive time steps can not be used with "
+                             "workers, ranks, checkpoints or the tiled "
+                             "engine")
+        self.num_steps = num_steps
+        dt = min(pop.dt for pop in self.populations)
+        print('''
+              Running adaptive simulation over time %s\n
+              ppm output is saved every %s time units\n''' %
+              (num_steps * dt, save_freq * dt))
+        start = time.time()
+        state = PopulationState(self.populations, self._species)
+        state.release()
+        # the controller changes dt of populations
+        time_steps = [pop.dt for pop in self.populations]
+        controller = StepController(state, tolerance, dt)
+        stop_reason = "Completed %s steps" % num_steps
+        t = 0.
+        t_outs = [((i + 1) * dt, i) for i in range(0, num_steps, save_freq)]
+        t_outs.append((num_steps * dt, None))
+        try:
+            with self.output_writer() as writer:
+                for t_out, i in tqdm(t_outs):
+                    converged = False
+                    while t < t_out and not converged:
+                        t = controller.advance(t, t_out)
+                        converged = (monitor is not None and
+                                     monitor.update(state))
+                    if t < t_out or i is None:
+                        # output label i holds densities at time (i+1)*dt
+                        i = max(int(t / dt) - 1, 0)
+                        save = converged
+                    else:
+                        save = True
+                    if save:
+                        self.save_output(state, i, writer)
+                    if converged:
+                        stop_reason = monitor.stop_reason(i)
+                        break
+
+            state.sync()
+        finally:
+            for pop, pop_dt in zip(self.populations, time_steps):
+                pop.dt = pop_dt
+        self.save_stop_reason(stop_reason)
         # use max density value to rescale all ppm files
-        self.rescale_ppm_files(max_density)
+        self.rescale_ppm_files(writer.max_density)
 
-        # make sure we return last updated array
-        if num_steps % 2 == 0:
-            self.populations = np.copy(populations_old)
         end = time.time()
+        print("Accepted steps: %s, rejected steps: %s" %
+              (controller.accepted, controller.rejected))
         print("Simulation time: %.2f s" % (end - start))
 
+    def output_writer(self):
+        """Return a new output writer for the simulation
+
+        Output is written in a background thread if async_output is True.
+        If snapshot_dtype is set, density frames are also saved to
+        a store named snapshot_file in the output directory. After resume()
+        frames are appended to the store of the checkpoint.
+
+        :return: output writer
+        :rtype: pumha.writer.OutputWriter
+        """
+        store = None
+        if self.snapshot_dtype is not None and self.populations:
+            snapshot_file = os.path.join(self.out_dir, self.snapshot_file)
+            if self._snapshot_index is not None:
+                store = SnapshotStore(snapshot_file, 'a',
+                                      dtype=self.snapshot_dtype,
+                                      index=self._snapshot_index)
+            else:
+                env = self.populations[0]._env
+                store = SnapshotStore(snapshot_file, 'w',
+                                      env.unpack_rows(0, env.shape[0]),
+                                      self.snapshot_dtype)
+        return OutputWriter(self, self.max_queued_bytes, self.async_output,
+                            store, self._start_max_density)
+
+    def save_output(self, state, timestep, writer):
+        """Hand over densities of the current state to an output writer
+
+        :param state: double buffered densities of all populations
+        :type state: pumha.state.PopulationState
+        :param timestep: the timestep to which the output corresponds to
+        :type timestep: int
+        :param writer: output writer of the simulation
+        :type writer: pumha.writer.OutputWriter
+        """
+        state.sync()
+        writer.submit(timestep, [p.density for p in self.populations])
+        if state.compact:
+            # submit() copies the grids or writes them right away
+            state.release()
+
+    def save_checkpoint(self, state, step, writer):
+        """Write checkpoint.npz to the output directory
+
+        All output up to the step is written first and the index of the
+        snapshot store is written to its file, so the checkpoint matches the
+        output files and the store is readable until the next checkpoint.
+
+        :param state: double buffered densities of all populations
+        :type state: pumha.state.PopulationState
+        :param step: number of completed steps
+        :type step: int
+        :param writer: output writer of the simulation
+        :type writer: pumha.writer.OutputWriter
+        """
+        writer.flush()
+        snapshot_file = snapshot_index = None
+        if writer.store is not None:
+            snapshot_file = self.snapshot_file
+            snapshot_index = writer.store.checkpoint()
+        state.sync()
+        average_file = os.path.join(self.out_dir, 'average_densities.dat')
+        save_checkpoint(os.path.join(self.out_dir, 'checkpoint.npz'),
+                        step, step * self.populations[0].dt,
+                        dict((p.kind, p.density) for p in self.populations),
+                        self.config or {}, self.populations[0]._env,
+                        writer.max_density, os.path.getsize(average_file),
+                        self.ppm_scale, snapshot_file, snapshot_index)
+        if state.compact:
+            state.release()
+
+    def resume(self, filename):
+        """Continue a simulation from a checkpoint
+
+        Densities of populations are set to the densities in the checkpoint
+        and the next run() starts from the step of the checkpoint, writing
+        its output to the directory of the checkpoint with the PPM scale of
+        the checkpoint. Average densities and snapshots written after the
+        checkpoint are removed, so they are not repeated, and further
+        snapshots are appended to the store of the checkpoint. If there was
+        no store, a new one is named after the step of the checkpoint.
+
+        :param filename: name of the checkpoint file
+        :type filename: string
+        :return: checkpoint values, see pumha.checkpoint.load_checkpoint
+        :rtype: dict
+        :raises ValueError: if the checkpoint was written for another \
+                landscape or other populations
+        """
+        checkpoint = load_checkpoint(filename)
+        if checkpoint['landscape_hash'] != \
+                landscape_hash(self.populations[0]._env):
+            raise ValueError("Checkpoint was written for another landscape: "
+                             "%s" % checkpoint['landscape_file'])
+        for pop in self.populations:
+            try:
+                pop.density[...] = checkpoint['densities'][pop.kind]
+            except KeyError:
+                raise ValueError("No %s in the checkpoint" % pop.kind)
+
+        # continue writing output to the directory of the checkpoint
+        if not os.listdir(self.out_dir):
+            os.rmdir(self.out_dir)
+        self.out_dir = os.path.dirname(os.path.abspath(filename))
+        average_file = os.path.join(self.out_dir, 'average_densities.dat')
+        if os.path.exists(average_file):
+            with open(average_file, 'r+') as out:
+                out.truncate(checkpoint['average_bytes'])
+        if checkpoint['snapshot_file'] is not None:
+            self.snapshot_file = checkpoint['snapshot_file']
+            self._snapshot_index = checkpoint['snapshot_index']
+        else:
+            self.snapshot_file = 'densities_%s.npz' % checkpoint['step']
+        self.ppm_scale = checkpoint['ppm_scale']
+        self.rank_densities = False
+        self._start_step = checkpoint['step']
+        self._start_max_density = checkpoint['max_density']
+        self.config = checkpoint['config']
+        return checkpoint
+
+    def save_stop_reason(self, reason):
+        """Write the reason why a simulation stopped to stop_reason.dat
+
+        :param reason: description of the end of a simulation
+        :type reason: string
+        """
+        out_file = os.path.join(self.out_dir, 'stop_reason.dat')
+        with open(out_file, 'w') as out:
+            out.write(reason + '\n')
+
     def rescale_ppm_files(self, max_density):
         """Rescale all PPM files using common PPM color value (Maxval)
 
         The method takes the highest recorded density from the entire
         simulation and uses it as common scaling factor for all PPM files.
-        In this way the whole simulation is scaled properly.
+        In this way the whole simulation is scaled properly. Only the
+        fixed width Maxval field in the header of every file is rewritten,
+        pixels are not read. A warning is printed if densities were above
+        the range of ppm_scale and had to be clipped.
 
         :param max_density: maximum density for a single square from the run
         :type max_density: int, float
         """
-        max_density = int(max_density)+1
-        ppm_maxval = 65536  # maxmimum allowed color value for ppm format
-        colorline = 3   # 4th line in a file is a color max value
-
-        # make sure color value is below ppm format allowed maximum
-        if max_density > ppm_maxval:
-            max_density = ppm_maxval
+        maxval = int(np.ceil(max_density * self.ppm_scale)) + 1
+        if maxval > MAXVALS[16]:
+            print("Densities above %g are clipped in PPM files, set a higher "
+                  "Ppm_max_density" % (MAXVALS[16] / self.ppm_scale))
 
-        # list all files, open, edit color value line and save
+        # list all files and patch color value in their headers
         for item in os.listdir(self.out_dir):
             item = os.path.join(self.out_dir, item)
             if item.endswith(".ppm"):
-                with open(item, 'r') as my_file:
-                    filedata = my_file.readlines()
-                    filedata[colorline] = str(max_density)+'\n'
-                with open(item, 'w') as my_file:
-                    my_file.writelines(filedata)
+                patch_maxval(item, maxval)
 
-    def save_density_grid_interface(self, i):
+    def save_density_grid_interface(self, i, densities=None):
         """Simple interface to save_density_grid method
 
-        Provides extendable interface to potential group of save_density_grid
+        Provides extendable interface to the group of save_density_grid
         methods, each one to cover specific case for a simulation. This is
-        mostly because of the limitation of the PPM file format. Currently only
-        the case of a simulation containing both a puma and hare population is
-        implemented.
+        mostly because of the limitation of the PPM file format. A
+        simulation of one puma and one hare population is saved to one PPM
+        file per timestep with save_density_grid(), any other populations,
+        e.g. species of a pumha.community.Community, to one PPM file per
+        population and timestep with save_species_grids().
 
         :param timestep: the timestep to which the density \
                 matrix corresponds to
         :type timestep: int
+        :param densities: density arrays in the order of populations, \
+                current densities of populations if not given
+        :type densities: list of numpy.ndarray
         """
-        info = '''
-        Save to PPM file method requires exactly 2 populations
-        in a simulation, one of hares and one of pumas.
-        Other cases are not yet implemented. In fact they will never be.
-        The simulation will continue without PPM visualisation.
+        if self._is_hare_puma():
+            self.save_density_grid(i, densities)
+        elif self.populations:
+            self.save_species_grids(i, densities)
 
-        Current population(s):
-        '''
-
-        if len(self.populations) == 2 and self._print_info:
-            try:
-                self.save_density_grid(i)
-            except UnboundLocalError:
-                print("%s\n %s" % (info, self.populations))
-                self._print_info = False
-        elif self._print_info:
-            print("%s\n %s" % (info, self.populations))
-            self._print_info = False
-
-    def save_density_grid(self, timestep):
-        """Write the densities on each landscape square to a plain PPM file
+    def save_density_grid(self, timestep, densities=None):
+        """Write the densities on each landscape square to a binary PPM file
 
         The method writes the density of a population to a file in the output
         folder. The name of a file is in a format timestep.ppm.
 
-        The files are in a plain PPM format - each line is separated into
-        a group of 3 values corresponding to a pixel, each value in those
-        triplets represents either red, green or blue. The dimension
-        of the landscape is given in the head of the file. The value after
-        the dimensions is a scaling factor which is updated in every file
-        in the end of the simulation, based on the highest maximum density
-        encountered in the simulation. That is done with the
-        rescale_ppm_files method.
+        The files are in a binary PPM (P6) format with 16-bit samples, one
+        pixel per landscape square. Red and green samples hold puma and hare
+        densities respectively in fixed point, i.e. density multiplied by
+        ppm_scale and rounded, and blue sample is 255. The dimension of the
+        landscape is given in the head of the file. The value after the
+        dimensions is a scaling factor (Maxval) which is written as the
+        largest 16-bit value and patched in place in the end of the
+        simulation, based on the highest maximum density encountered in the
+        simulation. That is done with the rescale_ppm_files method.
 
-        Example::
+        Example of a header::
 
-            P3
-            # some comment
+            P6
             4 4
-            255
-            0 0 255  0 0 255  0 0 255  0 0 255
-            0 0 255  34 56 255  28 60 255  0 0 255
-            0 0 255  30 50 255  30 57 225  0 0 255
-            0 0 255  0 0 255  0 0 255  0 0 255
+            65535
 
-        This PPM file represents a small island surrounded by water.
-        Since lines in a PPM file must be no longer than 70 characters,
-        the function creates an array of strings, every string representing
-        a pixel and then writes those strings to a file.
+        followed by 4*4 pixels of 6 bytes each.
 
         :param timestep: the timestep to which the density matrix \
                 corresponds to
         :type timestep: int
+        :param densities: density arrays in the order of populations, \
+                current densities of populations if not given
+        :type densities: list of numpy.ndarray
 
         """
         # find puma and hare densities
-        for pop in self.populations:
-            if isinstance(pop, HarePopulation):
-                hare_pop = pop.density
-            else:
-                puma_pop = pop.density
+        hare_pop, puma_pop = self._hare_puma_densities(densities)
 
         # get nicely formatted step number for printing
         time_st = str(timestep).zfill(len(str(self.num_steps)))
         # get output file name
         density_file = os.path.join(self.out_dir, time_st+'.ppm')
 
-        density_arr = []
         rows, cols = hare_pop.shape
-        for i in range(1, rows-1):
-            for j in range(1, cols-1):
-                puma_pop_ij = int(round(puma_pop[i][j]))
-                hare_pop_ij = int(round(hare_pop[i][j]))
-                density_arr.append(str(puma_pop_ij) +
-                                   ' ' + str(hare_pop_ij) + ' 255')
-
-        # writing pixels on a file in a plain ppm format
-        with open(density_file, 'w+') as out:
-            out.write('P3' + '\n')
-            out.write('#da plain ppm file' + '\n')
-            out.write('%s %s\n' % (cols-2, rows-2))
-            out.write('5\n')
-            i = 3
-            for segment in density_arr:
-                out.write(segment + '  ')
-                i = (i + 1) % 4
-                if i == 3:
-                    out.write('\n')
-            out.write('\n')
-
-    def save_average_density(self, timestep):
+        write_ppm_bands(density_file, (rows-2, cols-2),
+                        self._ppm_bands((puma_pop, hare_pop)))
+
+    def save_species_grids(self, timestep, densities=None):
+        """Write the density of every population to its own binary PPM file
+
+        Files are named timestep_kind.ppm after the kind of the population
+        and have the format of save_density_grid(), with the density in the
+        red sample and 255 in the blue sample.
+
+        :param timestep: the timestep to which the density matrix \
+                corresponds to
+        :type timestep: int
+        :param densities: density arrays in the order of populations, \
+                current densities of populations if not given
+        :type densities: list of numpy.ndarray
+        """
+        if densities is None:
+            densities = [pop.density for pop in self.populations]
+        time_st = str(timestep).zfill(len(str(self.num_steps)))
+        rows, cols = densities[0].shape
+        for pop, density in zip(self.populations, densities):
+            write_ppm_bands(os.path.join(self.out_dir,
+                                         '%s_%s.ppm' % (time_st, pop.kind)),
+                            (rows-2, cols-2),
+                            self._ppm_bands((density,)))
+
+    def _ppm_bands(self, densities):
+        """Yield pixels of a PPM file in bands of tile_rows rows
+
+        The border of the grids is left out. Samples of the red and green
+        channels hold the densities in fixed point and blue samples are 255,
+        so only one band of pixels is allocated at a time.
+
+        :param densities: density grids of the red and the green channel
+        :type densities: tuple of numpy.ndarray
+        """
+        rows, cols = densities[0].shape
+        band_rows = self.populations[0].tile_rows
+        for start in range(1, rows - 1, band_rows):
+            stop = min(start + band_rows, rows - 1)
+            pixels = np.zeros((stop - start, cols - 2, 3), dtype=np.uint16)
+            for channel, density in enumerate(densities):
+                scaled = np.rint(density[start:stop, 1:-1] *
+                                 self.ppm_scale)
+                np.clip(scaled, 0, MAXVALS[16], out=scaled)
+                pixels[:, :, channel] = scaled
+            pixels[:, :, 2] = 255
+            yield pixels
+
+    def save_average_density(self, timestep, densities=None, out=None):
         """Calculate the average density of animals in the whole landscape
 
         The average population is found by summing all the densities in
         the grid and dividing it by the numbers of squares in the grid.
         The density is saved to a file 'average_densities.txt', where the first
         column gives the timestep.  The second and third columns
-        give hare and puma densities at that time step respectively.
+        give hare and puma densities at that time step respectively. For
+        other populations the columns give their densities in the order of
+        populations.
 
         :param timestep: timestep at which the averages are calculated.
         :type timestep: int
+        :param densities: density arrays in the order of populations, \
+                current densities of populations if not given
+        :type densities: list of numpy.ndarray
+        :param out: open average densities file, the file is opened in \
+                append mode if not given
+        :type out: file
         """
-        for pop in self.populations:
+        if self._is_hare_puma():
+            populations = list(self._hare_puma_densities(densities))
+        elif densities is None:
+            populations = [pop.density for pop in self.populations]
+        else:
+            populations = list(densities)
+        if out is None:
+            out_file = os.path.join(self.out_dir, 'average_densities.dat')
+            with open(out_file, 'a+') as out:
+                self._write_average_density(out, timestep, populations)
+        else:
+            self._write_average_density(out, timestep, populations)
+
+    def _write_average_density(self, out, timestep, populations):
+        """Write one line of average densities to an open file"""
+        out.write(str(timestep) + '           ')
+        for pop in populations:
+            average_pop = np.sum(pop) / (
+                (pop.shape[0] - 2) * (pop.shape[1] - 2))
+            out.write(str(average_pop) + '          ')
+        out.write('\n')
+
+    def _is_hare_puma(self):
+        """Return True if the populations are one hare and one puma"""
+        return (len(self.populations) == 2 and
+                max(self._species) < len(self.populations))
+
+    def _hare_puma_densities(self, densities=None):
+        """Return hare and puma density arrays
+
+        :param densities: density arrays in the order of populations, \
+                current densities of populations if not given
+        :type densities: list of numpy.ndarray
+        :return: hare and puma densities
+        :rtype: tuple of numpy.ndarray
+        """
+        if densities is None:
+            densities = [pop.density for pop in self.populations]
+        for pop, density in zip(self.populations, densities):
             if isinstance(pop, HarePopulation):
-                hare_pop = pop.density
+                hare_pop = density
             else:
-                puma_pop = pop.density
-
-        populations = [hare_pop, puma_pop]
-        out_file = os.path.join(self.out_dir, 'average_densities.dat')
-        with open(out_file, 'a+') as out:
-            out.write(str(timestep) + '           ')
-            for pop in populations:
-                average_pop = np.sum(pop) / (
-                    (pop.shape[0] - 2) * (pop.shape[1] - 2))
-                out.write(str(average_pop) + '          ')
-            out.write('\n')
+                puma_pop = density
+        return hare_pop, puma_pop
 
 
 def create_output_dir():
@@ -323,3 +771,4 @@ def create_output_dir():
     if not os.path.exists(new_dir):
         os.makedirs(new_dir)
     return new_dir
+
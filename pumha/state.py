@@ -0,0 +1,219 @@
+"""State module.
+
+The module contains one class::
+
+    PopulationState
+
+The PopulationState class owns the density arrays of all populations in
+a simulation. Every population gets two preallocated buffers, one holding
+the density at time t and the other one receiving the density at t+dt.
+After each step the buffers are swapped by reference, so the time stepping
+loop does not copy or allocate any density arrays.
+
+If populations use one of the compact engines, the buffers are land
+vectors holding land squares only (see pumha.env.Landscape) and density
+grids of populations are refreshed from them with sync(). The grids can be
+dropped with release() while they are not needed, e.g. between outputs, so
+memory of a compact simulation scales with the number of land squares.
+
+Out-of-core populations (with scratch_dir set) get buffers backed by
+scratch files as well, which are copied in bands of rows, so a state never
+holds a whole density grid in memory.
+"""
+
+from __future__ import (absolute_import,
+                        division,
+                        print_function,
+                        unicode_literals)
+import numpy as np
+from pumha.pop import (COMPACT_ENGINES,
+                       advance_fused,
+                       can_fuse,
+                       species_indices,
+                       zeros_grid)
+
+
+class PopulationState(object):
+    """Double buffered density arrays of a list of populations.
+
+    The current buffer of each population is its density array at the time
+    the state is created, the next buffer is a copy of it, so both buffers
+    hold zeros on water squares. Update kernels read the current buffers and
+    write land squares of the next buffers only. After swap() the
+    density attribute of every population points to its current buffer.
+
+    A density array of zeros is allocated once and returned for populations
+    missing in a simulation. Buffers of out-of-core populations, including
+    the array of zeros, are memory-mapped scratch files in the scratch_dir
+    of the population.
+
+    With compact engines the buffers are land vectors. The density
+    attribute of every population then stays a grid, which is only updated
+    when sync() is called, e.g. before writing an output. After release()
+    the density attributes are None and sync() allocates new grids.
+
+    Puma and hare populations are looked up once, when the state is
+    created, and a puma and a hare population both using the vector engine
+    are updated together by pumha.pop.advance_fused().
+
+    :Example:
+
+        >>> state = PopulationState([puma, hare])
+        >>> P = state.current(PumaPopulation)
+        >>> H = state.current(HarePopulation)
+        >>> puma.advance(P, H, state.next(puma))
+        >>> hare.advance(P, H, state.next(hare))
+        >>> state.swap()
+
+    :ivar populations: populations owning the buffers
+    :vartype populations: list of pumha.pop.Population types
+    :ivar compact: True if the buffers are land vectors
+    :vartype compact: bool
+    :ivar species: indices of the puma and hare populations, the number of \
+            populations for a missing species (see \
+            pumha.pop.species_indices())
+    :vartype species: (int, int)
+    :ivar fused: True if pumas and hares are updated together
+    :vartype fused: bool
+    :raises ValueError: if compact and grid engines are mixed
+    """
+
+    def __init__(self, populations, species=None):
+        self.populations = list(populations)
+        self.species = (species_indices(self.populations)
+                        if species is None else tuple(species))
+        self.fused = can_fuse(self.populations)
+        compact = set(pop.engine in COMPACT_ENGINES
+                      for pop in self.populations)
+        if len(compact) > 1:
+            raise ValueError("Compact and grid engines can not be mixed: %s"
+                             % [pop.engine for pop in self.populations])
+        self.compact = compact == set([True])
+
+        if self.compact:
+            self._landscape = self.populations[0]._env
+            self._current = [self._landscape.to_land_vector(pop.density)
+                             for pop in self.populations]
+            self._next = [np.copy(arr) for arr in self._current]
+        else:
+            self._current = [pop.density for pop in self.populations]
+            self._next = [copy_grid(pop.density, pop.scratch_dir,
+                                    pop.tile_rows)
+                          for pop in self.populations]
+        if not self.populations:
+            self._zeros = None
+        elif self.compact:
+            self._zeros = np.zeros_like(self._current[0])
+        else:
+            self._zeros = zeros_grid(self._current[0].shape,
+                                     self.populations[0].scratch_dir)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def current(self, pop_class):
+        """Return density at time t of the first population of pop_class.
+
+        For compact state the density is returned as a land vector.
+
+        :param pop_class: required population class
+        :type pop_class: extended Population class
+        :return: current density array (array of zeros if not found)
+        :rtype: numpy.ndarray of float type
+        """
+        for pop, arr in zip(self.populations, self._current):
+            if isinstance(pop, pop_class):
+                return arr
+        return self._zeros
+
+    def next(self, pop):
+        """Return the buffer receiving density of pop at t+dt.
+
+        :param pop: population in the state
+        :type pop: pumha.pop.Population
+        :return: next density array
+        :rtype: numpy.ndarray of float type
+        """
+        return self._next[self.populations.index(pop)]
+
+    def step(self):
+        """Advance all populations by one time step and swap the buffers.
+
+        Every population reads densities at time t from the current buffers
+        and writes its density at t+dt into its next buffer.
+        """
+        puma, hare = self.species
+        P = self._species_density(puma)
+        H = self._species_density(hare)
+        if self.fused:
+            advance_fused(self.populations[puma], self.populations[hare],
+                          P, H, self._next[puma], self._next[hare])
+        else:
+            for pop, out in zip(self.populations, self._next):
+                pop.advance(P, H, out)
+        self.swap()
+
+    def _species_density(self, index):
+        """Return the current buffer of a population index of species."""
+        if index < len(self._current):
+            return self._current[index]
+        return self._zeros
+
+    def swap(self):
+        """Swap current and next buffers of all populations.
+
+        Only references are exchanged, no data is copied. Density attributes
+        of populations are rebound to the current buffers unless the state
+        is compact.
+        """
+        self._current, self._next = self._next, self._current
+        if not self.compact:
+            for pop, arr in zip(self.populations, self._current):
+                pop.density = arr
+
+    def sync(self):
+        """Write current densities into density grids of populations.
+
+        Does nothing unless the state is compact, since otherwise density
+        grids already are the current buffers.
+        """
+        if self.compact:
+            for pop, vector in zip(self.populations, self._current):
+                pop.density = self._landscape.to_grid(vector, pop.density)
+
+    def release(self):
+        """Drop density grids of populations of a compact state.
+
+        Densities are kept in the land vectors of the state and the grids
+        are allocated again by the next sync(). Does nothing unless the
+        state is compact.
+        """
+        if self.compact:
+            for pop in self.populations:
+                pop.density = None
+
+
+def copy_grid(grid, scratch_dir=None, band_rows=None):
+    """Return a copy of a density grid.
+
+    With scratch_dir the copy is backed by a scratch file (see
+    pumha.pop.zeros_grid()) and it is copied in bands of band_rows rows.
+
+    :param grid: density grid to copy
+    :type grid: numpy.ndarray of float type
+    :param scratch_dir: directory of the scratch file, in memory if None
+    :type scratch_dir: string
+    :param band_rows: number of rows copied at once
+    :type band_rows: int
+    :return: copy of the grid
+    :rtype: numpy.ndarray or numpy.memmap of float type
+    """
+    if scratch_dir is None:
+        return np.copy(grid)
+    out = zeros_grid(grid.shape, scratch_dir)
+    for start in range(0, grid.shape[0], band_rows):
+        out[start:start + band_rows] = grid[start:start + band_rows]
+    return out
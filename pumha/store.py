@@ -0,0 +1,192 @@
+"""Snapshot store module.
+
+The module contains one class::
+
+    SnapshotStore
+
+The SnapshotStore keeps density time series of all populations of
+a simulation in a single compressed file. The file is a zip archive of
+numpy .npy arrays, so it can also be opened with numpy.load. It holds::
+
+    mask.npy                       land mask of the padded landscape
+    <kind>/<timestep>.npy          densities of land squares (one per frame)
+
+Every frame holds densities of land squares only, in the order of
+pumha.env.Landscape.land_indices, and is compressed separately, so a
+single frame of a single population can be read without reading the
+rest of the file. The index of the archive is written when the store is
+closed or checkpointed, see SnapshotStore.checkpoint.
+"""
+
+from __future__ import (absolute_import,
+                        division,
+                        print_function,
+                        unicode_literals)
+import io
+import zipfile
+import numpy as np
+
+
+class SnapshotStore(object):
+    """Compressed store of density frames with random access by timestep.
+
+    A store is opened for reading ('r'), writing ('w', land_mask is
+    required) or appending ('a'). If index, as returned by checkpoint(), is
+    given in 'a' mode, it is written back to the file first, so frames
+    appended after the checkpoint are dropped.
+
+    :Example:
+
+        Write frames during a simulation
+
+        >>> store = SnapshotStore('densities.npz', 'w', puma._land_mask)
+        >>> store.append(0, 'PumaPopulation', puma.density)
+        >>> store.close()
+
+        Save the index with a checkpoint and append to the store on resume
+
+        >>> index = store.checkpoint()
+        >>> store = SnapshotStore('densities.npz', 'a', index=index)
+
+        Read one frame later on
+
+        >>> with SnapshotStore('densities.npz') as store:
+        ...     print(store.species(), store.timesteps('PumaPopulation'))
+        ...     density = store.read(0, 'PumaPopulation')
+
+    :ivar filename: name of the store file
+    :vartype filename: string
+    :ivar mask: land mask of the padded landscape
+    :vartype mask: numpy.ndarray of bool type
+    :ivar dtype: data type of stored densities
+    :vartype dtype: numpy.dtype
+    """
+
+    def __init__(self, filename, mode='r', land_mask=None, dtype=np.float32,
+                 index=None):
+        self.filename = filename
+        self.dtype = np.dtype(dtype)
+        if mode == 'w':
+            if land_mask is None:
+                raise ValueError("Land mask is required to create a store")
+            self._zip = zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED)
+            self.mask = np.asarray(land_mask, dtype=bool)
+            self._write_array('mask.npy', self.mask)
+            self._frames = {}
+        elif mode in ('r', 'a'):
+            if mode == 'a' and index is not None:
+                size, data = index
+                with open(filename, 'r+b') as store_file:
+                    store_file.seek(size - len(data))
+                    store_file.write(data)
+                    store_file.truncate(size)
+            self._zip = zipfile.ZipFile(filename, mode, zipfile.ZIP_DEFLATED)
+            self.mask = self._read_array('mask.npy')
+            self._frames = {}
+            for name in self._zip.namelist():
+                if name != 'mask.npy':
+                    kind, frame = name.rsplit('/', 1)
+                    timestep = int(frame[:-len('.npy')])
+                    self._frames.setdefault(kind, {})[timestep] = name
+        else:
+            raise ValueError("Unknown mode: %s" % mode)
+        self.mode = mode
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Close the store file, writing its index if opened for writing."""
+        self._zip.close()
+
+    def checkpoint(self):
+        """Write the index of a store opened for writing to its file.
+
+        The store file is a complete archive afterwards and the store stays
+        open for appending. Frames appended later overwrite the index in the
+        file, so the returned size and index are saved with a checkpoint and
+        written back when the store is opened in 'a' mode on resume.
+
+        :return: size of the file and its index at the end of the file
+        :rtype: tuple of int and bytes
+        """
+        self._zip.close()
+        self._zip = zipfile.ZipFile(self.filename, 'a', zipfile.ZIP_DEFLATED)
+        with open(self.filename, 'rb') as store_file:
+            store_file.seek(self._zip.start_dir)
+            index = store_file.read()
+        return self._zip.start_dir + len(index), index
+
+    def append(self, timestep, kind, density):
+        """Add density of a population at a timestep to the store.
+
+        :param timestep: the timestep to which the density corresponds to
+        :type timestep: int
+        :param kind: name of the population, e.g. PumaPopulation
+        :type kind: string
+        :param density: density grid with the shape of the landscape
+        :type density: numpy.ndarray of float type
+        """
+        name = '%s/%010d.npy' % (kind, timestep)
+        self._write_array(name, density[self.mask].astype(self.dtype))
+        self._frames.setdefault(kind, {})[timestep] = name
+
+    def species(self):
+        """Return names of populations in the store.
+
+        :return: sorted population names
+        :rtype: list of strings
+        """
+        return sorted(self._frames)
+
+    def timesteps(self, kind):
+        """Return timesteps stored for a population.
+
+        :param kind: name of the population
+        :type kind: string
+        :return: sorted timesteps
+        :rtype: list of int
+        """
+        return sorted(self._frames.get(kind, {}))
+
+    def read_land(self, timestep, kind):
+        """Return densities of land squares of one frame.
+
+        :param timestep: timestep of the frame
+        :type timestep: int
+        :param kind: name of the population
+        :type kind: string
+        :return: densities in the order of land indices
+        :rtype: numpy.ndarray
+        :raises KeyError: if the frame is not in the store
+        """
+        return self._read_array(self._frames[kind][timestep])
+
+    def read(self, timestep, kind):
+        """Return density grid of one frame.
+
+        :param timestep: timestep of the frame
+        :type timestep: int
+        :param kind: name of the population
+        :type kind: string
+        :return: density grid with zeros on water squares
+        :rtype: numpy.ndarray
+        :raises KeyError: if the frame is not in the store
+        """
+        land = self.read_land(timestep, kind)
+        grid = np.zeros(self.mask.shape, dtype=land.dtype)
+        grid[self.mask] = land
+        return grid
+
+    def _write_array(self, name, array):
+        """Write an array to the archive as a compressed .npy member."""
+        buf = io.BytesIO()
+        np.lib.format.write_array(buf, np.ascontiguousarray(array))
+        self._zip.writestr(name, buf.getvalue())
+
+    def _read_array(self, name):
+        """Read a .npy member of the archive."""
+        return np.lib.format.read_array(io.BytesIO(self._zip.read(name)))
@@ -0,0 +1,323 @@
+"""Sweep module.
+
+The module contains six functions::
+
+    init_worker
+    sweep_points
+    run_point
+    run_batch
+    read_results
+    run_sweep
+
+A parameter sweep runs a simulation for every combination of values of
+swept configuration keys on a pool of processes and writes the final
+average densities of every run to a single table. A sweep file is a JSON
+object with the values shared by all runs under "Base" and the swept keys
+under "Sweep", each with a list of values or an evenly spaced range::
+
+    {
+        "Base": {"Steps": 200},
+        "Sweep": {
+            "Hare_birth": [0.06, 0.08, 0.1],
+            "Puma_birth": {"Start": 0.01, "Stop": 0.03, "Num": 5}
+        }
+    }
+
+Keys missing in "Base" take the values of the default configuration.
+Sweeps over rates and time steps only can advance several runs together in
+one pumha.ensemble.ParameterBatch, which is faster on small landscapes.
+Every completed run is appended to the table right away, so an
+interrupted sweep continues with the runs which are missing when it is
+started again with the same output directory.
+"""
+
+from __future__ import (absolute_import,
+                        division,
+                        print_function,
+                        unicode_literals)
+import os
+import sys
+import time
+import itertools
+import contextlib
+import multiprocessing
+import numpy as np
+from tqdm import tqdm
+from jsonschema.exceptions import ValidationError
+from jsonschema import validate
+from pumha.pop import (Configuration,
+                       PumaPopulation,
+                       HarePopulation,
+                       CONFIG_SCHEMA,
+                       DEFAULT_CONFIG,
+                       DEFAULT_ENGINE,
+                       ENGINES,
+                       population_seeds)
+from pumha.state import PopulationState
+from pumha.ensemble import ParameterBatch, BATCH_KEYS
+from pumha.env import Landscape, replace_file
+
+RESULTS_FILE = 'sweep_results.dat'
+# runs of a sweep are plain puma and hare simulations
+UNSUPPORTED_KEYS = ('Species', 'Ensemble', 'Adaptive', 'Convergence_tolerance')
+# all runs share one landscape, which depends on the engine
+FIXED_KEYS = UNSUPPORTED_KEYS + ('Engine',)
+# engines matching a parameter batch bit for bit
+BATCH_ENGINES = ('vector', 'threads', 'tiled')
+# landscape shared by all runs of a worker process, set by init_worker()
+_landscape = None
+
+
+def init_worker(landscape=None, filename=None, packed=False):
+    """Set the landscape of all runs of a worker process.
+
+    Forked workers get the landscape of the main process itself and share
+    its pages. Workers started without fork load it from its file, which
+    memory-maps the cache of the landscape written by the main process.
+
+    :param landscape: landscape of the main process
+    :type landscape: pumha.env.Landscape
+    :param filename: name of the landscape file, used without landscape
+    :type filename: string
+    :param packed: the landscape is packed, see pumha.env.Landscape
+    :type packed: bool
+    """
+    global _landscape
+    if landscape is None:
+        with open(os.devnull, 'w') as devnull, \
+                contextlib.redirect_stdout(devnull):
+            landscape = Landscape(filename, packed=packed)
+    _landscape = landscape
+
+
+def sweep_points(spec):
+    """Return swept keys and configuration values of every run of a sweep.
+
+    Every run is checked against the schema of a configuration file.
+
+    :param spec: sweep specification, see the module documentation
+    :type spec: dict
+    :return: names of swept keys and one configuration dictionary per run, \
+            with the last key changing fastest
+    :rtype: (list of string, list of dict)
+    :raises ValueError: if a swept key has no values, is not a key of \
+            a configuration file or can not be swept, or if a run is not \
+            a valid configuration
+    """
+    base = dict(DEFAULT_CONFIG)
+    base.update(spec.get("Base", {}))
+    if base.get("Engine", DEFAULT_ENGINE) not in ENGINES:
+        raise ValueError("Unknown engine: %s" % base["Engine"])
+    for key in UNSUPPORTED_KEYS:
+        if base.get(key):
+            raise ValueError("Sweep can not be used with %s" % key)
+    keys = sorted(spec.get("Sweep", {}))
+    values = []
+    for key in keys:
+        if key not in CONFIG_SCHEMA["properties"] or key in FIXED_KEYS:
+            raise ValueError("Sweep over an unknown or fixed key: %s" % key)
+        value = spec["Sweep"][key]
+        if isinstance(value, dict):
+            value = np.linspace(value["Start"], value["Stop"],
+                                int(value["Num"])).tolist()
+        if not value:
+            raise ValueError("No values of swept key: %s" % key)
+        values.append(value)
+    points = []
+    for combination in itertools.product(*values):
+        point = dict(base)
+        point.update(zip(keys, combination))
+        try:
+            validate(point, CONFIG_SCHEMA)
+        except ValidationError as ve:
+            raise ValueError("Invalid configuration of a run: %s"
+                             % ve.message)
+        points.append(point)
+    return keys, points
+
+
+def run_point(task):
+    """Run one simulation of a sweep and return its final average densities.
+
+    Initial densities are drawn from the Seed of the configuration, or
+    with the index of the run as the seed of the global numpy random
+    generator without a Seed, so a run gives the same result in any
+    process and in a resumed sweep. Output of the configuration and of
+    populations is not printed.
+
+    :param task: index of the run and its configuration values
+    :type task: (int, dict)
+    :return: index of the run and final average hare and puma densities
+    :rtype: (int, float, float)
+    """
+    index, point = task
+    with open(os.devnull, 'w') as devnull, \
+            contextlib.redirect_stdout(devnull):
+        config = Configuration(data=point)
+        if config.seed is None:
+            np.random.seed(index)
+        puma_seed, hare_seed = population_seeds(config.seed, 2)
+        puma = PumaPopulation(_landscape, birth=config.puma_birth,
+                              death=config.puma_mortality,
+                              diffusion=config.puma_diffusion,
+                              dt=config.time_step, engine=config.engine,
+                              seed=puma_seed)
+        hare = HarePopulation(_landscape, birth=config.hare_birth,
+                              death=config.hare_predation,
+                              diffusion=config.hare_diffusion,
+                              dt=config.time_step, engine=config.engine,
+                              seed=hare_seed)
+    for pop in (puma, hare):
+        pop.tile_rows = config.band_rows
+        pop.threads = config.threads
+    state = PopulationState([puma, hare])
+    for _ in range(int(config.steps)):
+        state.step()
+    state.sync()
+    rows, cols = puma.density.shape
+    squares = (rows - 2) * (cols - 2)
+    return (index, float(np.sum(hare.density) / squares),
+            float(np.sum(puma.density) / squares))
+
+
+def run_batch(tasks):
+    """Run simulations of a sweep together in a parameter batch.
+
+    All runs must differ only in keys of pumha.ensemble.BATCH_KEYS. Every
+    run draws its initial densities as in run_point(), so it gives the
+    same result.
+
+    :param tasks: indices of the runs and their configuration values
+    :type tasks: list of (int, dict)
+    :return: index and final average hare and puma densities of every run
+    :rtype: list of (int, float, float)
+    """
+    if len(tasks) == 1:
+        return [run_point(tasks[0])]
+    with open(os.devnull, 'w') as devnull, \
+            contextlib.redirect_stdout(devnull):
+        config = Configuration(data=tasks[0][1])
+        puma = PumaPopulation(_landscape)
+        hare = HarePopulation(_landscape)
+    P = np.empty((len(tasks),) + _landscape.shape)
+    H = np.empty_like(P)
+    for member, (index, point) in enumerate(tasks):
+        if config.seed is None:
+            np.random.seed(index)
+        puma.seed, hare.seed = population_seeds(config.seed, 2)
+        P[member] = puma.random_density(_landscape)
+        H[member] = hare.random_density(_landscape)
+    parameters = dict((key, [point[key] for index, point in tasks])
+                      for key in BATCH_KEYS)
+    batch = ParameterBatch(puma, hare, parameters, (P, H))
+    for _ in range(int(config.steps)):
+        batch.step()
+    rows, cols = _landscape.shape
+    squares = (rows - 2) * (cols - 2)
+    return [(index, float(np.sum(batch.H[member]) / squares),
+             float(np.sum(batch.P[member]) / squares))
+            for member, (index, point) in enumerate(tasks)]
+
+
+def read_results(filename):
+    """Read completed runs from a results table.
+
+    :param filename: name of the results table
+    :type filename: string
+    :return: lines of completed runs keyed by index of the run
+    :rtype: dict
+    """
+    results = {}
+    if os.path.exists(filename):
+        with open(filename, 'r') as table:
+            for line in table:
+                if line.strip() and not line.startswith('#'):
+                    results[int(line.split()[0])] = line
+    return results
+
+
+def run_sweep(landscape, spec, out_dir, processes=None, batch_size=1):
+    """Run all runs of a sweep missing in the results table of out_dir.
+
+    Runs are made on a pool of processes, which share the landscape with
+    the main process. With batch_size larger than one, every process
+    advances up to that many runs together with run_batch(), provided
+    the sweep is over keys of pumha.ensemble.BATCH_KEYS only and uses an
+    engine of BATCH_ENGINES, and one run at a time otherwise. Every
+    completed run is appended to the table, a line of the index, swept
+    values and final average hare and puma densities. When all runs are
+    complete, the table is rewritten in the order of runs.
+
+    :param landscape: landscape of all runs
+    :type landscape: pumha.env.Landscape
+    :param spec: sweep specification, see the module documentation
+    :type spec: dict
+    :param out_dir: directory of the results table
+    :type out_dir: string
+    :param processes: number of processes, number of CPUs if None
+    :type processes: int
+    :param batch_size: maximum number of runs advanced together
+    :type batch_size: int
+    :return: name of the results table
+    :rtype: string
+    :raises ValueError: if the table holds runs of a different sweep
+    """
+    keys, points = sweep_points(spec)
+    filename = os.path.join(out_dir, RESULTS_FILE)
+    header = '# index %s hare puma\n' % ' '.join(keys)
+    results = read_results(filename)
+    for index, line in results.items():
+        values = [float(value) for value in line.split()[1:1 + len(keys)]]
+        if (index >= len(points) or
+                not np.allclose(values, [points[index][key]
+                                         for key in keys])):
+            raise ValueError("Results in %s are not of this sweep"
+                             % filename)
+    tasks = [(index, point) for index, point in enumerate(points)
+             if index not in results]
+    if (any(key not in BATCH_KEYS for key in keys) or
+            points[0].get("Engine", DEFAULT_ENGINE) not in BATCH_ENGINES):
+        batch_size = 1
+    batches = [tasks[first:first + batch_size]
+               for first in range(0, len(tasks), batch_size)]
+    print('Sweep of %d runs, %d completed before' %
+          (len(points), len(results)))
+
+    start = time.time()
+    try:
+        context = multiprocessing.get_context('fork')
+        initargs = (landscape,)
+    except ValueError:  # platforms without fork
+        context = multiprocessing.get_context()
+        initargs = (None, landscape.filename, landscape.packed)
+    with open(filename, 'a') as table:
+        if not results:
+            table.write(header)
+        pool = context.Pool(processes, init_worker, initargs)
+        try:
+            for batch in tqdm(pool.imap_unordered(run_batch, batches),
+                              total=len(batches)):
+                for index, hare, puma in batch:
+                    line = '%d %s %r %r\n' % (
+                        index,
+                        ' '.join(repr(points[index][key]) for key in keys),
+                        hare, puma)
+                    table.write(line)
+                    results[index] = line
+                table.flush()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    # consolidated table in the order of runs
+    with open(filename + '.tmp', 'w') as table:
+        table.write(header)
+        for index in sorted(results):
+            table.write(results[index])
+    replace_file(filename + '.tmp', filename)
+    print("Sweep time: %.2f s" % (time.time() - start))
+    return filename
+
+
+if __name__ == '__main__':
+    sys.exit("Run a sweep with: pumha sweep <landscape_file> <sweep_file>")
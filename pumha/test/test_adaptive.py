@@ -0,0 +1,112 @@
+from unittest import TestCase
+from unittest import mock
+import os
+import shutil
+import numpy as np
+from pumha.env import Landscape
+from pumha.pop import (PumaPopulation,
+                       HarePopulation)
+from pumha.state import PopulationState
+from pumha.sim import Simulation
+from pumha.adaptive import StepController, stability_limit
+
+env = Landscape('pumha/data/map1.dat')
+P_init = PumaPopulation(env).density
+H_init = HarePopulation(env).density
+
+
+def new_populations(engine='vector', dt=.4):
+    puma = PumaPopulation(env, dt=dt, engine=engine)
+    hare = HarePopulation(env, dt=dt, engine=engine)
+    puma.density = np.copy(P_init)
+    hare.density = np.copy(H_init)
+    return puma, hare
+
+
+class TestStepController(TestCase):
+    def test_stability_limit(self):
+        puma, hare = new_populations()
+        hare.diffusion = .5
+        self.assertAlmostEqual(stability_limit([puma, hare]), 1. / (.5 * 4))
+        puma.diffusion = hare.diffusion = 0.
+        self.assertEqual(stability_limit([puma, hare]), np.inf)
+
+    def test_matches_fine_fixed_steps(self):
+        # reference solution with many small fixed steps
+        puma, hare = new_populations(dt=.01)
+        state = PopulationState([puma, hare])
+        sim = Simulation()
+        for _ in range(200):
+            sim.update(state)
+        os.rmdir(sim.out_dir)
+
+        puma_a, hare_a = new_populations()
+        controller = StepController(PopulationState([puma_a, hare_a]),
+                                    tolerance=1e-4)
+        t = 0.
+        while t < 2.:
+            t = controller.advance(t, 2.)
+        self.assertEqual(t, 2.)
+        self.assertTrue(np.allclose(puma_a.density, puma.density, atol=1e-2))
+        self.assertTrue(np.allclose(hare_a.density, hare.density, atol=1e-2))
+
+    def test_step_grows_when_quiescent(self):
+        puma, hare = new_populations(dt=.001)
+        puma.density[...] = 0.
+        hare.density[...] = 0.
+        controller = StepController(PopulationState([puma, hare]))
+        t = 0.
+        for _ in range(10):
+            t = controller.advance(t, 100.)
+        self.assertEqual(controller.dt, controller.dt_max)
+        self.assertEqual(controller.rejected, 0)
+
+    def test_step_limited_by_stability(self):
+        puma, hare = new_populations(dt=10.)
+        controller = StepController(PopulationState([puma, hare]))
+        self.assertEqual(controller.dt, controller.dt_max)
+
+    def test_imex_not_supported(self):
+        puma, hare = new_populations(engine='imex')
+        with self.assertRaises(ValueError):
+            StepController(PopulationState([puma, hare]))
+
+    def test_run_adaptive_outputs(self):
+        puma, hare = new_populations()
+        sim = Simulation(puma, hare)
+        sim.run_adaptive(10, 4)
+        outputs = sorted(f for f in os.listdir(sim.out_dir)
+                         if f.endswith('.ppm'))
+        self.assertEqual(outputs, ['00.ppm', '04.ppm', '08.ppm'])
+        self.assertEqual(puma.dt, .4)
+        shutil.rmtree(sim.out_dir)
+
+    def test_run_adaptive_restores_dt(self):
+        puma, hare = new_populations()
+        hare.dt = .3
+        sim = Simulation(puma, hare)
+        sim.run_adaptive(4, 2)
+        self.assertEqual((puma.dt, hare.dt), (.4, .3))
+
+        # also when a step fails
+        def failing_advance(controller, t, t_stop):
+            for pop in controller.state.populations:
+                pop.dt = .01
+            raise FloatingPointError
+        with mock.patch.object(StepController, 'advance', failing_advance):
+            with self.assertRaises(FloatingPointError):
+                sim.run_adaptive(4, 2)
+        self.assertEqual((puma.dt, hare.dt), (.4, .3))
+        shutil.rmtree(sim.out_dir)
+
+    def test_run_adaptive_unsupported(self):
+        sims = []
+        for name, value in (('workers', 2), ('ranks', 2),
+                            ('checkpoint_freq', 5)):
+            sims.append(Simulation(*new_populations()))
+            setattr(sims[-1], name, value)
+        sims.append(Simulation(*new_populations(engine='tiled')))
+        for sim in sims:
+            with self.assertRaises(ValueError):
+                sim.run_adaptive(10, 4)
+            shutil.rmtree(sim.out_dir, ignore_errors=True)
@@ -0,0 +1,126 @@
+from unittest import TestCase
+import os
+import shutil
+import tempfile
+import numpy as np
+from pumha.env import Landscape
+from pumha.pop import (PumaPopulation,
+                       HarePopulation,
+                       population_seeds)
+from pumha.sim import Simulation
+from pumha.cache import ResultCache, simulation_key
+
+env = Landscape('pumha/data/islands2.dat')
+
+
+def make_simulation(tmp_dir, cache, seed=3, birth=.02):
+    """Return a cached simulation writing to its own directory."""
+    puma_seed, hare_seed = population_seeds(seed, 2)
+    sim = Simulation(PumaPopulation(env, birth=birth, seed=puma_seed),
+                     HarePopulation(env, seed=hare_seed))
+    if not os.listdir(sim.out_dir):
+        os.rmdir(sim.out_dir)
+    sim.out_dir = tempfile.mkdtemp(dir=tmp_dir)
+    sim.async_output = False
+    sim.cache = cache
+    return sim
+
+
+def read_outputs(sim):
+    """Return contents of output files of a simulation keyed by name."""
+    outputs = {}
+    for name in os.listdir(sim.out_dir):
+        with open(os.path.join(sim.out_dir, name), 'rb') as f:
+            outputs[name] = f.read()
+    return outputs
+
+
+class TestResultCache(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache = ResultCache(os.path.join(self.tmp_dir, 'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_key(self):
+        sims = [make_simulation(self.tmp_dir, None),
+                make_simulation(self.tmp_dir, None),
+                make_simulation(self.tmp_dir, None, seed=4),
+                make_simulation(self.tmp_dir, None, birth=.03)]
+        keys = [simulation_key(sim.populations, {}) for sim in sims]
+        self.assertEqual(keys[0], keys[1])
+        self.assertEqual(len(set(keys)), 3)
+        self.assertNotEqual(keys[0], simulation_key(sims[0].populations,
+                                                    {'save_freq': 2}))
+
+    def test_unseeded_run(self):
+        np.random.seed(3)
+        sim = Simulation(PumaPopulation(env), HarePopulation(env))
+        os.rmdir(sim.out_dir)
+        sim.out_dir = tempfile.mkdtemp(dir=self.tmp_dir)
+        sim.async_output = False
+        sim.cache = self.cache
+        sim.run(4, 2)
+        self.assertFalse(os.path.exists(self.cache.directory))
+
+    def test_cached_run(self):
+        first = make_simulation(self.tmp_dir, self.cache)
+        first.run(6, 2)
+        second = make_simulation(self.tmp_dir, self.cache)
+
+        def update(state):
+            raise AssertionError("cached simulation was computed")
+        second.update = update
+        second.run(6, 2)
+        self.assertEqual(read_outputs(second), read_outputs(first))
+        for pop, expected in zip(second.populations, first.populations):
+            self.assertTrue(np.array_equal(pop.density, expected.density))
+
+    def test_longer_run_continues(self):
+        make_simulation(self.tmp_dir, self.cache).run(5, 2)
+        longer = make_simulation(self.tmp_dir, self.cache)
+        steps = []
+        update = longer.update
+
+        def counted_update(state):
+            steps.append(1)
+            update(state)
+        longer.update = counted_update
+        longer.run(9, 2)
+        self.assertEqual(len(steps), 4)
+
+        uncached = make_simulation(self.tmp_dir, None)
+        uncached.run(9, 2)
+        self.assertEqual(read_outputs(longer), read_outputs(uncached))
+        for pop, expected in zip(longer.populations, uncached.populations):
+            self.assertTrue(np.array_equal(pop.density, expected.density))
+
+    def test_output_names(self):
+        make_simulation(self.tmp_dir, self.cache).run(9, 2)
+        longer = make_simulation(self.tmp_dir, self.cache)
+        longer.run(12, 2)
+        uncached = make_simulation(self.tmp_dir, None)
+        uncached.run(12, 2)
+        # 8.ppm of the cached run is copied as 08.ppm of 12 steps
+        self.assertEqual(sorted(os.listdir(longer.out_dir)),
+                         sorted(os.listdir(uncached.out_dir)))
+        self.assertEqual(read_outputs(longer), read_outputs(uncached))
+
+    def test_eviction(self):
+        make_simulation(self.tmp_dir, self.cache).run(4, 2)
+        entries = os.listdir(self.cache.directory)
+        self.assertEqual(len(entries), 1)
+        # last used a while ago
+        entry = os.path.join(self.cache.directory, entries[0])
+        os.utime(entry, (os.path.getatime(entry) - 60,
+                         os.path.getmtime(entry) - 60))
+        # room for a single entry, the least recently used one is removed
+        self.cache.max_bytes = 1.5 * sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, files in os.walk(self.cache.directory)
+            for name in files)
+        make_simulation(self.tmp_dir, self.cache, seed=4).run(4, 2)
+        remaining = os.listdir(self.cache.directory)
+        self.assertEqual(len(remaining), 1)
+        self.assertNotEqual(remaining, entries)
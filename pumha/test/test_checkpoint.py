@@ -0,0 +1,129 @@
+from unittest import TestCase
+import os
+import shutil
+import tempfile
+import numpy as np
+from pumha.env import Landscape
+from pumha.pop import (PumaPopulation,
+                       HarePopulation)
+from pumha.sim import Simulation
+from pumha.store import SnapshotStore
+from pumha.checkpoint import (save_checkpoint,
+                              load_checkpoint,
+                              landscape_hash)
+
+env = Landscape('pumha/data/map1.dat')
+
+
+def read_file(filename):
+    with open(filename, 'rb') as f:
+        return f.read()
+
+
+def make_simulation(tmp_dir, *pops):
+    """Return a simulation writing to its own directory in tmp_dir."""
+    sim = Simulation(*pops)
+    # output directories are named by seconds, so they may be shared
+    if not os.listdir(sim.out_dir):
+        os.rmdir(sim.out_dir)
+    sim.out_dir = tempfile.mkdtemp(dir=tmp_dir)
+    return sim
+
+
+class TestCheckpoint(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmp_dir, 'checkpoint.npz')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_save_load(self):
+        puma = PumaPopulation(env)
+        config = {"Steps": 10, "Output_interval": 2}
+        np.random.seed(3)
+        save_checkpoint(self.filename, 4, 1.6, {puma.kind: puma.density},
+                        config, env, 1.5, 120, 64., 'densities.npz',
+                        (300, b'index'))
+        expected = np.random.random(5)
+        # the write is atomic, no temporary file is left behind
+        self.assertEqual(os.listdir(self.tmp_dir), ['checkpoint.npz'])
+
+        np.random.seed(5)
+        checkpoint = load_checkpoint(self.filename)
+        self.assertTrue(np.array_equal(np.random.random(5), expected))
+        self.assertEqual(checkpoint['step'], 4)
+        self.assertEqual(checkpoint['time'], 1.6)
+        self.assertEqual(checkpoint['config'], config)
+        self.assertEqual(checkpoint['max_density'], 1.5)
+        self.assertEqual(checkpoint['average_bytes'], 120)
+        self.assertEqual(checkpoint['ppm_scale'], 64.)
+        self.assertEqual(checkpoint['snapshot_file'], 'densities.npz')
+        self.assertEqual(checkpoint['snapshot_index'], (300, b'index'))
+        self.assertEqual(checkpoint['landscape_hash'], landscape_hash(env))
+        self.assertTrue(np.array_equal(checkpoint['densities'][puma.kind],
+                                       puma.density))
+
+    def test_landscape_hash(self):
+        other = Landscape('pumha/test/data/test_land.dat')
+        self.assertNotEqual(landscape_hash(env), landscape_hash(other))
+
+    def test_resume(self):
+        np.random.seed(7)
+        hare = HarePopulation(env)
+        puma = PumaPopulation(env)
+        H, P = np.copy(hare.density), np.copy(puma.density)
+
+        # uninterrupted run
+        sim = make_simulation(self.tmp_dir, hare, puma)
+        sim.snapshot_dtype = 'float64'
+        sim.ppm_scale = 64.
+        sim.run(12, 2)
+        full_dir = sim.out_dir
+        full = [np.copy(hare.density), np.copy(puma.density)]
+
+        # run stopped after a checkpoint and resumed by a new simulation
+        hare = HarePopulation(env)
+        puma = PumaPopulation(env)
+        hare.density[...], puma.density[...] = H, P
+        sim = make_simulation(self.tmp_dir, hare, puma)
+        sim.checkpoint_freq = 4
+        sim.snapshot_dtype = 'float64'
+        sim.ppm_scale = 64.
+        sim.run(10, 2)
+        checkpoint_file = os.path.join(sim.out_dir, 'checkpoint.npz')
+        resumed_hare = HarePopulation(env)
+        resumed_puma = PumaPopulation(env)
+        resumed = make_simulation(self.tmp_dir, resumed_hare, resumed_puma)
+        resumed.snapshot_dtype = 'float64'
+        new_dir = resumed.out_dir
+        resumed.resume(checkpoint_file)
+        self.assertFalse(os.path.exists(new_dir))
+        self.assertEqual(resumed.out_dir, sim.out_dir)
+        # the scale of the PPM files written before the checkpoint is kept
+        self.assertEqual(resumed.ppm_scale, 64.)
+        resumed.run(12, 2)
+
+        self.assertTrue(np.array_equal(resumed_hare.density, full[0]))
+        self.assertTrue(np.array_equal(resumed_puma.density, full[1]))
+        for name in os.listdir(full_dir):
+            if name.endswith('.ppm') or name == 'average_densities.dat':
+                self.assertEqual(
+                    read_file(os.path.join(full_dir, name)),
+                    read_file(os.path.join(resumed.out_dir, name)), name)
+        # the frame after the checkpoint is replaced, not repeated
+        with SnapshotStore(os.path.join(full_dir, 'densities.npz')) as full, \
+                SnapshotStore(os.path.join(resumed.out_dir,
+                                           'densities.npz')) as store:
+            for kind in ('HarePopulation', 'PumaPopulation'):
+                self.assertEqual(store.timesteps(kind), list(range(0, 12, 2)))
+                for step in store.timesteps(kind):
+                    self.assertTrue(np.array_equal(store.read(step, kind),
+                                                   full.read(step, kind)))
+
+    def test_resume_other_landscape(self):
+        save_checkpoint(self.filename, 1, 0.4, {}, {}, env)
+        other = Landscape('pumha/test/data/test_land.dat')
+        resumed = make_simulation(self.tmp_dir, PumaPopulation(other))
+        with self.assertRaises(ValueError):
+            resumed.resume(self.filename)
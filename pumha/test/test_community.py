@@ -0,0 +1,83 @@
+from unittest import TestCase
+import os
+import shutil
+import tempfile
+import numpy as np
+from pumha.env import Landscape
+from pumha.pop import (PumaPopulation,
+                       HarePopulation)
+from pumha.state import PopulationState
+from pumha.sim import Simulation
+from pumha.community import Community, CommunityState
+
+env = Landscape('pumha/data/map1.dat')
+
+three_species = [
+    {"Name": "Grass", "Growth": 0.1, "Diffusion": 0.05,
+     "Interactions": {"Grass": -0.02, "Hare": -0.03}},
+    {"Name": "Hare", "Growth": -0.01, "Diffusion": 0.2,
+     "Interactions": {"Grass": 0.02, "Puma": -0.04}},
+    {"Name": "Puma", "Growth": -0.06, "Diffusion": 0.2,
+     "Interactions": {"Hare": 0.02}},
+]
+
+
+class TestCommunity(TestCase):
+    def test_matches_hare_puma(self):
+        np.random.seed(8)
+        hare = HarePopulation(env)
+        puma = PumaPopulation(env)
+        np.random.seed(8)
+        community = Community(env, ['Hare', 'Puma'], growth=[.08, -.06],
+                              diffusion=[.2, .2],
+                              interactions=[[0, -.04], [.02, 0]])
+        state = PopulationState([hare, puma])
+        community_state = CommunityState(community)
+        for _ in range(5):
+            state.step()
+            community_state.step()
+        for pop, expected in zip(community.populations, (hare, puma)):
+            self.assertTrue(np.allclose(pop.density, expected.density,
+                                        rtol=1e-12, atol=0))
+
+    def test_stacked_densities(self):
+        community = Community.from_config(env, three_species, .4)
+        self.assertEqual(community.names, ['Grass', 'Hare', 'Puma'])
+        self.assertEqual(community.density.shape, (3,) + env.shape)
+        self.assertEqual(community.interactions[1, 2], -.04)
+        state = CommunityState(community)
+        state.step()
+        for index, pop in enumerate(community.populations):
+            self.assertIs(pop.density.base, community.density)
+            self.assertTrue(np.array_equal(pop.density,
+                                           community.density[index]))
+            self.assertFalse(pop.density[~env.landscape.astype(bool)].any())
+
+    def test_seeded_densities(self):
+        first = Community.from_config(env, three_species, .4, seed=5)
+        second = Community.from_config(env, three_species, .4, seed=5)
+        self.assertTrue(np.array_equal(first.density, second.density))
+        # every species draws from its own stream
+        self.assertFalse(np.array_equal(first.density[0], first.density[1]))
+
+    def test_unknown_interaction(self):
+        species = [{"Name": "Hare", "Growth": .08, "Diffusion": .2,
+                    "Interactions": {"Lynx": -.04}}]
+        with self.assertRaises(ValueError):
+            Community.from_config(env, species, .4)
+
+    def test_simulation_run(self):
+        community = Community.from_config(env, three_species, .4)
+        sim = Simulation(*community.populations)
+        if not os.listdir(sim.out_dir):
+            os.rmdir(sim.out_dir)
+        sim.out_dir = tempfile.mkdtemp()
+        sim.async_output = False
+        sim.run(4, 2)
+        files = os.listdir(sim.out_dir)
+        for name in ('0_Grass.ppm', '2_Hare.ppm', '2_Puma.ppm'):
+            self.assertIn(name, files)
+        averages = np.loadtxt(os.path.join(sim.out_dir,
+                                           'average_densities.dat'))
+        self.assertEqual(averages.shape, (2, 4))
+        shutil.rmtree(sim.out_dir)
@@ -0,0 +1,166 @@
+from unittest import TestCase
+from unittest import mock
+import os
+import sys
+import signal
+import shutil
+import socket
+import binascii
+import subprocess
+import numpy as np
+import pumha
+from pumha.env import Landscape
+from pumha.pop import (PumaPopulation,
+                       HarePopulation)
+from pumha.sim import Simulation
+from pumha.state import PopulationState
+from pumha.distributed import DistributedState
+from pumha.monitor import ConvergenceMonitor
+from pumha.cache import ResultCache
+
+env = Landscape('pumha/data/map1.dat')
+
+
+class TestDistributedState(TestCase):
+    def test_matches_serial(self):
+        np.random.seed(4)
+        serial = [PumaPopulation(env), HarePopulation(env)]
+        np.random.seed(4)
+        distributed = [PumaPopulation(env), HarePopulation(env)]
+        state = PopulationState(serial)
+        with DistributedState(distributed, 3) as ranks:
+            self.assertEqual(len(ranks.strips), 3)
+            for _ in range(4):
+                state.step()
+                ranks.step()
+            ranks.sync()
+            for pop, expected in zip(distributed, serial):
+                self.assertTrue(np.array_equal(pop.density,
+                                               expected.density))
+            for _ in range(3):
+                state.step()
+                ranks.step()
+        for pop, expected in zip(distributed, serial):
+            self.assertTrue(np.array_equal(pop.density, expected.density))
+
+    def test_missing_population(self):
+        np.random.seed(4)
+        serial = HarePopulation(env)
+        np.random.seed(4)
+        hare = HarePopulation(env)
+        state = PopulationState([serial])
+        with DistributedState([hare], 2) as ranks:
+            for _ in range(3):
+                state.step()
+                ranks.step()
+        self.assertTrue(np.array_equal(hare.density, serial.density))
+
+    def test_simulation_run(self):
+        np.random.seed(2)
+        serial = Simulation(PumaPopulation(env), HarePopulation(env))
+        serial.run(5, 2)
+        np.random.seed(2)
+        distributed = Simulation(PumaPopulation(env), HarePopulation(env))
+        distributed.ranks = 2
+        distributed.run(5, 2)
+        for pop, expected in zip(distributed.populations,
+                                 serial.populations):
+            self.assertTrue(np.array_equal(pop.density, expected.density))
+        shutil.rmtree(serial.out_dir, ignore_errors=True)
+        shutil.rmtree(distributed.out_dir, ignore_errors=True)
+
+    def test_rank_densities(self):
+        # strips cut several seed bands
+        with mock.patch('pumha.pop.SEED_BAND_ROWS', 16), \
+                mock.patch('pumha.distributed.SEED_BAND_ROWS', 16):
+            serial = [PumaPopulation(env, seed=1),
+                      HarePopulation(env, seed=2)]
+            # densities are not drawn, the ranks draw them
+            distributed = [PumaPopulation(env, seed=1,
+                                          density=np.zeros(env.shape)),
+                           HarePopulation(env, seed=2,
+                                          density=np.zeros(env.shape))]
+            state = PopulationState(serial)
+            with DistributedState(distributed, 3, draw=True) as ranks:
+                for _ in range(3):
+                    state.step()
+                    ranks.step()
+        for pop, expected in zip(distributed, serial):
+            self.assertTrue(np.array_equal(pop.density, expected.density))
+
+    def test_simulation_rank_densities(self):
+        np.random.seed(2)
+        sim = Simulation(PumaPopulation(env, density=np.zeros(env.shape)),
+                         HarePopulation(env, density=np.zeros(env.shape)))
+        sim.ranks = 2
+        sim.rank_densities = True
+        sim.cache = ResultCache(sim.out_dir)
+        sim.run(3, 2)
+        self.assertFalse(sim.rank_densities)
+        for pop in sim.populations:
+            self.assertTrue(pop.density.any())
+        shutil.rmtree(sim.out_dir, ignore_errors=True)
+
+    def test_dead_rank(self):
+        ranks = DistributedState([PumaPopulation(env), HarePopulation(env)],
+                                 2)
+        ranks._processes[1].terminate()
+        ranks.step()
+        with self.assertRaises(RuntimeError):
+            ranks.sync()
+        # the state is closed, the other rank is stopped
+        ranks.close()
+        self.assertFalse(any(process.is_alive()
+                             for process in ranks._processes))
+
+    def test_silent_rank(self):
+        ranks = DistributedState([HarePopulation(env)], 2, timeout=.2)
+        # a rank which never answers, e.g. on a host which hangs
+        os.kill(ranks._processes[0].pid, signal.SIGSTOP)
+        ranks.step()
+        with self.assertRaises(RuntimeError):
+            ranks.sync()
+        self.assertFalse(any(process.is_alive()
+                             for process in ranks._processes))
+
+    def test_remote_ranks(self):
+        np.random.seed(4)
+        serial = [PumaPopulation(env), HarePopulation(env)]
+        np.random.seed(4)
+        distributed = [PumaPopulation(env), HarePopulation(env)]
+        state = PopulationState(serial)
+        probe = socket.socket()
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+        probe.close()
+        authkey = os.urandom(16)
+        # ranks started by hand from another directory, before the
+        # coordinator, reach it by its address only
+        package_dir = os.path.dirname(os.path.dirname(
+            os.path.abspath(pumha.__file__)))
+        environment = dict(os.environ, PYTHONPATH=package_dir)
+        processes = [subprocess.Popen(
+            [sys.executable, '-m', 'pumha.distributed', '127.0.0.1',
+             str(port), binascii.hexlify(authkey).decode('ascii')],
+            cwd=os.path.dirname(package_dir), env=environment)
+            for _ in range(2)]
+        with DistributedState(distributed, 2, ('127.0.0.1', port), authkey,
+                              launch=False) as ranks:
+            for _ in range(3):
+                state.step()
+                ranks.step()
+        for process in processes:
+            self.assertEqual(process.wait(30), 0)
+        for pop, expected in zip(distributed, serial):
+            self.assertTrue(np.array_equal(pop.density, expected.density))
+
+    def test_compact_engine(self):
+        with self.assertRaises(ValueError):
+            DistributedState([PumaPopulation(env, engine='sparse')], 2)
+
+    def test_monitor(self):
+        sim = Simulation(PumaPopulation(env), HarePopulation(env))
+        sim.ranks = 2
+        with self.assertRaises(ValueError):
+            sim.run(5, 2, ConvergenceMonitor(1e-3))
+        shutil.rmtree(sim.out_dir, ignore_errors=True)
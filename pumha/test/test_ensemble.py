@@ -0,0 +1,132 @@
+from unittest import TestCase
+import os
+import shutil
+import tempfile
+from unittest import mock
+import numpy as np
+from pumha.env import Landscape
+from pumha.pop import (PumaPopulation,
+                       HarePopulation)
+from pumha.state import PopulationState
+from pumha.ensemble import Ensemble, ParameterBatch
+
+env = Landscape('pumha/data/map1.dat')
+
+
+class TestEnsemble(TestCase):
+    def test_members_match_single_runs(self):
+        # stacks of members updated in bands of rows and all at once
+        for land in (env, Landscape('pumha/data/islands2.dat')):
+            np.random.seed(5)
+            ensemble = Ensemble(PumaPopulation(land), HarePopulation(land),
+                                3)
+            # members draw their densities in the same order as single runs
+            np.random.seed(5)
+            singles = [[PumaPopulation(land), HarePopulation(land)]
+                       for _ in range(3)]
+            states = [PopulationState(pops) for pops in singles]
+            for _ in range(4):
+                ensemble.step()
+                for state in states:
+                    state.step()
+            for member, (puma, hare) in enumerate(singles):
+                self.assertTrue(np.array_equal(ensemble.P[member],
+                                               puma.density))
+                self.assertTrue(np.array_equal(ensemble.H[member],
+                                               hare.density))
+
+    def test_stacked_members(self):
+        puma = PumaPopulation(env)
+        stacks = []
+        advance_window = puma.advance_window
+
+        def counted_advance_window(P, H, out, N, mask):
+            stacks.append(P.shape[0])
+            advance_window(P, H, out, N, mask)
+        puma.advance_window = counted_advance_window
+        ensemble = Ensemble(puma, HarePopulation(env), 8)
+        ensemble.step()
+        # members of map1.dat are not advanced one by one
+        self.assertTrue(min(stacks) > 1)
+        self.assertEqual(sum(stacks) % 8, 0)
+
+    def test_averages(self):
+        ensemble = Ensemble(PumaPopulation(env), HarePopulation(env), 4)
+        members, mean, std = ensemble.averages()
+        self.assertEqual(members.shape, (4, 2))
+        squares = (env.shape[0] - 2) * (env.shape[1] - 2)
+        self.assertAlmostEqual(members[2, 1], ensemble.P[2].sum() / squares)
+        self.assertTrue(np.allclose(mean, members.mean(axis=0)))
+        self.assertTrue((std > 0).all())
+
+    def test_run(self):
+        out_dir = tempfile.mkdtemp()
+        ensemble = Ensemble(PumaPopulation(env), HarePopulation(env), 2)
+        ensemble.run(5, 2, out_dir)
+        members = np.loadtxt(os.path.join(out_dir, 'ensemble_members.dat'))
+        averages = np.loadtxt(os.path.join(out_dir,
+                                           'ensemble_averages.dat'))
+        self.assertEqual(members.shape, (6, 4))
+        self.assertEqual(averages.shape, (3, 5))
+        self.assertTrue(np.array_equal(averages[:, 0], [0, 2, 4]))
+        shutil.rmtree(out_dir)
+
+    def test_no_members(self):
+        with self.assertRaises(ValueError):
+            Ensemble(PumaPopulation(env), HarePopulation(env), 0)
+
+
+class TestParameterBatch(TestCase):
+    def test_members_match_single_runs(self):
+        parameters = {'Hare_birth': [.06, .08, .1],
+                      'Puma_mortality': [.05, .06, .07],
+                      'Time_step': [.4, .2, .3]}
+        for land in (env, Landscape('pumha/data/islands2.dat')):
+            puma = PumaPopulation(land)
+            hare = HarePopulation(land)
+            batch = ParameterBatch(puma, hare, parameters)
+            singles = [[PumaPopulation(land, death=death, dt=dt),
+                        HarePopulation(land, birth=birth, dt=dt)]
+                       for birth, death, dt in zip(*[
+                           parameters[key] for key in ('Hare_birth',
+                                                       'Puma_mortality',
+                                                       'Time_step')])]
+            # all members start from the densities of the populations
+            for pops in singles:
+                pops[0].density[...] = puma.density
+                pops[1].density[...] = hare.density
+            states = [PopulationState(pops) for pops in singles]
+            for _ in range(4):
+                batch.step()
+                for state in states:
+                    state.step()
+            for member, (single_puma, single_hare) in enumerate(singles):
+                self.assertTrue(np.array_equal(batch.P[member],
+                                               single_puma.density))
+                self.assertTrue(np.array_equal(batch.H[member],
+                                               single_hare.density))
+
+    def test_stacked_members(self):
+        stacks = []
+        advance_window = PumaPopulation.advance_window
+
+        def counted_advance_window(pop, P, H, out, N, mask):
+            stacks.append(P.shape[0])
+            advance_window(pop, P, H, out, N, mask)
+        batch = ParameterBatch(PumaPopulation(env), HarePopulation(env),
+                               {'Hare_birth': np.linspace(.06, .1, 64)})
+        with mock.patch.object(PumaPopulation, 'advance_window',
+                               counted_advance_window):
+            batch.step()
+        # parameter sets on map1.dat advance in stacks, not one by one
+        self.assertTrue(min(stacks) > 1)
+        self.assertEqual(sum(stacks) % 64, 0)
+
+    def test_invalid_parameters(self):
+        puma = PumaPopulation(env)
+        hare = HarePopulation(env)
+        with self.assertRaises(ValueError):
+            ParameterBatch(puma, hare, {'Steps': [10, 20]})
+        with self.assertRaises(ValueError):
+            ParameterBatch(puma, hare, {'Hare_birth': [.06, .08],
+                                        'Puma_birth': [.02]})
@@ -1,4 +1,7 @@
 from unittest import TestCase
+import os
+import shutil
+import tempfile
 import numpy as np
 
 from pumha.env import Landscape
@@ -74,3 +77,112 @@ class TestLandscape(TestCase):
     def test_find_land_squares_indices(self):
         self.assertTrue(np.array_equal(land_indices, env.land_indices))
 
+    def test_find_neighbour_table(self):
+        # land vector positions: (1,1)->0, (2,2)->1, (2,3)->2,
+        # (3,1)->3, (3,2)->4, (3,3)->5 and 6 for water
+        table = np.array([[6, 6, 6, 6, 1, 2],
+                          [6, 4, 5, 6, 6, 6],
+                          [6, 6, 1, 6, 3, 4],
+                          [6, 2, 6, 4, 5, 6]])
+        self.assertTrue(np.array_equal(table, env.neighbour_table))
+
+    def test_land_vector(self):
+        grid = np.arange(25, dtype=float).reshape(5, 5) * land_arr
+        vector = env.to_land_vector(grid)
+        self.assertTrue(np.array_equal(vector, [6, 12, 13, 16, 17, 18, 0]))
+        self.assertTrue(np.array_equal(env.to_grid(vector), grid))
+
+    def test_laplacian(self):
+        lap = env.laplacian()
+        self.assertIs(lap, env.laplacian())
+        grid = np.arange(25, dtype=float).reshape(5, 5) * land_arr
+        vector = env.to_land_vector(grid)
+        expected = ((grid[:-2, 1:-1] + grid[2:, 1:-1] + grid[1:-1, :-2] +
+                     grid[1:-1, 2:]) - dry_squares[1:-1, 1:-1] *
+                    grid[1:-1, 1:-1])
+        expected = expected[land_arr[1:-1, 1:-1] == 1]
+        self.assertTrue(np.allclose(lap.dot(vector[:-1]), expected))
+        # symmetric with zero row sums (no flux through the coast)
+        self.assertEqual(abs(lap - lap.T).max(), 0)
+        self.assertTrue(np.allclose(lap.sum(axis=1), 0))
+
+    def test_diffusion_solver(self):
+        solve = env.diffusion_solver(0.2, 0.4)
+        self.assertIs(solve, env.diffusion_solver(0.2, 0.4))
+        self.assertIsNot(solve, env.diffusion_solver(0.2, 0.8))
+        x = np.linspace(1., 2., 6)
+        b = x - 0.4 * 0.2 * env.laplacian().dot(x)
+        self.assertTrue(np.allclose(solve(b), x))
+
+
+    def test_packed(self):
+        packed = Landscape('pumha/test/data/test_land.dat', cache=False,
+                           packed=True)
+        self.assertEqual(packed.shape, land_arr.shape)
+        self.assertEqual(packed.mask_bits.shape, (5, 1))
+        self.assertEqual(packed.neighbour_counts.dtype, np.uint8)
+        self.assertTrue(np.array_equal(packed.unpack_rows(2, 4),
+                                       land_arr[2:4] == 1))
+        self.assertEqual(packed.count_land(), 6)
+        self.assertIsNone(packed._landscape)
+        # full arrays are unpacked when asked for
+        self.assertTrue(np.array_equal(packed.landscape, land_arr))
+        self.assertTrue(np.array_equal(packed.dry_squares, dry_squares))
+        self.assertTrue(np.array_equal(packed.land_indices, land_indices))
+
+
+class TestLandscapeCache(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmp_dir, 'map1.dat')
+        shutil.copy('pumha/data/map1.dat', self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_parse_landscape(self):
+        with open(self.filename, 'rb') as f:
+            data = f.read()
+        land = Landscape.parse_landscape(data[data.index(b'\n') + 1:])
+        self.assertTrue(np.array_equal(land, np.loadtxt(self.filename,
+                                                        skiprows=1)))
+        # entries other than single 0 and 1 are left to numpy.loadtxt
+        self.assertIsNone(Landscape.parse_landscape(b'1 0\n1.0 0\n'))
+        self.assertIsNone(Landscape.parse_landscape(b'1 0\n10 0\n'))
+        self.assertIsNone(Landscape.parse_landscape(b'1 0\n1 0 1\n'))
+
+    def test_cache(self):
+        env = Landscape(self.filename)
+        self.assertTrue(os.path.isdir(env.cache_dir))
+        cached = Landscape(self.filename)
+        for name in ('landscape', 'dry_squares', 'land_indices'):
+            array = getattr(cached, name)
+            self.assertIsInstance(array, np.memmap)
+            self.assertEqual(array.dtype, getattr(env, name).dtype)
+            self.assertTrue(np.array_equal(array, getattr(env, name)))
+        self.assertTrue(np.array_equal(cached.neighbour_table,
+                                       env.neighbour_table))
+
+        # touching the file keeps the cache, since the hash is the same
+        os.utime(self.filename, (0, 0))
+        self.assertIsInstance(Landscape(self.filename).landscape, np.memmap)
+
+        # a changed file is loaded again
+        with open(self.filename, 'w') as f:
+            f.write('2 2\n1 0\n0 0\n')
+        changed = Landscape(self.filename)
+        self.assertNotIsInstance(changed.landscape, np.memmap)
+        self.assertEqual(changed.landscape.shape, (4, 4))
+        self.assertEqual(Landscape(self.filename).landscape.shape, (4, 4))
+
+    def test_packed_cache(self):
+        env = Landscape(self.filename)
+        packed = Landscape(self.filename, packed=True)
+        self.assertIsInstance(packed.mask_bits, np.memmap)
+        self.assertIsInstance(packed.neighbour_counts, np.memmap)
+        self.assertIsNone(packed._landscape)
+        self.assertTrue(np.array_equal(packed.landscape, env.landscape))
+
+    def test_no_cache(self):
+        env = Landscape(self.filename, cache=False)
+        self.assertFalse(os.path.exists(env.cache_dir))
@@ -0,0 +1,64 @@
+from unittest import TestCase
+import os
+import shutil
+import numpy as np
+from pumha.env import Landscape
+from pumha.pop import (PumaPopulation,
+                       HarePopulation)
+from pumha.state import PopulationState
+from pumha.sim import Simulation
+from pumha.monitor import ConvergenceMonitor
+
+env = Landscape('pumha/data/map1.dat')
+
+
+class TestConvergenceMonitor(TestCase):
+    def test_change_of_last_step(self):
+        puma = PumaPopulation(env)
+        hare = HarePopulation(env)
+        P = np.copy(puma.density)
+        H = np.copy(hare.density)
+        state = PopulationState([puma, hare])
+        sim = Simulation()
+        sim.update(state)
+        os.rmdir(sim.out_dir)
+        for norm in ('max', 'l2'):
+            monitor = ConvergenceMonitor(1e-3, norm=norm)
+            self.assertFalse(monitor.update(state))
+            changes = [puma.density - P, hare.density - H]
+            if norm == 'max':
+                expected = max(np.abs(c).max() for c in changes)
+            else:
+                expected = max(np.linalg.norm(c) for c in changes)
+            self.assertAlmostEqual(monitor.change, expected / puma.dt)
+
+    def test_converges_after_num_steps(self):
+        # no pumas, no hare births and deaths: densities only diffuse
+        hare = HarePopulation(env, birth=0., death=0.)
+        hare.density[hare.density != 0] = 1.
+        state = PopulationState([hare])
+        monitor = ConvergenceMonitor(1e-12, num_steps=3)
+        sim = Simulation()
+        for _ in range(2):
+            sim.update(state)
+            self.assertFalse(monitor.update(state))
+        sim.update(state)
+        self.assertTrue(monitor.update(state))
+        os.rmdir(sim.out_dir)
+
+    def test_unknown_norm(self):
+        with self.assertRaises(ValueError):
+            ConvergenceMonitor(1e-3, norm='l7')
+
+    def test_run_stops_early(self):
+        hare = HarePopulation(env, birth=0., death=0.)
+        hare.density[hare.density != 0] = 1.
+        puma = PumaPopulation(env, birth=0., death=0.)
+        puma.density[puma.density != 0] = 1.
+        sim = Simulation(hare, puma)
+        monitor = ConvergenceMonitor(1e-12, num_steps=3)
+        sim.run(1000, 100, monitor)
+        with open(os.path.join(sim.out_dir, 'stop_reason.dat')) as f:
+            reason = f.read()
+        self.assertTrue(reason.startswith('Converged at step 2:'))
+        shutil.rmtree(sim.out_dir)
@@ -0,0 +1,86 @@
+from unittest import TestCase
+import shutil
+import time
+import numpy as np
+from pumha.env import Landscape
+from pumha.pop import (PumaPopulation,
+                       HarePopulation)
+from pumha.sim import Simulation
+from pumha.state import PopulationState
+from pumha.parallel import SharedState, split_rows
+
+env = Landscape('pumha/data/map1.dat')
+
+
+class FailingPopulation(HarePopulation):
+    def advance_rows(self, P, H, out, start, stop):
+        raise ZeroDivisionError
+
+
+class HangingPopulation(HarePopulation):
+    def advance_rows(self, P, H, out, start, stop):
+        if start == 1:
+            time.sleep(60)
+        HarePopulation.advance_rows(self, P, H, out, start, stop)
+
+
+class TestSharedState(TestCase):
+    def test_split_rows(self):
+        self.assertEqual(split_rows(10, 3), [(1, 4), (4, 6), (6, 9)])
+        # more strips than rows
+        self.assertEqual(split_rows(4, 5), [(1, 2), (2, 3)])
+
+    def test_matches_serial(self):
+        for engine in ('vector', 'packed'):
+            np.random.seed(5)
+            serial = [PumaPopulation(env, engine=engine),
+                      HarePopulation(env, engine=engine)]
+            np.random.seed(5)
+            parallel = [PumaPopulation(env, engine=engine),
+                        HarePopulation(env, engine=engine)]
+            state = PopulationState(serial)
+            for _ in range(5):
+                state.step()
+            with SharedState(parallel, 3) as shared:
+                self.assertEqual(len(shared.strips), 3)
+                for _ in range(5):
+                    shared.step()
+                self.assertTrue(np.array_equal(
+                    shared.current(PumaPopulation), serial[0].density))
+            for pop, expected in zip(parallel, serial):
+                self.assertNotIsInstance(pop.density.base, memoryview)
+                self.assertTrue(np.array_equal(pop.density, expected.density))
+
+    def test_simulation_run(self):
+        np.random.seed(2)
+        serial = Simulation(PumaPopulation(env), HarePopulation(env))
+        serial.run(4, 2)
+        np.random.seed(2)
+        parallel = Simulation(PumaPopulation(env), HarePopulation(env))
+        parallel.workers = 2
+        parallel.run(4, 2)
+        for pop, expected in zip(parallel.populations, serial.populations):
+            self.assertTrue(np.array_equal(pop.density, expected.density))
+        shutil.rmtree(serial.out_dir, ignore_errors=True)
+        shutil.rmtree(parallel.out_dir, ignore_errors=True)
+
+    def test_compact_engine(self):
+        with self.assertRaises(ValueError):
+            SharedState([PumaPopulation(env, engine='land')], 2)
+
+    def test_worker_failure(self):
+        state = SharedState([FailingPopulation(env)], 2)
+        with self.assertRaises(RuntimeError):
+            state.step()
+        state.close()
+
+    def test_worker_timeout(self):
+        state = SharedState([HangingPopulation(env)], 2, timeout=0.5)
+        start = time.time()
+        with self.assertRaises(RuntimeError):
+            state.step()
+        # the hanging worker is terminated rather than waited for
+        self.assertTrue(time.time() - start < 30)
+        self.assertFalse(any(worker.is_alive()
+                             for worker in state._workers))
+        state.close()
@@ -1,9 +1,13 @@
 from unittest import TestCase
+import os
+import json
+import tempfile
 import numpy as np
 from pumha.env import Landscape
 from pumha.pop import (PumaPopulation,
                        HarePopulation,
-                       Configuration)
+                       Configuration,
+                       population_seeds)
 
 
 land_arr = np.array([[0, 0, 0, 0],
@@ -151,6 +155,37 @@ class TestPopulation(TestCase):
             self.assertTrue(pop.min_ro <= pop.random_density(env)[
                 pop.random_density(env) != 0].all() <= pop.max_ro)
 
+    def test_given_density(self):
+        grid = np.copy(H_density)
+        rng_state = np.random.get_state()
+        hare = HarePopulation(env, density=grid)
+        self.assertIs(hare.density, grid)
+        # no random density is drawn
+        self.assertTrue(np.array_equal(np.random.get_state()[1],
+                                       rng_state[1]))
+
+    def test_seeded_random_density(self):
+        land = Landscape('pumha/data/islands.dat')
+        rng_state = np.random.get_state()
+        hare = HarePopulation(land, seed=7)
+        # bands drawn by any number of threads give the same densities
+        for threads in (1, 3):
+            hare.threads = threads
+            hare.seed = np.random.SeedSequence(7)
+            self.assertTrue(np.array_equal(hare.random_density(land),
+                                           hare.density))
+        # later calls and other populations draw from other streams
+        self.assertFalse(np.array_equal(hare.random_density(land),
+                                        hare.density))
+        puma_seed, hare_seed = population_seeds(7, 2)
+        puma = PumaPopulation(land, seed=puma_seed)
+        self.assertFalse(np.array_equal(
+            puma.density, HarePopulation(land, seed=hare_seed).density))
+        self.assertTrue((puma.density[land.landscape == 0] == 0).all())
+        # the global random generator is not used
+        self.assertTrue(np.array_equal(np.random.get_state()[1],
+                                       rng_state[1]))
+
 
 # return True if all matrix perimeter (boundary) elements are zeros
 def zero_surrounded(array):
@@ -172,6 +207,18 @@ default = {
 config = Configuration('pumha/test/data/config.dat')
 
 
+def load_config(**keys):
+    """Return configuration of a config file with default and given keys."""
+    values = dict(default, **keys)
+    with tempfile.NamedTemporaryFile('w', suffix='.dat',
+                                     delete=False) as f:
+        json.dump(values, f)
+    try:
+        return Configuration(f.name)
+    finally:
+        os.remove(f.name)
+
+
 class Test_Configuration(TestCase):
     def test_load_from_file(self):
         #Test a properly formatted config loads properly
@@ -184,6 +231,11 @@ class Test_Configuration(TestCase):
         self.assertEqual(config.time_step, default["Time_step"])
         self.assertEqual(config.steps, default["Steps"])
         self.assertEqual(config.output_interval, default["Output_interval"])
+        self.assertEqual(config.engine, 'vector')
+
+        #Test optional engine key
+        engine_config = Configuration('pumha/test/data/config_engine.dat')
+        self.assertEqual(engine_config.engine, 'loop')
 
         #Test empty config input
         with self.assertRaises(SystemExit) as cm:
@@ -199,3 +251,210 @@ class Test_Configuration(TestCase):
         with self.assertRaises(SystemExit) as cm:
             Configuration('pumha/test/data/config_missingkey.dat')
         self.assertEqual(cm.exception.code, 1)
+
+    def test_ranks_with_convergence(self):
+        with self.assertRaises(SystemExit) as cm:
+            load_config(Ranks=2, Convergence_tolerance=1e-3)
+        self.assertEqual(cm.exception.code, 1)
+
+    def test_adaptive_combinations(self):
+        for keys in ({'Engine': 'imex'}, {'Engine': 'tiled'},
+                     {'Workers': 2}, {'Ranks': 2},
+                     {'Checkpoint_interval': 10}):
+            with self.assertRaises(SystemExit) as cm:
+                load_config(Adaptive=True, **keys)
+            self.assertEqual(cm.exception.code, 1)
+
+    def test_scratch_dir_engine(self):
+        tmp_dir = tempfile.mkdtemp()
+        config = load_config(Scratch_dir=tmp_dir, Engine='packed')
+        self.assertEqual(config.scratch_dir, tmp_dir)
+        with self.assertRaises(SystemExit) as cm:
+            load_config(Scratch_dir=tmp_dir)
+        self.assertEqual(cm.exception.code, 1)
+        os.rmdir(tmp_dir)
+
+    def test_species_combinations(self):
+        species = [{"Name": "Hare", "Growth": 0.08, "Diffusion": 0.2},
+                   {"Name": "Puma", "Growth": -0.06, "Diffusion": 0.2,
+                    "Interactions": {"Hare": 0.02}}]
+        self.assertEqual(load_config(Species=species).species, species)
+        self.assertEqual(load_config(Species=species,
+                                     Engine='vector').engine, 'vector')
+        for keys in ({'Engine': 'packed'}, {'Engine': 'tiled'},
+                     {'Workers': 2}, {'Ranks': 2}):
+            with self.assertRaises(SystemExit) as cm:
+                load_config(Species=species, **keys)
+            self.assertEqual(cm.exception.code, 1)
+
+    def test_ensemble_combinations(self):
+        self.assertEqual(load_config(Ensemble=4, Engine='vector').ensemble,
+                         4)
+        for keys in ({'Engine': 'imex'}, {'Engine': 'packed'},
+                     {'Workers': 2}, {'Ranks': 2},
+                     {'Checkpoint_interval': 10},
+                     {'Snapshot_dtype': 'float32'},
+                     {'Scratch_dir': '.', 'Engine': 'packed'}):
+            with self.assertRaises(SystemExit) as cm:
+                load_config(Ensemble=4, **keys)
+            self.assertEqual(cm.exception.code, 1)
+
+    def test_ppm_max_density(self):
+        self.assertIsNone(load_config().ppm_max_density)
+        self.assertEqual(load_config(Ppm_max_density=1000).ppm_max_density,
+                         1000)
+        for value in (0, 'high'):
+            with self.assertRaises(SystemExit) as cm:
+                load_config(Ppm_max_density=value)
+            self.assertEqual(cm.exception.code, 1)
+
+    def test_integer_keys(self):
+        self.assertEqual(load_config(Workers=2).workers, 2)
+        for key in ('Workers', 'Ranks', 'Threads', 'Band_rows',
+                    'Tile_steps', 'Ensemble'):
+            for value in (2.5, 0):
+                with self.assertRaises(SystemExit) as cm:
+                    load_config(**{key: value})
+                self.assertEqual(cm.exception.code, 1)
+
+
+map1 = Landscape('pumha/data/map1.dat')
+P_map1 = PumaPopulation(map1).density
+H_map1 = HarePopulation(map1).density
+
+
+class TestEngines(TestCase):
+    def test_vector_matches_loop(self):
+        land = map1
+        for pop_class in (PumaPopulation, HarePopulation):
+            loop_pop = pop_class(land, engine='loop')
+            vector_pop = pop_class(land, engine='vector')
+            P, H = P_map1, H_map1
+            out_loop = np.zeros_like(P)
+            out_vector = np.zeros_like(P)
+            loop_pop.advance(P, H, out_loop)
+            vector_pop.advance(P, H, out_vector)
+            self.assertTrue(np.array_equal(out_loop, out_vector))
+
+    def test_packed_matches_vector(self):
+        land = Landscape('pumha/data/map1.dat', cache=False)
+        packed = Landscape('pumha/data/map1.dat', cache=False, packed=True)
+        P, H = P_map1, H_map1
+        for pop_class in (PumaPopulation, HarePopulation):
+            vector_pop = pop_class(land, engine='vector')
+            packed_pop = pop_class(packed, engine='packed')
+            # bands of rows which do not divide the grid
+            packed_pop.tile_rows = 7
+            out_vector = np.full_like(P, -1.)
+            out_packed = np.full_like(P, -1.)
+            vector_pop.advance(P, H, out_vector)
+            packed_pop.advance(P, H, out_packed)
+            self.assertTrue(np.array_equal(out_packed, out_vector))
+        # the whole landscape was never unpacked
+        self.assertIsNone(packed._landscape)
+        self.assertIsNone(packed._dry_squares)
+
+    def test_threads_matches_vector(self):
+        land = map1
+        P, H = P_map1, H_map1
+        for pop_class in (PumaPopulation, HarePopulation):
+            vector_pop = pop_class(land, engine='vector')
+            threads_pop = pop_class(land, engine='threads')
+            # blocks of rows which do not divide the grid
+            threads_pop.threads = 3
+            out_vector = np.full_like(P, -1.)
+            out_threads = np.full_like(P, -1.)
+            vector_pop.advance(P, H, out_vector)
+            # temporaries are reused in the second step
+            for _ in range(2):
+                threads_pop.advance(P, H, out_threads)
+            self.assertTrue(np.array_equal(out_threads, out_vector))
+
+    def test_vector_water_untouched(self):
+        out = np.full(P_density.shape, -1.)
+        vector_puma = PumaPopulation(env)
+        vector_puma.advance(P_density, H_density, out)
+        self.assertTrue((out[land_arr == 0] == -1.).all())
+        self.assertTrue((out[land_arr == 1] >= 0.).all())
+
+    def test_unknown_engine(self):
+        bad_puma = PumaPopulation(env, engine='abacus')
+        with self.assertRaises(ValueError):
+            bad_puma.advance(P_density, H_density, np.zeros_like(P_density))
+
+    def test_land_matches_vector(self):
+        land = map1
+        P, H = P_map1, H_map1
+        P_vec = land.to_land_vector(P)
+        H_vec = land.to_land_vector(H)
+        for pop_class in (PumaPopulation, HarePopulation):
+            vector_pop = pop_class(land, engine='vector')
+            land_pop = pop_class(land, engine='land')
+            out_vector = np.zeros_like(P)
+            out_land = np.zeros_like(P_vec)
+            vector_pop.advance(P, H, out_vector)
+            land_pop.advance(P_vec, H_vec, out_land)
+            self.assertEqual(out_land[-1], 0.)
+            self.assertTrue(np.array_equal(land.to_grid(out_land),
+                                           out_vector))
+
+    def test_sparse_matches_vector(self):
+        land = map1
+        P, H = P_map1, H_map1
+        P_vec = land.to_land_vector(P)
+        H_vec = land.to_land_vector(H)
+        for pop_class in (PumaPopulation, HarePopulation):
+            vector_pop = pop_class(land, engine='vector')
+            sparse_pop = pop_class(land, engine='sparse')
+            out_vector = np.zeros_like(P)
+            out_sparse = np.zeros_like(P_vec)
+            vector_pop.advance(P, H, out_vector)
+            sparse_pop.advance(P_vec, H_vec, out_sparse)
+            self.assertTrue(np.allclose(land.to_grid(out_sparse), out_vector,
+                                        rtol=1e-12, atol=1e-12))
+
+    def test_imex_conserves_diffusing_population(self):
+        land = map1
+        hare = HarePopulation(land, birth=0., death=0., dt=50.,
+                              engine='imex')
+        H = land.to_land_vector(hare.density)
+        out = np.zeros_like(H)
+        hare.advance(np.zeros_like(H), H, out)
+        self.assertAlmostEqual(out.sum() / H.sum(), 1.)
+
+    def test_imex_large_time_step(self):
+        # dt is ten times above the stability limit of explicit engines
+        land = map1
+        dt = 10. / (4 * .2)
+        results = {}
+        for engine in ('sparse', 'imex'):
+            puma = PumaPopulation(land, birth=0., death=0., dt=dt,
+                                  engine=engine)
+            P = land.to_land_vector(np.copy(P_map1))
+            out = np.zeros_like(P)
+            for _ in range(5):
+                puma.advance(P, np.zeros_like(P), out)
+                P, out = out, P
+            results[engine] = P
+        self.assertTrue(results['sparse'].max() > 100 * P_map1.max())
+        self.assertTrue(results['imex'].max() <= P_map1.max())
+
+    def test_imex_matches_explicit_for_small_time_step(self):
+        land = map1
+        results = {}
+        for engine in ('sparse', 'imex'):
+            puma = PumaPopulation(land, dt=.01, engine=engine)
+            hare = HarePopulation(land, dt=.01, engine=engine)
+            P = land.to_land_vector(np.copy(P_map1))
+            H = land.to_land_vector(np.copy(H_map1))
+            P_new = np.zeros_like(P)
+            H_new = np.zeros_like(H)
+            for _ in range(100):
+                puma.advance(P, H, P_new)
+                hare.advance(P, H, H_new)
+                P, P_new = P_new, P
+                H, H_new = H_new, H
+            results[engine] = (P, H)
+        for expl, impl in zip(results['sparse'], results['imex']):
+            # both schemes are first order in dt
+            self.assertTrue(np.allclose(expl, impl, atol=5e-2))
@@ -0,0 +1,57 @@
+from unittest import TestCase
+import os
+import tempfile
+import numpy as np
+from pumha.ppm import (write_ppm, write_ppm_bands, read_ppm, patch_maxval,
+                       fixed_point_scale, PPM_SCALE)
+
+
+class TestPPM(TestCase):
+    def setUp(self):
+        handle, self.filename = tempfile.mkstemp(suffix='.ppm')
+        os.close(handle)
+        self.pixels = np.arange(36).reshape(3, 4, 3)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_write_read(self):
+        for depth in (8, 16):
+            write_ppm(self.filename, self.pixels * (depth - 7), depth)
+            maxval, pixels = read_ppm(self.filename)
+            self.assertEqual(maxval, 2 ** depth - 1)
+            self.assertTrue(np.array_equal(pixels, self.pixels * (depth - 7)))
+        with open(self.filename, 'rb') as ppm_file:
+            self.assertEqual(ppm_file.readline(), b'P6\n')
+            self.assertEqual(ppm_file.readline(), b'4 3\n')
+            self.assertEqual(ppm_file.readline(), b'65535\n')
+        self.assertEqual(os.path.getsize(self.filename), 13 + 3 * 4 * 6)
+
+    def test_write_bands(self):
+        write_ppm(self.filename, self.pixels)
+        with open(self.filename, 'rb') as ppm_file:
+            whole = ppm_file.read()
+        write_ppm_bands(self.filename, (3, 4),
+                        (self.pixels[:2], self.pixels[2:]))
+        with open(self.filename, 'rb') as ppm_file:
+            self.assertEqual(ppm_file.read(), whole)
+
+    def test_patch_maxval(self):
+        write_ppm(self.filename, self.pixels, 16)
+        self.assertEqual(patch_maxval(self.filename, 1000), 1000)
+        maxval, pixels = read_ppm(self.filename)
+        self.assertEqual(maxval, 1000)
+        self.assertTrue(np.array_equal(pixels, self.pixels))
+        # 16-bit samples require Maxval above 255
+        self.assertEqual(patch_maxval(self.filename, 6), 256)
+        self.assertEqual(patch_maxval(self.filename, 10 ** 6), 65535)
+
+        write_ppm(self.filename, self.pixels, 8)
+        self.assertEqual(patch_maxval(self.filename, 36), 36)
+        self.assertEqual(read_ppm(self.filename)[0], 36)
+        self.assertEqual(patch_maxval(self.filename, 1000), 255)
+
+    def test_fixed_point_scale(self):
+        self.assertEqual(fixed_point_scale(5), PPM_SCALE)
+        self.assertEqual(fixed_point_scale(1000), PPM_SCALE / 4)
+        self.assertTrue(1e6 * fixed_point_scale(1e6) < 65535)
@@ -1,10 +1,14 @@
 from unittest import TestCase
+from unittest import mock
 import os
+import shutil
+import numpy as np
 from pumha.env import Landscape
 from pumha.pop import (PumaPopulation,
                        HarePopulation)
 from pumha.sim import Simulation
-from pumha.sim import create_output_dir
+from pumha.sim import create_output_dir, PPM_SCALE
+from pumha.ppm import read_ppm, fixed_point_scale
 
 env = Landscape('pumha/test/data/test_land.dat')
 hare = HarePopulation(env)
@@ -39,3 +43,87 @@ class TestSimulation(TestCase):
             test = True
         self.assertTrue(test)
         os.rmdir(sim.out_dir)
+
+    def test_run(self):
+        hare_run = HarePopulation(env)
+        puma_run = PumaPopulation(env)
+        H = np.copy(hare_run.density)
+        P = np.copy(puma_run.density)
+        for _ in range(3):
+            H_new = np.copy(H)
+            P_new = np.copy(P)
+            hare_run.advance(P, H, H_new)
+            puma_run.advance(P, H, P_new)
+            H, P = H_new, P_new
+        sim = Simulation(hare_run, puma_run)
+        sim.run(3, 2)
+        self.assertTrue(np.array_equal(hare_run.density, H))
+        self.assertTrue(np.array_equal(puma_run.density, P))
+        ppm_files = [f for f in os.listdir(sim.out_dir) if f.endswith('.ppm')]
+        self.assertEqual(len(ppm_files), 2)
+        # last output is at step 2, Maxval is scaled by the highest density
+        maxval, pixels = read_ppm(os.path.join(sim.out_dir, '2.ppm'))
+        max_density = max(np.amax(H), np.amax(P))
+        self.assertTrue(maxval >= np.ceil(max_density * PPM_SCALE))
+        self.assertTrue(np.array_equal(pixels[:, :, 0],
+                                       np.rint(P[1:-1, 1:-1] * PPM_SCALE)))
+        self.assertTrue(np.array_equal(pixels[:, :, 1],
+                                       np.rint(H[1:-1, 1:-1] * PPM_SCALE)))
+        self.assertTrue(np.all(pixels[:, :, 2] == 255))
+        shutil.rmtree(sim.out_dir)
+
+    def test_ppm_bands(self):
+        sim = Simulation(HarePopulation(env), PumaPopulation(env))
+        sim.num_steps = 2
+        sim.save_density_grid(0)
+        maxval, whole = read_ppm(os.path.join(sim.out_dir, '0.ppm'))
+        # pixels are written three rows at a time
+        for pop in sim.populations:
+            pop.tile_rows = 3
+        sim.save_density_grid(1)
+        self.assertTrue(np.array_equal(
+            read_ppm(os.path.join(sim.out_dir, '1.ppm'))[1], whole))
+        shutil.rmtree(sim.out_dir)
+
+    def test_high_densities(self):
+        hare = HarePopulation(env)
+        puma = PumaPopulation(env)
+        sim = Simulation(hare, puma)
+        sim.async_output = False
+        sim.num_steps = 2
+        # the scale is chosen before the first output and never changes
+        sim.ppm_scale = fixed_point_scale(1000 * puma.density.max())
+        self.assertTrue(sim.ppm_scale < PPM_SCALE)
+        with sim.output_writer() as writer:
+            writer.submit(0, [hare.density, puma.density])
+            # above the range of samples of the first output
+            puma.density *= 1000
+            writer.submit(1, [hare.density, puma.density])
+        sim.rescale_ppm_files(writer.max_density)
+        for name, factor in (('0.ppm', 1000.), ('1.ppm', 1.)):
+            maxval, pixels = read_ppm(os.path.join(sim.out_dir, name))
+            # densities relative to the highest one, up to rounding
+            for channel, density in ((0, puma.density / factor),
+                                     (1, hare.density)):
+                self.assertTrue(np.allclose(
+                    pixels[:, :, channel] / float(maxval),
+                    density[1:-1, 1:-1] / writer.max_density,
+                    atol=2. / maxval))
+        shutil.rmtree(sim.out_dir)
+
+    def test_clipped_densities(self):
+        hare = HarePopulation(env)
+        puma = PumaPopulation(env)
+        sim = Simulation(hare, puma)
+        sim.async_output = False
+        sim.num_steps = 1
+        puma.density[1, 1] = 1000
+        with sim.output_writer() as writer:
+            writer.submit(0, [hare.density, puma.density])
+        with mock.patch('pumha.sim.print', create=True) as printed:
+            sim.rescale_ppm_files(writer.max_density)
+        self.assertIn('clipped', printed.call_args[0][0])
+        maxval, pixels = read_ppm(os.path.join(sim.out_dir, '0.ppm'))
+        self.assertEqual(maxval, 65535)
+        self.assertEqual(pixels[0, 0, 0], 65535)
+        shutil.rmtree(sim.out_dir)
@@ -0,0 +1,150 @@
+from unittest import TestCase
+import os
+import shutil
+import tempfile
+import numpy as np
+from pumha.env import Landscape
+from pumha.pop import (PumaPopulation,
+                       HarePopulation)
+from pumha.state import PopulationState
+
+env = Landscape('pumha/data/map1.dat')
+
+
+class TestPopulationState(TestCase):
+    def test_swap_reuses_buffers(self):
+        puma = PumaPopulation(env)
+        hare = HarePopulation(env)
+        state = PopulationState([puma, hare])
+        first = puma.density
+        second = state.next(puma)
+        self.assertIsNot(first, second)
+        state.swap()
+        self.assertIs(puma.density, second)
+        self.assertIs(state.next(puma), first)
+        state.swap()
+        self.assertIs(puma.density, first)
+
+    def test_step_matches_separate_arrays(self):
+        puma = PumaPopulation(env)
+        hare = HarePopulation(env)
+        P = np.copy(puma.density)
+        H = np.copy(hare.density)
+        P_new = np.copy(P)
+        H_new = np.copy(H)
+        puma.advance(P, H, P_new)
+        hare.advance(P, H, H_new)
+
+        state = PopulationState([puma, hare])
+        P_cur = state.current(PumaPopulation)
+        H_cur = state.current(HarePopulation)
+        puma.advance(P_cur, H_cur, state.next(puma))
+        hare.advance(P_cur, H_cur, state.next(hare))
+        state.swap()
+        self.assertTrue(np.array_equal(puma.density, P_new))
+        self.assertTrue(np.array_equal(hare.density, H_new))
+
+    def test_fused_step_matches_separate_updates(self):
+        np.random.seed(3)
+        fused = [HarePopulation(env), PumaPopulation(env)]
+        np.random.seed(3)
+        separate = [HarePopulation(env, engine='loop'),
+                    PumaPopulation(env, engine='loop')]
+        fused_state = PopulationState(fused)
+        separate_state = PopulationState(separate)
+        self.assertEqual(fused_state.species, (1, 0))
+        self.assertTrue(fused_state.fused)
+        self.assertFalse(separate_state.fused)
+        for _ in range(3):
+            fused_state.step()
+            separate_state.step()
+        for pop, expected in zip(fused, separate):
+            self.assertTrue(np.array_equal(pop.density, expected.density))
+
+    def test_missing_population(self):
+        hare = HarePopulation(env)
+        state = PopulationState([hare])
+        P = state.current(PumaPopulation)
+        self.assertFalse(P.any())
+        self.assertEqual(P.shape, hare.density.shape)
+        state.swap()
+        self.assertIs(state.current(PumaPopulation), P)
+
+    def test_compact_matches_grid(self):
+        pops = []
+        for engine in ('vector', 'land'):
+            puma = PumaPopulation(env, engine=engine)
+            hare = HarePopulation(env, engine=engine)
+            pops.append((puma, hare))
+        pops[1][0].density = np.copy(pops[0][0].density)
+        pops[1][1].density = np.copy(pops[0][1].density)
+
+        for puma, hare in pops:
+            state = PopulationState([puma, hare])
+            for _ in range(5):
+                P = state.current(PumaPopulation)
+                H = state.current(HarePopulation)
+                puma.advance(P, H, state.next(puma))
+                hare.advance(P, H, state.next(hare))
+                state.swap()
+            state.sync()
+        self.assertTrue(state.compact)
+        self.assertTrue(np.array_equal(pops[0][0].density,
+                                       pops[1][0].density))
+        self.assertTrue(np.array_equal(pops[0][1].density,
+                                       pops[1][1].density))
+
+    def test_release(self):
+        puma = PumaPopulation(env, engine='land')
+        hare = HarePopulation(env, engine='land')
+        expected = np.copy(puma.density)
+        state = PopulationState([puma, hare])
+        state.release()
+        self.assertIsNone(puma.density)
+        # densities are kept in land vectors
+        state.sync()
+        self.assertTrue(np.array_equal(puma.density, expected))
+        state.step()
+        grid = puma.density
+        state.sync()
+        self.assertIs(puma.density, grid)
+        self.assertFalse(np.array_equal(puma.density, expected))
+
+    def test_mixed_engines(self):
+        puma = PumaPopulation(env, engine='vector')
+        hare = HarePopulation(env, engine='land')
+        with self.assertRaises(ValueError):
+            PopulationState([puma, hare])
+
+    def test_out_of_core_matches_in_memory(self):
+        scratch_dir = tempfile.mkdtemp()
+        try:
+            np.random.seed(11)
+            puma = PumaPopulation(env, engine='packed')
+            hare = HarePopulation(env, engine='packed')
+            np.random.seed(11)
+            ooc_puma = PumaPopulation(env, engine='packed',
+                                      scratch_dir=scratch_dir)
+            ooc_hare = HarePopulation(env, engine='packed',
+                                      scratch_dir=scratch_dir)
+            self.assertIsInstance(ooc_puma.density, np.memmap)
+            self.assertTrue(np.array_equal(ooc_puma.density, puma.density))
+            # scratch files are removed as soon as they are mapped
+            self.assertEqual(os.listdir(scratch_dir), [])
+
+            for pops in ((puma, hare), (ooc_puma, ooc_hare)):
+                for pop in pops:
+                    pop.tile_rows = 9
+                state = PopulationState(pops)
+                for _ in range(5):
+                    P = state.current(PumaPopulation)
+                    H = state.current(HarePopulation)
+                    pops[0].advance(P, H, state.next(pops[0]))
+                    pops[1].advance(P, H, state.next(pops[1]))
+                    state.swap()
+            self.assertIsInstance(ooc_puma.density, np.memmap)
+            self.assertIsInstance(state.next(ooc_hare), np.memmap)
+            self.assertTrue(np.array_equal(ooc_puma.density, puma.density))
+            self.assertTrue(np.array_equal(ooc_hare.density, hare.density))
+        finally:
+            shutil.rmtree(scratch_dir)
@@ -0,0 +1,89 @@
+from unittest import TestCase
+import os
+import shutil
+import tempfile
+import numpy as np
+from pumha.env import Landscape
+from pumha.pop import (PumaPopulation,
+                       HarePopulation)
+from pumha.sim import Simulation
+from pumha.store import SnapshotStore
+
+env = Landscape('pumha/data/map1.dat')
+
+
+class TestSnapshotStore(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmp_dir, 'densities.npz')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_append_read(self):
+        puma = PumaPopulation(env)
+        mask = puma._land_mask
+        with SnapshotStore(self.filename, 'w', mask, np.float64) as store:
+            for i in range(0, 30, 10):
+                store.append(i, 'PumaPopulation', puma.density * i)
+
+        with SnapshotStore(self.filename) as store:
+            self.assertEqual(store.species(), ['PumaPopulation'])
+            self.assertEqual(store.timesteps('PumaPopulation'), [0, 10, 20])
+            self.assertTrue(np.array_equal(store.mask, mask))
+            self.assertTrue(np.array_equal(store.read(10, 'PumaPopulation'),
+                                           puma.density * 10))
+            self.assertEqual(store.read_land(20, 'PumaPopulation').shape,
+                             (np.count_nonzero(mask),))
+            with self.assertRaises(KeyError):
+                store.read(5, 'PumaPopulation')
+
+        # readable with numpy
+        with np.load(self.filename) as npz:
+            self.assertTrue(np.array_equal(
+                npz['PumaPopulation/0000000010'], puma.density[mask] * 10))
+
+    def test_checkpoint(self):
+        puma = PumaPopulation(env)
+        store = SnapshotStore(self.filename, 'w', puma._land_mask)
+        store.append(0, 'PumaPopulation', puma.density)
+        index = store.checkpoint()
+        # complete archive at the checkpoint
+        with SnapshotStore(self.filename) as saved:
+            self.assertEqual(saved.timesteps('PumaPopulation'), [0])
+        store.append(10, 'PumaPopulation', puma.density * 10)
+        # an interrupted run leaves a store without index behind
+        crashed = os.path.join(self.tmp_dir, 'crashed.npz')
+        shutil.copy(self.filename, crashed)
+        store.close()
+
+        with SnapshotStore(crashed, 'a', index=index) as store:
+            self.assertEqual(store.timesteps('PumaPopulation'), [0])
+            store.append(10, 'PumaPopulation', puma.density * 2)
+        with SnapshotStore(crashed) as store:
+            self.assertEqual(store.timesteps('PumaPopulation'), [0, 10])
+            self.assertTrue(np.allclose(store.read(10, 'PumaPopulation'),
+                                        puma.density * 2))
+
+    def test_float32(self):
+        puma = PumaPopulation(env)
+        with SnapshotStore(self.filename, 'w', puma._land_mask) as store:
+            store.append(0, 'PumaPopulation', puma.density)
+        with SnapshotStore(self.filename) as store:
+            density = store.read(0, 'PumaPopulation')
+        self.assertEqual(density.dtype, np.float32)
+        self.assertTrue(np.allclose(density, puma.density, rtol=1e-6))
+
+    def test_simulation_store(self):
+        hare = HarePopulation(env)
+        puma = PumaPopulation(env)
+        sim = Simulation(hare, puma)
+        sim.snapshot_dtype = 'float64'
+        sim.run(5, 2)
+        with SnapshotStore(os.path.join(sim.out_dir, 'densities.npz')) as st:
+            self.assertEqual(st.species(), ['HarePopulation',
+                                            'PumaPopulation'])
+            self.assertEqual(st.timesteps('HarePopulation'), [0, 2, 4])
+            self.assertTrue(np.array_equal(st.read(4, 'HarePopulation'),
+                                           hare.density))
+        shutil.rmtree(sim.out_dir)
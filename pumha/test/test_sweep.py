@@ -0,0 +1,114 @@
+from unittest import TestCase
+import os
+import shutil
+import tempfile
+import multiprocessing
+from unittest import mock
+import numpy as np
+from pumha.env import Landscape
+from pumha.pop import (PumaPopulation,
+                       HarePopulation)
+from pumha.state import PopulationState
+from pumha.sweep import sweep_points, run_sweep, RESULTS_FILE
+
+env = Landscape('pumha/data/islands2.dat')
+spec = {"Base": {"Steps": 5},
+        "Sweep": {"Hare_birth": [0.06, 0.1],
+                  "Puma_birth": {"Start": 0.01, "Stop": 0.03, "Num": 3}}}
+
+
+class TestSweep(TestCase):
+    def setUp(self):
+        self.out_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.out_dir)
+
+    def test_sweep_points(self):
+        keys, points = sweep_points(spec)
+        self.assertEqual(keys, ['Hare_birth', 'Puma_birth'])
+        self.assertEqual(len(points), 6)
+        # the last key changes fastest, other keys take the base values
+        self.assertEqual(points[1]['Hare_birth'], 0.06)
+        self.assertAlmostEqual(points[1]['Puma_birth'], 0.02)
+        self.assertEqual(points[4]['Hare_birth'], 0.1)
+        self.assertEqual(points[4]['Steps'], 5)
+        self.assertEqual(points[4]['Hare_diffusion'], 0.2)
+
+    def test_invalid_sweeps(self):
+        for bad in ({"Sweep": {"Hare_brith": [0.1]}},
+                    {"Sweep": {"Engine": ["vector", "loop"]}},
+                    {"Sweep": {"Hare_birth": []}},
+                    {"Sweep": {"Hare_birth": ["fast"]}},
+                    {"Base": {"Ensemble": 4}}):
+            with self.assertRaises(ValueError):
+                sweep_points(bad)
+
+    def test_run_sweep(self):
+        filename = run_sweep(env, spec, self.out_dir, processes=2)
+        self.assertEqual(filename, os.path.join(self.out_dir, RESULTS_FILE))
+        table = np.loadtxt(filename)
+        self.assertEqual(table.shape, (6, 5))
+        self.assertTrue(np.array_equal(table[:, 0], np.arange(6)))
+
+        # a run matches a single simulation seeded with its index
+        point = sweep_points(spec)[1][4]
+        np.random.seed(4)
+        puma = PumaPopulation(env, birth=point['Puma_birth'])
+        hare = HarePopulation(env, birth=point['Hare_birth'])
+        state = PopulationState([puma, hare])
+        for _ in range(5):
+            state.step()
+        squares = (env.shape[0] - 2) * (env.shape[1] - 2)
+        self.assertEqual(table[4, 3], hare.density.sum() / squares)
+        self.assertEqual(table[4, 4], puma.density.sum() / squares)
+
+    def test_workers_without_fork(self):
+        filename = run_sweep(env, spec, self.out_dir, processes=1)
+        forked = np.loadtxt(filename)
+        os.remove(filename)
+
+        spawn = multiprocessing.get_context('spawn')
+
+        def get_context(method=None):
+            if method == 'fork':
+                raise ValueError("cannot find context for 'fork'")
+            return spawn
+        # workers load the landscape from its file
+        with mock.patch('pumha.sweep.multiprocessing.get_context',
+                        get_context):
+            run_sweep(env, spec, self.out_dir, processes=2)
+        self.assertTrue(np.array_equal(np.loadtxt(filename), forked))
+
+    def test_batched_sweep(self):
+        filename = run_sweep(env, spec, self.out_dir, processes=1)
+        single = np.loadtxt(filename)
+        os.remove(filename)
+        # runs advanced together match runs advanced one by one exactly
+        run_sweep(env, spec, self.out_dir, processes=2, batch_size=4)
+        self.assertTrue(np.array_equal(np.loadtxt(filename), single))
+
+        # runs of a seeded sweep all start from the same densities
+        seeded = {"Base": dict(spec["Base"], Seed=11), "Sweep": spec["Sweep"]}
+        os.remove(filename)
+        run_sweep(env, seeded, self.out_dir, processes=1)
+        single = np.loadtxt(filename)
+        os.remove(filename)
+        run_sweep(env, seeded, self.out_dir, processes=1, batch_size=4)
+        self.assertTrue(np.array_equal(np.loadtxt(filename), single))
+
+    def test_resume(self):
+        filename = run_sweep(env, spec, self.out_dir, processes=1)
+        with open(filename, 'r') as f:
+            lines = f.readlines()
+        # an interrupted sweep, which completed runs out of order
+        with open(filename, 'w') as f:
+            f.writelines([lines[0], lines[3], lines[1]])
+        run_sweep(env, spec, self.out_dir, processes=1)
+        with open(filename, 'r') as f:
+            self.assertEqual(f.readlines(), lines)
+
+        # results of another sweep are not mixed with this one
+        other = {"Base": {"Steps": 5}, "Sweep": {"Hare_birth": [0.2]}}
+        with self.assertRaises(ValueError):
+            run_sweep(env, other, self.out_dir, processes=1)
@@ -0,0 +1,81 @@
+from unittest import TestCase
+import os
+import shutil
+import tempfile
+import numpy as np
+from pumha.env import Landscape
+from pumha.pop import (PumaPopulation,
+                       HarePopulation)
+from pumha.sim import Simulation
+from pumha.state import PopulationState
+from pumha.tiled import TiledState
+
+env = Landscape('pumha/data/map1.dat')
+
+
+def make_simulation(tmp_dir, *pops):
+    """Return a simulation writing to its own directory in tmp_dir."""
+    sim = Simulation(*pops)
+    # output directories are named by seconds, so they may be shared
+    if not os.listdir(sim.out_dir):
+        os.rmdir(sim.out_dir)
+    sim.out_dir = tempfile.mkdtemp(dir=tmp_dir)
+    return sim
+
+
+def make_populations(engine):
+    np.random.seed(6)
+    return [PumaPopulation(env, engine=engine),
+            HarePopulation(env, engine=engine)]
+
+
+class TestTiledState(TestCase):
+    def test_matches_serial(self):
+        serial = make_populations('vector')
+        state = PopulationState(serial)
+        tiled = make_populations('tiled')
+        # tiles which do not divide the grid and a pass cut short by sync
+        tiled_state = TiledState(tiled, depth=4, tile_shape=(7, 13))
+        for _ in range(10):
+            state.step()
+            tiled_state.step()
+        tiled_state.sync()
+        for pop, expected in zip(tiled, serial):
+            self.assertTrue(np.array_equal(pop.density, expected.density))
+
+    def test_pending_steps(self):
+        tiled = make_populations('tiled')
+        initial = [np.copy(pop.density) for pop in tiled]
+        state = TiledState(tiled, depth=3)
+        state.step()
+        state.step()
+        for pop, density in zip(tiled, initial):
+            self.assertTrue(np.array_equal(pop.density, density))
+        state.step()
+        self.assertFalse(np.array_equal(tiled[0].density, initial[0]))
+
+    def test_missing_population(self):
+        np.random.seed(6)
+        serial = HarePopulation(env)
+        np.random.seed(6)
+        hare = HarePopulation(env, engine='tiled')
+        state = PopulationState([serial])
+        tiled_state = TiledState([hare], depth=5, tile_shape=(16, 16))
+        for _ in range(5):
+            state.step()
+            tiled_state.step()
+        self.assertTrue(np.array_equal(hare.density, serial.density))
+
+    def test_simulation_run(self):
+        tmp_dir = tempfile.mkdtemp()
+        serial = make_simulation(tmp_dir, *make_populations('vector'))
+        serial.run(7, 3)
+        tiled = make_simulation(tmp_dir, *make_populations('tiled'))
+        tiled.run(7, 3)
+        for pop, expected in zip(tiled.populations, serial.populations):
+            self.assertTrue(np.array_equal(pop.density, expected.density))
+        shutil.rmtree(tmp_dir)
+
+    def test_compact_engine(self):
+        with self.assertRaises(ValueError):
+            TiledState([PumaPopulation(env, engine='land')])
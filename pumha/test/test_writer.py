@@ -0,0 +1,67 @@
+from unittest import TestCase
+import os
+import shutil
+import numpy as np
+from pumha.env import Landscape
+from pumha.pop import (PumaPopulation,
+                       HarePopulation)
+from pumha.sim import Simulation
+from pumha.writer import OutputWriter
+
+env = Landscape('pumha/test/data/test_land.dat')
+hare = HarePopulation(env)
+puma = PumaPopulation(env)
+
+
+def read_outputs(out_dir):
+    outputs = {}
+    for name in os.listdir(out_dir):
+        with open(os.path.join(out_dir, name), 'rb') as f:
+            outputs[name] = f.read()
+    return outputs
+
+
+class TestOutputWriter(TestCase):
+    def test_threaded_matches_synchronous(self):
+        outputs = []
+        for threaded in (True, False):
+            sim = Simulation(hare, puma)
+            with OutputWriter(sim, threaded=threaded) as writer:
+                for i in range(5):
+                    writer.submit(i, [hare.density * i, puma.density])
+            self.assertAlmostEqual(writer.max_density,
+                                   max(np.amax(hare.density) * 4,
+                                       np.amax(puma.density)))
+            outputs.append(read_outputs(sim.out_dir))
+            shutil.rmtree(sim.out_dir)
+        self.assertEqual(len(outputs[0]), 6)
+        self.assertEqual(outputs[0], outputs[1])
+
+    def test_snapshot_is_copied(self):
+        sim = Simulation(hare, puma)
+        density = np.copy(hare.density)
+        with OutputWriter(sim) as writer:
+            writer.submit(0, [density, puma.density])
+            density[...] = 0.
+        sim.save_average_density(1, [np.copy(hare.density), puma.density])
+        with open(os.path.join(sim.out_dir, 'average_densities.dat')) as f:
+            lines = f.readlines()
+        self.assertEqual(lines[0].split()[1:], lines[1].split()[1:])
+        shutil.rmtree(sim.out_dir)
+
+    def test_bounded_queue(self):
+        sim = Simulation(hare, puma)
+        snapshot_bytes = hare.density.nbytes + puma.density.nbytes
+        writer = OutputWriter(sim, max_queued_bytes=3 * snapshot_bytes)
+        writer.submit(0, [hare.density, puma.density])
+        self.assertEqual(writer._queue.maxsize, 3)
+        writer.close()
+        shutil.rmtree(sim.out_dir)
+
+    def test_error_is_raised(self):
+        sim = Simulation(hare, puma)
+        writer = OutputWriter(sim)
+        shutil.rmtree(sim.out_dir)
+        writer.submit(0, [hare.density, puma.density])
+        with self.assertRaises(IOError):
+            writer.close()
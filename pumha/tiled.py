@@ -0,0 +1,152 @@
+"""Tiled module.
+
+The module contains one class::
+
+    TiledState
+
+The TiledState class is a drop-in replacement of pumha.state.PopulationState
+which advances all populations several time steps at a time in small tiles
+of the grid. A tile is copied together with a halo as wide as the number of
+steps into a workspace small enough to stay in the cache, advanced there
+step by step and its interior written back, so the whole grid streams
+through memory once every few steps instead of once per species per step.
+"""
+
+from __future__ import (absolute_import,
+                        division,
+                        print_function,
+                        unicode_literals)
+import numpy as np
+from pumha.pop import DEFAULT_TILE_SHAPE, DEFAULT_TILE_STEPS
+from pumha.state import PopulationState
+
+
+class TiledState(PopulationState):
+    """Double buffered densities advanced several steps at a time in tiles.
+
+    Steps are counted by step() and made in a single pass over the grid
+    once depth steps are pending, or when sync() is called, e.g. by the
+    output methods of pumha.sim.Simulation. In a pass the interior of the
+    grid is split into tiles of tile_shape squares. Every tile is copied
+    with a halo of one square per pending step into the workspace, and
+    each step updates a region one square narrower on every side than the
+    step before (a trapezoid in time), so after the last step the tile
+    itself holds exact densities and is written to the next buffers.
+    Squares of the halo are updated by neighbouring tiles as well, which
+    is the price of reading the grid only once per pass.
+
+    Windows are updated with Population.advance_window(), the expression
+    of the vector engine, so results match the vector engine bit for bit
+    for any depth and tile shape.
+
+    Between passes current() and next() return densities at the end of
+    the last pass and at its start, so a convergence monitor needs depth
+    1. Only grid engines are supported.
+
+    :Example:
+
+        >>> state = TiledState([puma, hare], depth=8)
+        >>> for i in range(num_steps):
+        ...     state.step()
+        >>> state.sync()
+
+    :ivar depth: maximum number of steps made in one pass
+    :vartype depth: int
+    :ivar tile_shape: rows and columns of a tile
+    :vartype tile_shape: (int, int)
+    :raises ValueError: if populations use a compact engine
+    """
+
+    def __init__(self, populations, depth=DEFAULT_TILE_STEPS,
+                 tile_shape=DEFAULT_TILE_SHAPE, species=None):
+        super(TiledState, self).__init__(populations, species)
+        if self.compact:
+            raise ValueError("Tiled simulation works on grids, not with "
+                             "the %s engine" % self.populations[0].engine)
+        self.depth = depth
+        self.tile_shape = tuple(tile_shape)
+        self._pending = 0
+        self._workspace = None
+
+    def step(self):
+        """Count one more time step, making a pass if depth steps are due."""
+        self._pending += 1
+        if self._pending >= self.depth:
+            self._flush()
+
+    def sync(self):
+        """Make pending steps, so population densities are up to date."""
+        self._flush()
+        super(TiledState, self).sync()
+
+    def _flush(self):
+        """Advance all tiles by the pending steps and swap the buffers."""
+        steps = self._pending
+        if not steps or not self.populations:
+            return
+        rows, cols = self._current[0].shape
+        tile_rows, tile_cols = self.tile_shape
+        shape = (2, len(self.populations) + 1,
+                 min(tile_rows + 2 * steps, rows),
+                 min(tile_cols + 2 * steps, cols))
+        if (self._workspace is None or
+                any(np.less(self._workspace.shape, shape))):
+            self._workspace = np.zeros(shape)
+        for top in range(1, rows - 1, tile_rows):
+            for left in range(1, cols - 1, tile_cols):
+                self._advance_tile(steps, top, min(top + tile_rows, rows - 1),
+                                   left, min(left + tile_cols, cols - 1))
+        self._pending = 0
+        self.swap()
+
+    def _advance_tile(self, steps, top, bottom, left, right):
+        """Advance one tile of the current buffers into the next buffers.
+
+        :param steps: number of steps to make
+        :type steps: int
+        :param top: first row of the tile
+        :type top: int
+        :param bottom: row after the last row of the tile
+        :type bottom: int
+        :param left: first column of the tile
+        :type left: int
+        :param right: column after the last column of the tile
+        :type right: int
+        """
+        rows, cols = self._current[0].shape
+        num_pops = len(self.populations)
+        # the tile with its halo, which stops at the edge of the grid
+        r0, r1 = max(top - steps, 0), min(bottom + steps, rows)
+        c0, c1 = max(left - steps, 0), min(right + steps, cols)
+        work = self._workspace[:, :, :r1 - r0, :c1 - c0]
+        for index, grid in enumerate(self._current):
+            work[0, index] = grid[r0:r1, c0:c1]
+        work[:, num_pops] = 0.
+        # both buffers hold the edge of the grid and the water squares
+        work[1] = work[0]
+        first = self.populations[0]
+        N = first._N[r0:r1, c0:c1]
+        mask = first._land_mask[r0:r1, c0:c1]
+        # the last population index of the workspace holds zeros standing
+        # for a missing species
+        species = self.species
+
+        current = 0
+        for step in range(1, steps + 1):
+            # squares still exact after this step, with halos of one square
+            margin = steps - step
+            window = (slice(max(top - margin, 1) - 1 - r0,
+                            min(bottom + margin, rows - 1) + 1 - r0),
+                      slice(max(left - margin, 1) - 1 - c0,
+                            min(right + margin, cols - 1) + 1 - c0))
+            P = work[current, species[0]][window]
+            H = work[current, species[1]][window]
+            for index, pop in enumerate(self.populations):
+                pop.advance_window(P, H, work[1 - current, index][window],
+                                   N[window], mask[window])
+            current = 1 - current
+
+        for index, grid in enumerate(self._next):
+            grid[top:bottom, left:right] = work[current, index,
+                                                top - r0:bottom - r0,
+                                                left - c0:right - c0]
@@ -0,0 +1,159 @@
+"""Output writer module.
+
+The module contains one class::
+
+    OutputWriter
+
+The OutputWriter takes snapshots of population densities from the
+simulation loop and writes the simulation output (PPM files and average
+densities) in a background thread, so the simulation can continue with
+the next steps while the output is being written.
+"""
+
+from __future__ import (absolute_import,
+                        division,
+                        print_function,
+                        unicode_literals)
+import os
+import threading
+import numpy as np
+try:
+    import queue
+except ImportError:  # python 2
+    import Queue as queue
+
+# default limit of memory held by queued snapshots, in bytes
+DEFAULT_MAX_QUEUED_BYTES = 256 * 1024 ** 2
+
+
+class OutputWriter(object):
+    """Write simulation output in a background thread.
+
+    Every submitted snapshot is a copy of density arrays, which is put on
+    a bounded queue and written by a writer thread using output methods of
+    the simulation. The size of the queue is chosen so the queued snapshots
+    take at most max_queued_bytes of memory (but at least one snapshot is
+    queued). When the queue is full, submit() waits until the writer thread
+    catches up. Without the thread snapshots are written right away and
+    are not copied. The file with average densities is opened once and kept
+    open until the writer is closed. If a snapshot store is given, every
+    snapshot is also appended to it and the store is closed together with
+    the writer.
+
+    If writing an output fails, the error is raised by the next call of
+    submit() or by close(). close() always waits until all queued
+    snapshots are written, so the writer is best used as a context manager.
+
+    :Example:
+
+        >>> with OutputWriter(sim) as writer:
+        ...     for i in range(num_steps):
+        ...         sim.update(state)
+        ...         writer.submit(i, [p.density for p in sim.populations])
+        >>> sim.rescale_ppm_files(writer.max_density)
+
+    :ivar simulation: simulation providing output methods
+    :vartype simulation: pumha.sim.Simulation
+    :ivar threaded: write in a background thread if True, otherwise \
+            write in submit()
+    :vartype threaded: bool
+    :ivar store: optional store of density frames
+    :vartype store: pumha.store.SnapshotStore
+    :ivar max_density: the highest density written so far, including \
+            densities written before a simulation was resumed
+    :vartype max_density: float
+    """
+
+    def __init__(self, simulation, max_queued_bytes=DEFAULT_MAX_QUEUED_BYTES,
+                 threaded=True, store=None, max_density=0):
+        self.simulation = simulation
+        self.store = store
+        self.max_queued_bytes = max_queued_bytes
+        self.threaded = threaded
+        self.max_density = max_density
+        self._error = None
+        self._queue = None
+        self._thread = None
+        self._average_file = open(
+            os.path.join(simulation.out_dir, 'average_densities.dat'), 'a+')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def submit(self, timestep, densities):
+        """Copy densities and queue them for writing.
+
+        :param timestep: the timestep to which the densities correspond to
+        :type timestep: int
+        :param densities: density arrays in the order of populations \
+                of the simulation
+        :type densities: list of numpy.ndarray
+        """
+        self._raise_error()
+        if not self.threaded:
+            # written right away, so no copy is needed
+            self._write(timestep, list(densities))
+            return
+        snapshot = [np.copy(density) for density in densities]
+        if self._thread is None:
+            snapshot_bytes = max(1, sum(d.nbytes for d in snapshot))
+            maxsize = max(1, self.max_queued_bytes // snapshot_bytes)
+            self._queue = queue.Queue(maxsize)
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+        self._queue.put((timestep, snapshot))
+
+    def flush(self):
+        """Wait for all queued output to be written and flush files."""
+        if self._thread is not None:
+            self._queue.join()
+        self._average_file.flush()
+        self._raise_error()
+
+    def close(self):
+        """Wait for all queued output to be written and close files."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        if not self._average_file.closed:
+            self._average_file.close()
+        if self.store is not None:
+            self.store.close()
+        self._raise_error()
+
+    def _run(self):
+        """Write queued snapshots until None is received."""
+        while True:
+            job = self._queue.get()
+            if job is None:
+                self._queue.task_done()
+                return
+            # after an error keep draining the queue, so submit() never blocks
+            if self._error is None:
+                try:
+                    self._write(*job)
+                except Exception as e:
+                    self._error = e
+            self._queue.task_done()
+
+    def _write(self, timestep, snapshot):
+        """Write output of one snapshot."""
+        self.simulation.save_density_grid_interface(timestep, snapshot)
+        self.simulation.save_average_density(timestep, snapshot,
+                                             self._average_file)
+        if self.store is not None:
+            for pop, density in zip(self.simulation.populations, snapshot):
+                self.store.append(timestep, pop.kind, density)
+        for density in snapshot:
+            self.max_density = max(self.max_density, np.amax(density))
+
+    def _raise_error(self):
+        """Raise an error from the writer thread, if there was one."""
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
@@ -18,13 +18,16 @@ setup(
     license='MIT',
     packages=find_packages(),
     classifiers=[
-        'Programming Language :: Python :: 2.7',
         'Programming Language :: Python :: 3',
+        'Programming Language :: Python :: 3 :: Only',
+        'Programming Language :: Python :: 3.8',
         'License :: OSI Approved :: MIT License'
     ],
     include_package_data=True,
+    # multiprocessing.shared_memory of parallel updates is new in 3.8
+    python_requires='>=3.8',
     install_requires=[
-        'numpy>=1.9.2',
+        'numpy>=1.17',
         'simplejson>=3.8.1',
         'scipy>=0.14.1',
         'tqdm>=4.19.4',